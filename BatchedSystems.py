@@ -0,0 +1,176 @@
+# Many independent systems advanced together
+# Usage: python BatchedSystems.py [number of systems] [years]
+#
+# Runs that many Earth-Mars variants (as in EarthMarsSimulation.py, with randomly perturbed initial velocities) once as
+# a batch and a few of them one at a time, and prints the throughput of both in system-steps per second.
+
+import sys
+import time
+import numpy as np
+from NBodyEngine import G, NBodySystem, secondsPerDay, daysPerYear
+
+# Batched systems -----------------------------------------------------------------------------------------------------
+# A small system such as Sun-Earth-Mars spends almost all of its time in the Python overhead of each step, however the
+# per-body maths is written. Stacking M independent systems of the same N bodies into (M,N,3) arrays spreads that
+# overhead over all of them: one step of the batch is the same handful of array operations as one step of a single
+# system. Every system keeps its own masses, positions and velocities; they never feel each other.
+#
+# The class has the same attributes and methods as NBodySystem (position, velocity, t, forceModel, acceleration(),
+# kick(), drift(), step(), run()), so the integrators of Integrators.py that only use those (euler, leapfrog, yoshida4
+# and rkf45) work on a batch unchanged; Wisdom-Holman works on one system's (N,3) arrays and is turned down (see
+# checkIntegrator()). rkf45
+# then picks one step length for the whole batch. The arithmetic is always plain double precision (the engine's
+# 'float64' precision). Each system's sun is body 0, and with
+# the 'sun' force model the arithmetic is the engine's, so a system gives the same numbers batched or on its own.
+batchedIntegrators = ('euler', 'leapfrog', 'yoshida4', 'rkf45')
+
+# Turning down an integrator (or integrator name) that cannot advance a batch, before any work is done
+def checkIntegrator(integrator):
+    name = integrator if isinstance(integrator, str) else getattr(integrator, 'name', None)
+    if integrator is not None and name not in batchedIntegrators:
+        raise ValueError("The %s integrator is not supported for batched systems, only %s"
+                         % (name, ', '.join(batchedIntegrators)))
+
+class BatchedSystem:
+    def __init__(self, names, mass, position, velocity, t=0.0, forceModel='sun', softening=0.0):
+        self.names      = list(names)
+        self.position   = np.array(position, dtype=np.float64)                    # [m]     shape (M,N,3)
+        self.velocity   = np.array(velocity, dtype=np.float64)                    # [m/s]   shape (M,N,3)
+        self.mass       = np.broadcast_to(np.array(mass, dtype=np.float64), self.position.shape[:2]).copy()   # [kg]
+        self.t          = float(t)                                                # [s]
+        self.forceModel = forceModel
+        self.theta      = 0.0
+        self.softening  = softening                                               # [m]
+        if forceModel not in ('sun', 'direct'):
+            raise ValueError("Batched systems support the 'sun' and 'direct' force models, not '%s'" % forceModel)
+
+        massive = self.mass[:, 1:] > 0
+        self._unitMass = np.where(massive, self.mass[:, 1:], 1.0)
+        self._gravConst = G*self._unitMass*self.mass[:, :1]
+        self._reaction = massive.astype(np.float64)[:, :, None]
+
+    # Stacking single systems (same bodies, same force model) into one batch
+    @classmethod
+    def fromSystems(cls, systems):
+        first = systems[0]
+        if any(system.n != first.n or system.forceModel != first.forceModel for system in systems):
+            raise ValueError('every system of a batch needs the same number of bodies and the same force model')
+        return cls(first.names, [system.mass for system in systems], [system.position for system in systems],
+                   [system.velocity for system in systems], first.t, first.forceModel, first.softening)
+
+    @property
+    def m(self):
+        return self.position.shape[0]
+
+    @property
+    def n(self):
+        return self.position.shape[1]
+
+    # One system of the batch as an NBodySystem (a copy)
+    def member(self, k):
+        return NBodySystem(self.names, self.mass[k], self.position[k], self.velocity[k], self.t, self.forceModel,
+                           softening=self.softening)
+
+    # Force on every body of every system from its sun [kg*m*s^(-2)] (per unit mass for test particles)
+    def sunForce(self):
+        distance = self.position[:, 1:] - self.position[:, :1]                    # [m]     shape (M,N-1,3)
+        modulus = distance[..., 0]**2 + distance[..., 1]**2 + distance[..., 2]**2
+        modulus *= np.sqrt(modulus)                                               # [m^3]
+        return distance * (-self._gravConst/modulus)[..., None]
+
+    # Acceleration of every body of every system [m*s^(-2)]
+    def acceleration(self):
+        if self.forceModel == 'sun':
+            force = self.sunForce()
+            acceleration = np.empty_like(self.position)
+            acceleration[:, 1:] = force/self._unitMass[..., None]
+            acceleration[:, 0] = -np.add.reduce(force*self._reaction, axis=1)/self.mass[:, :1]
+            return acceleration
+        # All pairs within each system (N is small, so the (M,N,N,3) distances fit in memory)
+        distance = self.position[:, None, :, :] - self.position[:, :, None, :]
+        modulus = np.einsum('mijk,mijk->mij', distance, distance) + self.softening**2
+        modulus *= np.sqrt(modulus)
+        with np.errstate(divide='ignore'):
+            weight = np.where(modulus > 0, G*self.mass[:, None, :]/modulus, 0.0)
+        return np.einsum('mij,mijk->mik', weight, distance)
+
+    # Changing every velocity by dv [m/s] and moving every body along its velocity for h [s], as NBodySystem does in
+    # 'float64' precision
+    def kick(self, dv):
+        self.velocity += dv
+
+    def drift(self, h):
+        self.position += h*self.velocity
+
+    # The semi-implicit Euler step of NBodySystem.step(), for every system at once
+    def step(self, dt):
+        if self.forceModel != 'sun':
+            self.velocity += dt*self.acceleration()
+            self.position += dt*self.velocity
+            self.t += dt
+            return
+
+        force = self.sunForce()
+        self.velocity[:, 1:] += (dt/self._unitMass)[..., None]*force
+        self.position[:, 1:] += dt*self.velocity[:, 1:]
+        forceSun = np.add.reduce(force*self._reaction, axis=1)
+        self.velocity[:, 0] += (-dt/self.mass[:, :1])*forceSun
+        self.position[:, 0] += dt*self.velocity[:, 0]
+        self.t += dt
+
+    def run(self, nSteps, dt, recorder=None, integrator=None):
+        checkIntegrator(integrator)
+        for k in range(nSteps):
+            if integrator is None:
+                self.step(dt)
+            else:
+                integrator.step(self, dt)
+            if recorder is not None:
+                recorder.record(self.t, self.position, self.velocity)
+        return recorder
+
+# Running the same list of systems either one at a time or as one batch, returning the final systems and the
+# throughput in system-steps per second
+def runSystems(systems, nSteps, dt, makeIntegrator=None, batched=True):
+    start = time.perf_counter()
+    if batched:
+        integrator = None if makeIntegrator is None else makeIntegrator()
+        checkIntegrator(integrator)
+        batch = BatchedSystem.fromSystems(systems)
+        batch.run(nSteps, dt, integrator=integrator)
+        finals = [batch.member(k) for k in range(batch.m)]
+    else:
+        finals = []
+        for system in systems:
+            system = system.copy()
+            system.run(nSteps, dt, integrator=None if makeIntegrator is None else makeIntegrator())
+            finals.append(system)
+    return finals, len(systems)*nSteps/(time.perf_counter() - start)
+# ---------------------------------------------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    from BodyCatalog import loadCatalog
+
+    nSystems = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    years = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+    dt = secondsPerDay
+    nSteps = int(np.ceil(years*daysPerYear*secondsPerDay/dt))
+
+    # Earth-Mars variants whose initial velocities are perturbed by up to 1%
+    base = loadCatalog().system(['earth', 'mars'])
+    rng = np.random.default_rng(0)
+    systems = []
+    for k in range(nSystems):
+        system = base.copy()
+        system.velocity[1:] *= 1 + rng.uniform(-0.01, 0.01, (system.n - 1, 1))
+        systems.append(system)
+
+    batchedFinals, batchedRate = runSystems(systems, nSteps, dt, batched=True)
+    sample = systems[:max(1, min(nSystems, 200))]
+    singleFinals, singleRate = runSystems(sample, nSteps, dt, batched=False)
+    identical = all(np.array_equal(a.position, b.position) for a, b in zip(batchedFinals, singleFinals))
+
+    print('%d systems x %d steps' % (nSystems, nSteps))
+    print('one at a time: %12.0f system-steps/s' % singleRate)
+    print('batched:       %12.0f system-steps/s  (%.0fx)' % (batchedRate, batchedRate/singleRate))
+    print('batched results identical to single runs: %s' % identical)
@@ -0,0 +1,51 @@
+# Benchmark of the two force kernels in GravityKernels.py
+# Usage: python BenchmarkGravity.py [largest number of bodies]
+#
+# For a range of body counts this times one force evaluation with the direct all-pairs kernel and with the Barnes-Hut
+# tree, reports the median relative error of the tree against the direct sum, and prints the body count at which the
+# tree becomes the faster of the two (the value used for autoCrossover in GravityKernels.py).
+
+import sys
+import time
+import numpy as np
+from GravityKernels import directAcceleration, Octree
+
+# Settings ------------------------------------------------------------------------------------------------------------
+theta       = 0.5                                   # Barnes-Hut opening angle
+largest     = int(sys.argv[1]) if len(sys.argv) > 1 else 16000
+bodyCounts  = [n for n in (250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000) if n <= largest]
+# ---------------------------------------------------------------------------------------------------------------------
+
+# An asteroid belt: bodies spread between 2.1 and 3.3 AU in a thin disc, with asteroid-like masses [m], [kg]
+def asteroidBelt(n, rng):
+    radius = rng.uniform(3.1e11, 4.9e11, n)
+    angle = rng.uniform(0, 2*np.pi, n)
+    height = rng.normal(0, 1e10, n)
+    position = np.column_stack([radius*np.cos(angle), radius*np.sin(angle), height])
+    return position, rng.uniform(1e15, 1e20, n)
+
+# Best of a few repeats, in seconds
+def timeIt(function, repeats=3):
+    best = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter()-start)
+    return best, result
+
+rng = np.random.default_rng(0)
+crossover = None
+print('%8s %12s %12s %12s' % ('bodies', 'direct [s]', 'tree [s]', 'tree error'))
+for n in bodyCounts:
+    position, mass = asteroidBelt(n, rng)
+    directTime, direct = timeIt(lambda: directAcceleration(position, position, mass))
+    treeTime, tree = timeIt(lambda: Octree(position, mass).acceleration(position, theta))
+    error = np.median(np.linalg.norm(tree-direct, axis=1)/np.linalg.norm(direct, axis=1))
+    print('%8d %12.4g %12.4g %12.2e' % (n, directTime, treeTime, error))
+    if crossover is None and treeTime < directTime:
+        crossover = n
+
+if crossover is None:
+    print('The direct kernel was faster at every body count tried')
+else:
+    print('The Barnes-Hut tree is faster from about %d bodies (theta = %g)' % (crossover, theta))
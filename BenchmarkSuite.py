@@ -0,0 +1,273 @@
+# Benchmarks of the whole engine: throughput, memory and energy error, per scenario and integrator
+# Usage: python BenchmarkSuite.py [--output results.json] [--compare previous.json]
+#        python BenchmarkSuite.py --setups earthMars,solarSystem --years 1,100 --engines original,euler,wisdomHolman
+#        python BenchmarkSuite.py --quick
+#
+# A scenario is a setup (the bodies) run for a span of years with one engine:
+#   setups   earthMars (EarthMarsSimulation.py), solarSystem (the ten bodies of SolarSystemSimulation.py), and
+#            particles1k/particles10k/particles100k (the ten bodies plus that many massless asteroids)
+#   spans    1, 100 and 1000 years, with daily steps unless --dt says otherwise
+#   engines  original (the dictionary and list loop the simulations started with, as the baseline), any integrator
+#            of Integrators.py on NBodySystem, the same with the compiled kernels of JitKernels.py (euler.jit,
+#            leapfrog.jit, ...), and hybrid (HybridPropagation.py)
+# Every scenario runs in a fresh Python process, so that its peak memory is its own. It first times a few steps and
+# is skipped (with the estimate) when the whole span would take longer than --max-seconds.
+#
+# For every scenario the results hold the steps per second (and body-steps per second), the peak resident memory of
+# the process, the largest amount of temporary memory one step allocates (from tracemalloc, in a separate pass so
+# the timing is not disturbed), and the relative energy error at the end. They are written as JSON together with the
+# commit, Python and NumPy versions, so that runs on different commits can be compared with --compare.
+
+import argparse
+import json
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+from NBodyEngine import G, secondsPerDay, daysPerYear
+from Integrators import integrators, makeIntegrator
+from Diagnostics import totalEnergy
+
+# Settings ------------------------------------------------------------------------------------------------------------
+setups          = ['earthMars', 'solarSystem', 'particles1k', 'particles10k', 'particles100k']
+spans           = [1, 100, 1000]                                            # [years]
+defaultEngines  = ['original', 'euler', 'euler.jit', 'leapfrog', 'wisdomHolman', 'hybrid']
+maxSeconds      = 30.0                              # Longest a single scenario may run before it is skipped [s]
+calibration     = 0.2                               # Time spent estimating how long a scenario would take [s]
+allocationSteps = 5                                 # Steps measured with tracemalloc
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Setups --------------------------------------------------------------------------------------------------------------
+# Massless asteroids on circular orbits between 2.1 and 3.3 AU, in a thin disc [m], [m/s]
+def asteroidBelt(n, rng, massSun):
+    radius = rng.uniform(3.1e11, 4.9e11, n)
+    angle = rng.uniform(0, 2*np.pi, n)
+    position = np.column_stack([radius*np.cos(angle), radius*np.sin(angle), rng.normal(0, 1e10, n)])
+    speed = np.sqrt(G*massSun/radius)
+    velocity = np.column_stack([-speed*np.sin(angle), speed*np.cos(angle), np.zeros(n)])
+    return position, velocity
+
+def makeSetup(name):
+    from BodyCatalog import loadCatalog
+
+    catalog = loadCatalog()
+    if name == 'earthMars':
+        return catalog.system(['earth', 'mars'])
+    system = catalog.system()
+    if name.startswith('particles'):
+        count = int(name[len('particles'):].replace('k', '000'))
+        system.addTestParticles(*asteroidBelt(count, np.random.default_rng(0), system.mass[0]))
+    elif name != 'solarSystem':
+        raise ValueError("Unknown setup '%s', expected one of %s" % (name, ', '.join(setups)))
+    return system
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Engines -------------------------------------------------------------------------------------------------------------
+# The loop of the original SolarSystemSimulation.py: one dictionary entry of three-element lists per body, a Python
+# loop over bodies and axes, every position appended to a history list. It is kept as it was, including the force on
+# the sun that is never reset (so its energy error is not that of the Euler step alone). Massless particles get 1 kg,
+# since the loop divides by the mass.
+def originalLoop(system, nSteps, dt):
+    names = system.names
+    mass = {name: max(float(m), 1.0) for name, m in zip(names, system.mass)}
+    position = {name: list(map(float, p)) for name, p in zip(names, system.position)}
+    velocity = {name: list(map(float, v)) for name, v in zip(names, system.velocity)}
+    grav = {name: G*mass[name]*mass['sun'] for name in names[1:]}
+    history = {name: [[], [], []] for name in names}
+    force = {'sun': [0, 0, 0]}
+    modulus = {}
+    planets = names[1:]
+    for _ in range(nSteps):
+        distance = {}
+        for planet in planets:
+            modulus[planet] = 0
+            distance[planet] = []
+            for i, j in zip(position[planet], position['sun']):
+                difference = i-j
+                distance[planet].append(difference)
+                modulus[planet] += difference**2
+            modulus[planet] **= 1.5
+            force[planet] = [item * (-grav[planet]/modulus[planet]) for item in distance[planet]]
+            for i in range(3):
+                velocity[planet][i] += (dt/mass[planet])*force[planet][i]
+                position[planet][i] += dt*velocity[planet][i]
+                history[planet][i].append(position[planet][i])
+                force['sun'][i] += force[planet][i]
+        for i in range(3):
+            velocity['sun'][i] += (-dt/mass['sun'])*force['sun'][i]
+            position['sun'][i] += dt*velocity['sun'][i]
+            history['sun'][i].append(position['sun'][i])
+    system.position[:] = [position[name] for name in names]
+    system.velocity[:] = [velocity[name] for name in names]
+    system.t += nSteps*dt
+    return system
+
+def hybrid(system, nSteps, dt):
+    from HybridPropagation import HybridPropagator
+    return HybridPropagator(system).system(system.t + nSteps*dt)
+
+def makeEngine(name):
+    if name == 'original':
+        return originalLoop
+    if name == 'hybrid':
+        return hybrid
+    integratorName, _, backend = name.partition('.')
+    if integratorName not in integrators or backend not in ('', 'jit'):
+        raise ValueError("Unknown engine '%s', expected original, hybrid or one of %s (optionally with .jit)"
+                         % (name, ', '.join(integrators)))
+
+    def run(system, nSteps, dt):
+        system.backend = backend or 'numpy'
+        system.run(nSteps, dt, integrator=makeIntegrator(integratorName))
+        return system
+    return run
+# ---------------------------------------------------------------------------------------------------------------------
+
+# One scenario --------------------------------------------------------------------------------------------------------
+def peakRss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024                # [bytes] (ru_maxrss is in KiB)
+
+# Runs one scenario in this process and returns its results
+def runScenario(setup, years, engineName, dt=secondsPerDay, maxSeconds=maxSeconds):
+    system = makeSetup(setup)
+    engine = makeEngine(engineName)
+    nSteps = int(np.ceil(years*daysPerYear*secondsPerDay/dt))
+    result = {'setup': setup, 'years': years, 'engine': engineName, 'bodies': system.n, 'steps': nSteps,
+              'dt': dt, 'startRss': peakRss()}
+
+    # Estimating the run time from ever longer trial runs
+    trial, elapsed = 1, 0.0
+    while elapsed < calibration and trial < nSteps:
+        start = time.perf_counter()
+        engine(system.copy(), trial, dt)
+        elapsed = time.perf_counter() - start
+        trial *= 4
+    estimate = elapsed*nSteps/max(1, trial//4)
+    if estimate > maxSeconds:
+        result.update(status='skipped', estimatedSeconds=estimate, stepsPerSecond=nSteps/estimate,
+                      bodyStepsPerSecond=nSteps*system.n/estimate)
+        return result
+
+    # Temporary memory of one step, after a step to warm up caches
+    probe = engine(system.copy(), 1, dt)
+    tracemalloc.start()
+    largest = 0
+    for _ in range(allocationSteps):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        probe = engine(probe, 1, dt)
+        largest = max(largest, tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+    del probe
+
+    initialEnergy = totalEnergy(system)
+    start = time.perf_counter()
+    final = engine(system, nSteps, dt)
+    seconds = time.perf_counter() - start
+    result.update(status='ok', seconds=seconds, stepsPerSecond=nSteps/seconds,
+                  bodyStepsPerSecond=nSteps*final.n/seconds, peakRss=peakRss(), allocatedBytesPerStep=largest,
+                  energyError=float(abs((totalEnergy(final) - initialEnergy)/initialEnergy)))
+    return result
+
+# Runs one scenario in a fresh Python process (python BenchmarkSuite.py --case setup years engine)
+def runInProcess(setup, years, engineName, dt, maxSeconds):
+    command = [sys.executable, __file__, '--case', setup, str(years), engineName, '--dt', str(dt/secondsPerDay),
+               '--max-seconds', str(maxSeconds)]
+    completed = subprocess.run(command, capture_output=True, text=True)
+    if completed.returncode != 0:
+        return {'setup': setup, 'years': years, 'engine': engineName, 'status': 'failed',
+                'error': completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else ''}
+    return json.loads(completed.stdout)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Suite ---------------------------------------------------------------------------------------------------------------
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=sys.path[0] or None).stdout.strip()
+    except OSError:
+        commit = ''
+    try:
+        import numba
+        numbaVersion = numba.__version__
+    except ImportError:
+        numbaVersion = None
+    return {'commit': commit, 'python': platform.python_version(), 'numpy': np.__version__, 'numba': numbaVersion,
+            'machine': platform.machine(), 'processor': platform.processor(), 'date': time.strftime('%Y-%m-%d %H:%M')}
+
+def runSuite(setupNames, years, engineNames, dt=secondsPerDay, maxSeconds=maxSeconds, progress=True):
+    results = []
+    for setup in setupNames:
+        for span in years:
+            for engineName in engineNames:
+                result = runInProcess(setup, span, engineName, dt, maxSeconds)
+                results.append(result)
+                if progress:
+                    print(formatResult(result, results), flush=True)
+    return {'environment': environment(), 'results': results}
+
+def _key(result):
+    return result['setup'], result['years'], result['engine']
+
+# One line per scenario, with the speed-up over the original loop on the same setup and span
+def formatResult(result, results):
+    head = '%-14s %6g y  %-13s' % (result['setup'], result['years'], result['engine'])
+    if result['status'] == 'failed':
+        return head + ' failed: %s' % result['error']
+    baseline = [other for other in results if (other['setup'], other['years'], other['engine']) ==
+                (result['setup'], result['years'], 'original') and 'stepsPerSecond' in other]
+    speedup = ' %7.1fx' % (result['stepsPerSecond']/baseline[0]['stepsPerSecond']) if baseline else ' %8s' % ''
+    if result['status'] == 'skipped':
+        return head + ' %12.4g steps/s%s  (skipped, would take ~%.3g s)' % (result['stepsPerSecond'], speedup,
+                                                                            result['estimatedSeconds'])
+    return head + ' %12.4g steps/s%s  %8.1f MB peak  %10d B/step  dE/E %.2g' % (
+        result['stepsPerSecond'], speedup, result['peakRss']/2**20, result['allocatedBytesPerStep'],
+        result['energyError'])
+
+# Steps per second of every scenario against an earlier run (ratios above 1 are faster now)
+def compare(current, previous):
+    before = {_key(result): result for result in previous['results'] if 'stepsPerSecond' in result}
+    lines = ['compared with commit %s:' % previous['environment'].get('commit', '?')]
+    for result in current['results']:
+        if 'stepsPerSecond' in result and _key(result) in before:
+            ratio = result['stepsPerSecond']/before[_key(result)]['stepsPerSecond']
+            lines.append('%-14s %6g y  %-13s %6.2fx%s' % (_key(result) + (ratio, '  <-- slower' if ratio < 0.9 else '')))
+    return '\n'.join(lines)
+# ---------------------------------------------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the engine across setups, spans and integrators.')
+    parser.add_argument('--setups', default=','.join(setups), help='comma separated setups (default: all)')
+    parser.add_argument('--years', default=','.join(map(str, spans)), help='comma separated spans [years]')
+    parser.add_argument('--engines', default=','.join(defaultEngines),
+                        help='comma separated engines: original, hybrid or integrators (default: %s)'
+                             % ','.join(defaultEngines))
+    parser.add_argument('--dt', type=float, default=1.0, help='time step [days] (default: 1)')
+    parser.add_argument('--max-seconds', dest='maxSeconds', type=float, default=maxSeconds,
+                        help='skip scenarios estimated to take longer than this (default: %g)' % maxSeconds)
+    parser.add_argument('--quick', action='store_true', help='1 year of every setup up to 10k particles')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare with')
+    parser.add_argument('--case', nargs=3, metavar=('SETUP', 'YEARS', 'ENGINE'), help=argparse.SUPPRESS)
+    options = parser.parse_args()
+    dt = options.dt*secondsPerDay
+
+    if options.case:
+        setup, years, engineName = options.case
+        print(json.dumps(runScenario(setup, float(years), engineName, dt, options.maxSeconds)))
+        sys.exit()
+
+    setupNames = options.setups.split(',')
+    years = [float(span) for span in options.years.split(',')]
+    if options.quick:
+        setupNames, years = [name for name in setupNames if name != 'particles100k'], [1.0]
+    results = runSuite(setupNames, years, options.engines.split(','), dt, options.maxSeconds)
+    if options.output:
+        with open(options.output, 'w') as handle:
+            json.dump(results, handle, indent=1)
+    if options.compare:
+        with open(options.compare) as handle:
+            print(compare(results, json.load(handle)))
@@ -0,0 +1,236 @@
+# Source for data: https://nssdc.gsfc.nasa.gov/planetary/factsheet/index.html (copied into PlanetaryFactSheet.xlsx)
+
+import csv
+import hashlib
+import os
+import zipfile
+import xml.etree.ElementTree as ET
+import numpy as np
+from NBodyEngine import G, NBodySystem
+
+# Settings ------------------------------------------------------------------------------------------------------------
+here            = os.path.dirname(os.path.abspath(__file__))
+factSheet       = os.path.join(here, 'PlanetaryFactSheet.xlsx')
+cacheVersion    = 1                                 # Bumped whenever the layout of the cached arrays changes
+
+# Quantities read from the spreadsheet: catalog name, sheet row label, and the factor that turns the sheet's unit
+# into SI units. The row label includes the unit, so a sheet with different units is rejected instead of being
+# silently misread.
+quantities = {
+    'mass':         ('Mass (10^24 kg)',                 1e24),                      # [kg]
+    'gm':           ('GM (x 10^6 km3/s2)',              1e15),                      # [m^3*s^(-2)]
+    'radius':       ('Volumetric mean radius (km)',     1e3),                       # [m]
+    'semiMajor':    ('Semimajor axis (10^6 km)',        1e9),                       # [m]
+    'perihelion':   ('Perihelion (10^6 km)',            1e9),                       # [m]
+    'aphelion':     ('Aphelion (10^6 km)',              1e9),                       # [m]
+    'eccentricity': ('Orbit eccentricity',              1.0),
+    'inclination':  ('Orbit inclination (deg)',         1.0),                       # [deg]
+    'period':       ('Sidereal orbit period (days)',    24.0*60*60),                # [s]
+    'maxVelocity':  ('Max. orbital velocity (km/s)',    1e3),                       # Velocity at perihelion [m/s]
+    'minVelocity':  ('Min. orbital velocity (km/s)',    1e3),                       # Velocity at aphelion [m/s]
+}
+# The sheet writes powers of ten with superscripts, which come out of the file as plain digits (10^24 -> 1024)
+sheetLabels = {label.replace('^', ''): quantity for quantity, (label, factor) in quantities.items()}
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Reading the spreadsheet ---------------------------------------------------------------------------------------------
+# An .xlsx file is a zip archive of XML files, so it is read here with the standard library instead of a spreadsheet
+# package. The result is {sheet name: {row label: {column header: cell text}}}.
+namespace = {'m': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'}
+relationship = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id'
+
+def readWorkbook(path):
+    with zipfile.ZipFile(path) as archive:
+        strings = [''.join(text.text or '' for text in item.iter('{%s}t' % namespace['m']))
+                   for item in ET.fromstring(archive.read('xl/sharedStrings.xml')).findall('m:si', namespace)]
+        targets = {rel.get('Id'): rel.get('Target')
+                   for rel in ET.fromstring(archive.read('xl/_rels/workbook.xml.rels'))}
+        workbook = ET.fromstring(archive.read('xl/workbook.xml'))
+
+        sheets = {}
+        for sheet in workbook.find('m:sheets', namespace):
+            cells = {}
+            for cell in ET.fromstring(archive.read('xl/' + targets[sheet.get(relationship)])).iter(
+                    '{%s}c' % namespace['m']):
+                value = cell.find('m:v', namespace)
+                if value is None:
+                    continue
+                text = strings[int(value.text)] if cell.get('t') == 's' else value.text
+                column = ''.join(ch for ch in cell.get('r') if ch.isalpha())
+                row = int(''.join(ch for ch in cell.get('r') if ch.isdigit()))
+                cells[row, column] = ' '.join(text.replace('\xa0', ' ').split())
+
+            header = {column: text for (row, column), text in cells.items() if row == 1}
+            table = {}
+            for (row, column), text in cells.items():
+                if row > 1 and column != 'A' and column in header and (row, 'A') in cells:
+                    table.setdefault(cells[row, 'A'], {})[header[column]] = text
+            sheets[sheet.get('name')] = table
+        return sheets
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Catalog -------------------------------------------------------------------------------------------------------------
+# Every body is one entry of a set of (N,) arrays in SI units, with the sun first, then the planets in the order of
+# the spreadsheet, then any minor bodies imported from CSV files. Quantities that do not apply (the sun's orbit, say)
+# are NaN. Body names are lower case ('earth'), as in the dictionaries of the simulations.
+class BodyCatalog:
+    def __init__(self, names, values):
+        self.names = list(names)
+        self.index = {name: k for k, name in enumerate(self.names)}
+        self.values = {quantity: np.asarray(values[quantity], dtype=np.float64) for quantity in quantities}
+        # Direction of each body's aphelion in the ecliptic plane [deg], the x-axis unless a CSV file says otherwise
+        self.longitude = np.asarray(values.get('longitude', np.zeros(len(self.names))), dtype=np.float64)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, quantity):
+        return self.values[quantity]
+
+    # One quantity as a {body: value} dictionary, e.g. catalog.asDict('aphelion', planets)
+    def asDict(self, quantity, bodies=None):
+        bodies = self.names if bodies is None else bodies
+        return {name: float(self.values[quantity][self.index[name]]) for name in bodies}
+
+    @property
+    def planets(self):
+        return [name for name in self.names[1:] if name in planetNames]
+
+    # Checking that the numbers agree with each other, so a wrong unit or a typo in the sheet is caught early
+    def validate(self):
+        mass, gm = self['mass'], self['gm']
+        known = ~np.isnan(gm) & (mass > 0)
+        # GM / M must give back the gravitational constant (to the sheet's four or five significant figures)
+        if known.any() and np.any(np.abs(gm[known]/mass[known]/G - 1) > 2e-3):
+            raise ValueError('masses and GM values in the catalog do not agree; check their units')
+        orbit = ~np.isnan(self['semiMajor'])
+        q, a, Q = self['perihelion'][orbit], self['semiMajor'][orbit], self['aphelion'][orbit]
+        if np.any(q > a) or np.any(a > Q):
+            raise ValueError('every orbit needs perihelion <= semi-major axis <= aphelion')
+        # e = (Q-q)/(Q+q) and a = (Q+q)/2 hold for every ellipse
+        if np.any(np.abs((Q-q)/(Q+q) - self['eccentricity'][orbit]) > 5e-3):
+            raise ValueError('eccentricities in the catalog do not match the perihelion and aphelion distances')
+        if np.any(np.abs((Q+q)/2/a - 1) > 5e-3):
+            raise ValueError('semi-major axes in the catalog do not match the perihelion and aphelion distances')
+        return self
+
+    # Appending minor bodies from a CSV file with a header row. Columns (SI units, degrees for angles):
+    #   name, and either aphelion and perihelion [m] or semiMajor [m] and eccentricity,
+    #   optionally mass [kg] (0 or missing makes a test particle), inclination [deg] and longitude [deg] (direction
+    #   of the aphelion in the ecliptic plane, used to spread the bodies around their orbits)
+    def addCsv(self, path):
+        with open(path, newline='') as handle:
+            rows = list(csv.DictReader(handle))
+        if not rows:
+            return self
+        columns = rows[0].keys()
+        column = lambda key, default=np.nan: np.array([float(row[key]) if row.get(key) not in (None, '') else default
+                                                       for row in rows])
+        if 'aphelion' in columns and 'perihelion' in columns:
+            aphelion, perihelion = column('aphelion'), column('perihelion')
+            semiMajor = (aphelion + perihelion)/2
+            eccentricity = (aphelion - perihelion)/(aphelion + perihelion)
+        elif 'semiMajor' in columns and 'eccentricity' in columns:
+            semiMajor, eccentricity = column('semiMajor'), column('eccentricity')
+            aphelion, perihelion = semiMajor*(1 + eccentricity), semiMajor*(1 - eccentricity)
+        else:
+            raise ValueError("'%s' needs aphelion and perihelion columns, or semiMajor and eccentricity" % path)
+
+        mu = G*self['mass'][0]
+        new = {
+            'mass':         column('mass', 0.0),
+            'gm':           G*column('mass', 0.0),
+            'radius':       column('radius'),
+            'semiMajor':    semiMajor,
+            'perihelion':   perihelion,
+            'aphelion':     aphelion,
+            'eccentricity': eccentricity,
+            'inclination':  column('inclination', 0.0),
+            'period':       2*np.pi*np.sqrt(semiMajor**3/mu),
+            # Vis-viva equation: v^2 = mu*(2/r - 1/a)
+            'maxVelocity':  np.sqrt(mu*(2/perihelion - 1/semiMajor)),
+            'minVelocity':  np.sqrt(mu*(2/aphelion - 1/semiMajor)),
+        }
+        self.names += [row['name'] for row in rows]
+        self.index = {name: k for k, name in enumerate(self.names)}
+        self.values = {quantity: np.concatenate([self.values[quantity], new[quantity]]) for quantity in quantities}
+        self.longitude = np.concatenate([self.longitude, column('longitude', 0.0)])
+        return self
+
+    # An NBodySystem with every body (or the chosen ones) at aphelion, moving at its aphelion velocity, the way the
+    # simulations start. Planets start on the x-axis; minor bodies at their CSV longitude, tilted by their inclination.
+    def system(self, bodies=None, **options):
+        bodies = self.names[1:] if bodies is None else [name for name in bodies if name != self.names[0]]
+        k = np.array([self.index[name] for name in bodies], dtype=int)
+        longitude = np.radians(self.longitude[k])
+        inclination = np.where(np.isin(bodies, planetNames), 0.0, np.radians(self['inclination'][k]))
+        aphelion, speed = self['aphelion'][k], self['minVelocity'][k]
+
+        position = np.zeros((len(k) + 1, 3))
+        velocity = np.zeros((len(k) + 1, 3))
+        position[1:, 0] = aphelion*np.cos(longitude)
+        position[1:, 1] = aphelion*np.sin(longitude)
+        velocity[1:, 0] = -speed*np.sin(longitude)*np.cos(inclination)
+        velocity[1:, 1] = speed*np.cos(longitude)*np.cos(inclination)
+        velocity[1:, 2] = speed*np.sin(inclination)
+        mass = np.concatenate([[self['mass'][0]], self['mass'][k]])
+        return NBodySystem([self.names[0]] + bodies, mass, position, velocity, **options)
+
+
+planetNames = ['mercury', 'venus', 'earth', 'mars', 'jupiter', 'saturn', 'uranus', 'neptune', 'pluto']
+
+# Parsing the fact sheet into a catalog
+def parseFactSheet(path=factSheet):
+    sheets = readWorkbook(path)
+    rows = {}
+    for sheetName in ('BulkParameters', 'OrbitalParameters', 'Sun'):
+        if sheetName not in sheets:
+            raise ValueError("'%s' has no %s sheet" % (path, sheetName))
+        for label, row in sheets[sheetName].items():
+            if label in sheetLabels:
+                rows.setdefault(sheetLabels[label], {}).update(row)
+
+    for quantity, (label, factor) in quantities.items():
+        if quantity not in rows:
+            raise ValueError("'%s' has no row labelled '%s' (the unit must match too)" % (path, label))
+
+    names = ['Sun'] + [name for name in sheets['BulkParameters'].get(quantities['mass'][0].replace('^', ''), {})
+                       if name != 'Sun']
+    values = {}
+    for quantity, (label, factor) in quantities.items():
+        values[quantity] = [float(rows[quantity][name])*factor if name in rows[quantity] else np.nan
+                            for name in names]
+    return BodyCatalog([name.lower() for name in names], values).validate()
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Cached snapshot -----------------------------------------------------------------------------------------------------
+# Parsing the spreadsheet is only done when it changes. The parsed arrays are saved next to it as an .npz file
+# together with a SHA-256 hash of the spreadsheet, and later runs load that file instead as long as the hash matches.
+def fileHash(path):
+    with open(path, 'rb') as handle:
+        return hashlib.sha256(handle.read()).hexdigest()
+
+def loadCatalog(path=factSheet, cache=None, minorBodies=()):
+    cache = os.path.splitext(path)[0] + '.cache.npz' if cache is None else cache
+    digest = fileHash(path)
+
+    catalog = None
+    if cache and os.path.exists(cache):
+        with np.load(cache) as snapshot:
+            if str(snapshot['hash']) == digest and int(snapshot['version']) == cacheVersion:
+                catalog = BodyCatalog([str(name) for name in snapshot['names']],
+                                      {quantity: snapshot[quantity] for quantity in quantities})
+
+    if catalog is None:
+        catalog = parseFactSheet(path)
+        if cache:
+            temporary = cache + '.tmp'
+            with open(temporary, 'wb') as handle:
+                np.savez(handle, hash=np.array(digest), version=np.int64(cacheVersion),
+                         names=np.array(catalog.names), **catalog.values)
+            os.replace(temporary, cache)
+
+    for csvPath in minorBodies:
+        catalog.addCsv(csvPath)
+    return catalog
+# ---------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,98 @@
+# Checkpoint and restart of long runs
+# Usage: python Checkpoint.py checkpoint.npz [more steps]
+#
+# Continues the run saved in checkpoint.npz until the number of steps it was started with (or that many more steps),
+# writing a new checkpoint every interval steps on the way.
+
+import json
+import os
+import sys
+import numpy as np
+from NBodyEngine import NBodySystem
+from Integrators import makeIntegrator
+
+# Checkpoints ---------------------------------------------------------------------------------------------------------
+# A checkpoint is one uncompressed .npz file holding everything needed to continue a run exactly where it stopped:
+# the position/velocity/mass arrays, the time, dt, how many of how many steps are done, the force model, the
+# precision and its side state (see NBodyEngine.py), the integrator and its internal state (e.g. the acceleration it
+# reuses from the previous step, or the next step length of an adaptive integrator), and the state of the random
+# number generator if the run uses one.
+#
+# The file is first written next to the old one under a temporary name, flushed to disk, and then renamed over it.
+# The rename is atomic, so a crash part way through a write always leaves the last good checkpoint in place.
+
+def saveCheckpoint(path, system, integrator, dt, step, nSteps, rng=None):
+    arrays = {
+        'names':        np.array(system.names),
+        'mass':         system.mass,                                                # [kg]
+        'position':     system.position,                                            # [m]
+        'velocity':     system.velocity,                                            # [m/s]
+        't':            np.float64(system.t),                                       # [s]
+        'dt':           np.float64(dt),                                             # [s]
+        'step':         np.int64(step),
+        'nSteps':       np.int64(nSteps),
+        'forceModel':   np.array(system.forceModel),
+        'theta':        np.float64(system.theta),
+        'softening':    np.float64(system.softening),                               # [m]
+        'precision':    np.array(system.precision),
+        'integrator':   np.array(integrator.name),
+    }
+    for key, value in system.getPrecisionState().items():
+        arrays['precision.' + key] = np.asarray(value)
+    for key, value in integrator.getState().items():
+        arrays['integrator.' + key] = np.asarray(value)
+    if rng is not None:
+        arrays['rng'] = np.array(json.dumps(rng.bit_generator.state))
+
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as handle:
+        np.savez(handle, **arrays)
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(temporary, path)
+
+# Reading a checkpoint back into a system, an integrator and the rest of the run's settings
+def loadCheckpoint(path):
+    with np.load(path) as checkpoint:
+        system = NBodySystem([str(name) for name in checkpoint['names']], checkpoint['mass'],
+                             checkpoint['position'], checkpoint['velocity'], float(checkpoint['t']),
+                             str(checkpoint['forceModel']), float(checkpoint['theta']),
+                             float(checkpoint['softening']),
+                             precision=str(checkpoint['precision']) if 'precision' in checkpoint.files else 'float64')
+        system.setPrecisionState({key[len('precision.'):]: checkpoint[key] for key in checkpoint.files
+                                  if key.startswith('precision.')})
+        integrator = makeIntegrator(str(checkpoint['integrator']))
+        integrator.setState({key[len('integrator.'):]: checkpoint[key][()] for key in checkpoint.files
+                             if key.startswith('integrator.')})
+        rng = None
+        if 'rng' in checkpoint.files:
+            state = json.loads(str(checkpoint['rng']))
+            rng = np.random.Generator(getattr(np.random, state['bit_generator'])())
+            rng.bit_generator.state = state
+        settings = {'dt': float(checkpoint['dt']), 'step': int(checkpoint['step']),
+                    'nSteps': int(checkpoint['nSteps']), 'rng': rng}
+    return system, integrator, settings
+
+# Running steps step..nSteps-1, writing a checkpoint every interval steps and once more at the end
+def runWithCheckpoints(system, integrator, dt, nSteps, path, interval=1000, step=0, recorder=None, rng=None):
+    while step < nSteps:
+        chunk = min(interval, nSteps - step)
+        system.run(chunk, dt, recorder=recorder, integrator=integrator)
+        step += chunk
+        saveCheckpoint(path, system, integrator, dt, step, nSteps, rng)
+    return system
+
+# Continuing a checkpointed run, optionally for more steps than it was started with
+def resume(path, interval=1000, moreSteps=0, recorder=None):
+    system, integrator, settings = loadCheckpoint(path)
+    nSteps = settings['nSteps'] + moreSteps
+    runWithCheckpoints(system, integrator, settings['dt'], nSteps, path, interval, settings['step'], recorder,
+                       settings['rng'])
+    return system, integrator
+# ---------------------------------------------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        sys.exit('Usage: python Checkpoint.py checkpoint.npz [more steps]')
+    system, integrator = resume(sys.argv[1], moreSteps=int(sys.argv[2]) if len(sys.argv) > 2 else 0)
+    print('Resumed run finished at t = %g s' % system.t, integrator.report())
@@ -0,0 +1,254 @@
+import csv
+import json
+import os
+import time
+from collections import defaultdict
+import numpy as np
+from NBodyEngine import G
+from KeplerOrbits import elementsFromState
+
+# Formulae ------------------------------------------------------------------------------------------------------------
+# For bodies of mass m_i at positions r_i with velocities v_i:
+# kinetic energy        K = sum_i m_i*|v_i|^2/2                                                                     (0)
+# potential energy      U = -G*sum_(i<j) m_i*m_j/sqrt(|r_j-r_i|^2+eps^2)                                            (1)
+#                       (with the 'sun' force model only the pairs with the sun count: U = -G*sum_i m_0*m_i/|r_i-r_0|)
+# linear momentum       P = sum_i m_i*v_i                                                                           (2)
+# angular momentum      L = sum_i m_i*(r_i x v_i)                                                                   (3)
+# The exact equations of motion keep E = K+U, P and L constant, so how far they move from their starting values is a
+# measure of the integration error: the daily Euler step of the original scripts loses ~1e-4 of the energy in 20
+# years, while the error of the Wisdom-Holman integrator with 30 day steps swings within ~1e-5 without drifting.
+# Osculating elements (see KeplerOrbits.py) show where an error goes, e.g. a semi-major axis that creeps outwards.
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Settings ------------------------------------------------------------------------------------------------------------
+blockElements = 2**20                               # Largest number of body pairs held in memory for the potential
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Conserved quantities ------------------------------------------------------------------------------------------------
+# Formula 0 [J]
+def kineticEnergy(mass, velocity):
+    return 0.5*np.einsum('i,ij,ij->', mass, velocity, velocity)
+
+# Formula 1 [J]; only massive bodies take part, in blocks of pairs so that large systems fit in memory
+def potentialEnergy(mass, position, forceModel='sun', softening=0.0):
+    if forceModel == 'sun':
+        distance = position[1:] - position[0]
+        return -G*mass[0]*np.sum(mass[1:]/np.sqrt(np.einsum('ij,ij->i', distance, distance) + softening**2))
+    massive = np.flatnonzero(mass > 0)
+    position, mass = position[massive], mass[massive]
+    energy = 0.0
+    blockSize = max(1, blockElements//max(1, len(mass)))
+    for start in range(0, len(mass), blockSize):
+        block = slice(start, start + blockSize)
+        distance = position[None, :, :] - position[block, None, :]
+        modulus = np.sqrt(np.einsum('ijk,ijk->ij', distance, distance) + softening**2)
+        upper = np.arange(len(mass))[None, :] > np.arange(start, min(start + blockSize, len(mass)))[:, None]
+        energy -= G*np.sum(np.where(upper, mass[block, None]*mass[None, :]/np.where(upper, modulus, 1.0), 0.0))
+    return energy
+
+# Total energy of a system under its force model [J]
+def totalEnergy(system):
+    return kineticEnergy(system.mass, system.velocity) + potentialEnergy(system.mass, system.position,
+                                                                         system.forceModel, system.softening)
+
+# Formula 2 [kg*m*s^(-1)]
+def linearMomentum(mass, velocity):
+    return mass @ velocity
+
+# Formula 3, about the origin [kg*m^2*s^(-1)]
+def angularMomentum(mass, position, velocity):
+    return mass @ np.cross(position, velocity)
+
+# Osculating elements of every body but the sun, about the sun (see KeplerOrbits.elementsFromState)
+def osculatingElements(mass, position, velocity):
+    return elementsFromState(position[1:] - position[0], velocity[1:] - velocity[0], G*(mass[0] + mass[1:]))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Conservation monitor ------------------------------------------------------------------------------------------------
+# A recorder (see TrajectoryBuffer.py) that works out the conserved quantities every `every` steps and keeps one row
+# per check: the quantities themselves and how far they have moved, relative to their starting values. With
+# elements=True (or a list of bodies) the semi-major axis, eccentricity and inclination of the bodies are kept too.
+# The momentum drift is relative to the sum of |m_i*v_i|, since the total momentum itself usually starts near zero.
+class ConservationMonitor:
+    def __init__(self, system, every=1, elements=False):
+        self.system = system
+        self.every = int(every)
+        self.calls = 0
+        if elements is True:
+            elements = system.names[1:]
+        self.elementBodies = [system.names.index(name) - 1 for name in (elements or [])]
+        self.columns = ['t', 'step', 'energy', 'energyError', 'momentumError', 'angularMomentumError',
+                        'momentumX', 'momentumY', 'momentumZ', 'angularMomentumX', 'angularMomentumY',
+                        'angularMomentumZ']
+        for k in self.elementBodies:
+            name = system.names[k + 1]
+            self.columns += ['semiMajor.%s' % name, 'eccentricity.%s' % name, 'inclination.%s' % name]
+        self.rows = []
+        self.initialEnergy = None
+        self._measure(system.t, system.position, system.velocity)
+
+    def _measure(self, t, position, velocity):
+        system = self.system
+        mass = system.mass
+        energy = kineticEnergy(mass, velocity) + potentialEnergy(mass, position, system.forceModel, system.softening)
+        momentum = linearMomentum(mass, velocity)
+        angular = angularMomentum(mass, position, velocity)
+        if self.initialEnergy is None:
+            self.initialEnergy, self.initialMomentum, self.initialAngular = energy, momentum, angular
+            self.momentumScale = max(np.sum(mass*np.sqrt(np.einsum('ij,ij->i', velocity, velocity))), 1e-300)
+        row = [energy, abs((energy - self.initialEnergy)/self.initialEnergy),
+               np.linalg.norm(momentum - self.initialMomentum)/self.momentumScale,
+               np.linalg.norm(angular - self.initialAngular)/max(np.linalg.norm(self.initialAngular), 1e-300)]
+        row += list(momentum) + list(angular)
+        if self.elementBodies:
+            elements = osculatingElements(mass, position, velocity)
+            k = self.elementBodies
+            row += list(np.stack([elements['semiMajor'][k], elements['eccentricity'][k],
+                                  elements['inclination'][k]], axis=1).reshape(-1))
+        self.rows.append([float(t), self.calls] + [float(value) for value in row])
+
+    def record(self, t, position, velocity=None):
+        self.calls += 1
+        if self.calls % self.every == 0:
+            if velocity is None:
+                raise ValueError('the conservation monitor needs the velocities as well as the positions')
+            self._measure(t, position, velocity)
+
+    # The largest relative drift of each conserved quantity so far
+    def summary(self):
+        rows = np.array(self.rows)
+        return {'checks': len(self.rows), 'steps': self.calls,
+                'maxEnergyError': float(rows[:, 3].max()),
+                'finalEnergyError': float(rows[-1, 3]),
+                'maxMomentumError': float(rows[:, 4].max()),
+                'maxAngularMomentumError': float(rows[:, 5].max())}
+
+    def asDict(self):
+        return {'summary': self.summary(), 'columns': self.columns, 'rows': self.rows}
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Phase timers --------------------------------------------------------------------------------------------------------
+# Wall-clock time and number of calls per phase of a run, kept as integer nanoseconds in two dictionaries, so timing a
+# call costs two perf_counter_ns() calls and two additions. Phases are timed either by wrapping a function with
+# timed() (instrument() does this for a system, integrator and recorder) or with a `with timers.phase(name):` block.
+# Phases can sit inside each other: the force evaluations inside the integration, the disk writes inside the
+# recording. report() gives every phase's total and, for the phases that contain others, the time spent in the phase
+# itself (selfSeconds). A phase is never inside itself: a timed function called from another one of the same phase
+# (acceleration() calling sunForce(), say) is neither timed nor counted again.
+phaseParents = {'force': 'integration', 'io': 'recording'}
+
+class PhaseTimers:
+    def __init__(self):
+        self.totals = defaultdict(int)              # [ns]
+        self.calls = defaultdict(int)
+        self.running = defaultdict(bool)            # Whether a call of the phase is under way
+        self.started = time.perf_counter_ns()
+
+    def timed(self, name, function):
+        totals, calls, running, clock = self.totals, self.calls, self.running, time.perf_counter_ns
+
+        def timedFunction(*args, **kwargs):
+            if running[name]:
+                return function(*args, **kwargs)
+            running[name] = True
+            start = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                totals[name] += clock() - start
+                calls[name] += 1
+                running[name] = False
+        return timedFunction
+
+    def phase(self, name):
+        return _Phase(self, name)
+
+    def report(self):
+        report = {'wallSeconds': 1e-9*(time.perf_counter_ns() - self.started), 'phases': {}}
+        for name in self.totals:
+            children = sum(self.totals.get(child, 0) for child, parent in phaseParents.items() if parent == name)
+            report['phases'][name] = {'seconds': 1e-9*self.totals[name], 'calls': self.calls[name],
+                                      'secondsPerCall': 1e-9*self.totals[name]/max(1, self.calls[name]),
+                                      'selfSeconds': 1e-9*(self.totals[name] - children)}
+        return report
+
+    def __str__(self):
+        report = self.report()
+        lines = ['%-12s %10s %10s %12s' % ('phase', 'seconds', 'calls', 'us/call')]
+        for name, phase in report['phases'].items():
+            lines.append('%-12s %10.4f %10d %12.2f' % (name, phase['seconds'], phase['calls'],
+                                                       1e6*phase['secondsPerCall']))
+        lines.append('%-12s %10.4f' % ('wall', report['wallSeconds']))
+        return '\n'.join(lines)
+
+class _Phase:
+    def __init__(self, timers, name):
+        self.timers, self.name = timers, name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+
+    def __exit__(self, *exc):
+        self.timers.totals[self.name] += time.perf_counter_ns() - self.start
+        self.timers.calls[self.name] += 1
+
+# Timing the phases of a run without touching the code that runs it: the methods of these objects are replaced (on
+# the objects only) by timed versions, so a run that is not instrumented pays nothing
+#   force         system.acceleration() and system.sunForce(), and the Wisdom-Holman interaction
+#   integration   integrator.step() (or system.step() when there is no integrator). With the jit backend the compiled
+#                 integrators run whole loops of steps without calling either (see JitKernels.run), so the
+#                 integration and force phases stay empty and their time only shows in the wall time.
+#   recording     recorder.record()
+#   io            the chunk writes and closing of a trajectory writer (see TrajectoryIO.py)
+# Anything else (saving checkpoints, say) can be timed with timers.phase().
+def instrument(timers, system, integrator=None, recorder=None):
+    system.acceleration = timers.timed('force', system.acceleration)
+    system.sunForce = timers.timed('force', system.sunForce)
+    if integrator is None:
+        system.step = timers.timed('integration', system.step)
+    else:
+        integrator.step = timers.timed('integration', integrator.step)
+        if hasattr(integrator, '_interaction'):
+            integrator._interaction = timers.timed('force', integrator._interaction)
+    for part in getattr(recorder, 'recorders', [recorder]):
+        if part is None:
+            continue
+        part.record = timers.timed('recording', part.record)
+        for method in ('_writeChunk', '_close'):
+            if hasattr(part, method):
+                setattr(part, method, timers.timed('io', getattr(part, method)))
+    return timers
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Metrics files -------------------------------------------------------------------------------------------------------
+# Writing the checks of a ConservationMonitor and the report of PhaseTimers (either may be None), as one JSON file or,
+# for a path ending in .csv, as a CSV table of the checks plus a second CSV file of the phases next to it
+# (name.timers.csv). Extra keyword arguments (run settings, say) go into the JSON file as they are.
+def writeMetrics(path, monitor=None, timers=None, **extra):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if path.lower().endswith('.csv'):
+        if monitor is not None:
+            with open(path, 'w', newline='') as handle:
+                writer = csv.writer(handle)
+                writer.writerow(monitor.columns)
+                writer.writerows(monitor.rows)
+        if timers is not None:
+            report = timers.report()
+            with open(path[:-4] + '.timers.csv', 'w', newline='') as handle:
+                writer = csv.writer(handle)
+                writer.writerow(['phase', 'seconds', 'calls', 'secondsPerCall', 'selfSeconds'])
+                for name, phase in report['phases'].items():
+                    writer.writerow([name, phase['seconds'], phase['calls'], phase['secondsPerCall'],
+                                     phase['selfSeconds']])
+                writer.writerow(['wall', report['wallSeconds'], '', '', ''])
+        return
+    metrics = dict(extra)
+    if monitor is not None:
+        metrics['conservation'] = monitor.asDict()
+    if timers is not None:
+        metrics['timers'] = timers.report()
+    with open(path, 'w') as handle:
+        json.dump(metrics, handle, indent=1)
+# ---------------------------------------------------------------------------------------------------------------------
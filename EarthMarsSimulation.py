@@ -1,27 +1,26 @@
 # Source for data: https://nssdc.gsfc.nasa.gov/planetary/factsheet/index.html
 
+import numpy as np
 import matplotlib.pyplot as plt
-from matplotlib import animation
+from NBodyEngine import NBodySystem
+from TrajectoryBuffer import TrajectoryBuffer
+from BodyCatalog import loadCatalog
+from OrbitRenderer import OrbitRenderer
 
 # Variable definitions ------------------------------------------------------------------------------------------------
-G               = 6.6743e-11                        # Gravitational constant [m^3*kg^(-1)*s^(-2)]
-massSun         = 1.9891e30                         # Mass of the sun [kg]
-massEarth       = 5.97219e24                        # Moss of the Earth [kg]
-massMars        = 6.4169e23                         # Mass of Mars [kg]
+catalog         = loadCatalog()                     # Read from PlanetaryFactSheet.xlsx (see BodyCatalog.py)
+massSun         = catalog.asDict('mass')['sun']     # Mass of the sun [kg]
+massEarth       = catalog.asDict('mass')['earth']   # Mass of the Earth [kg]
+massMars        = catalog.asDict('mass')['mars']    # Mass of Mars [kg]
 secondsPerDay   = 24.0*60*60                        # Number of seconds in a day [s]
 # Distances [m]
-earthPerihelion = 1.47095e11                        # Earth's perihelion (shortest distance to the sun)
-earthAphelion   = 1.521e11                          # Earth's aphelion (furthest distance to the sun)
-marsPerihelion  = 2.0665e11                         # Mars' perihelion
-marsAphelion    = 2.49261e11                        # Mars' aphelion
+earthPerihelion = catalog.asDict('perihelion')['earth']     # Earth's perihelion (shortest distance to the sun)
+earthAphelion   = catalog.asDict('aphelion')['earth']       # Earth's aphelion (furthest distance to the sun)
+marsPerihelion  = catalog.asDict('perihelion')['mars']      # Mars' perihelion
+marsAphelion    = catalog.asDict('aphelion')['mars']        # Mars' aphelion
 # Velocities [m*s^(-1)]
-earthInitialVelocity   = 29290                      # Earth's velocity at aphelion (furthest from the sun)
-marsInitialVelocity    = 21970                      # Mars' velocity at aphelion
-
-# F = (G*M*m)/(r^2) [kg*m*s^(-1)]
-# Finding the numerator for each body (G*M*m) [m^3*kg*s^(-2)]
-gravConstEarth  = G*massEarth*massSun
-gravConstMars   = G*massMars*massSun
+earthInitialVelocity   = catalog.asDict('minVelocity')['earth']     # Earth's velocity at aphelion
+marsInitialVelocity    = catalog.asDict('minVelocity')['mars']      # Mars' velocity at aphelion
 # ---------------------------------------------------------------------------------------------------------------------
 
 # Initial Conditions --------------------------------------------------------------------------------------------------
@@ -34,122 +33,31 @@ marsVelocity   = [0, marsInitialVelocity, 0]             # Mars' initial velocit
 # For Sun
 sunPosition    = [0, 0, 0]                               # Sun's initial position vector is the origin
 sunVelocity    = [0, 0, 0]                               # Sun's initially at rest
+# All three bodies in one system for the engine in NBodyEngine.py, the sun first
+system = NBodySystem(['sun', 'earth', 'mars'], [massSun, massEarth, massMars],
+                     [sunPosition, earthPosition, marsPosition], [sunVelocity, earthVelocity, marsVelocity])
 # Time
-t              = 0.0
-dt             = secondsPerDay                           # Frame rate is every second
-# Opening a list for each dimension containing the history of each body's position
-xEarthHist, yEarthHist, zEarthHist = [],[],[]
-xSunHist, ySunHist, zSunHist       = [],[],[]
-xMarsHist, yMarsHist, zMarsHist    = [],[],[]
+dt             = secondsPerDay                           # Frame rate is every day
 # ---------------------------------------------------------------------------------------------------------------------
 
 # Simulation Data -----------------------------------------------------------------------------------------------------
-while t<5*365.2422*secondsPerDay: #Simulating 5 years
-    modulusEarth, modulusMars = 0, 0
-    # Forces on Earth - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-    distanceEarth = []
-    for i,j in zip(earthPosition,sunPosition):
-        differenceEarth = i-j
-        distanceEarth.append(differenceEarth)
-        modulusEarth += differenceEarth**2
-    modulusEarth **= 1.5
-    earthForce = [item * (-gravConstEarth/modulusEarth) for item in distanceEarth]
-    
-    # Update Earth's Velocity, F = m*a thus a = F/m, v = a*dt = (F/m)*dt, then update Earth's position, p = v*dt
-    for i in range(3): 
-        earthVelocity[i] += (dt/massEarth)*earthForce[i]
-        earthPosition[i] += dt*earthVelocity[i]
-    
-    # Keep a history of Earth's position in each coordinate
-    xEarthHist.append(earthPosition[0])
-    yEarthHist.append(earthPosition[1])
-    zEarthHist.append(earthPosition[2])
-
-    # Forces on Mars - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - 
-    distanceMars = []
-    for i,j in zip(marsPosition,sunPosition):
-        differenceMars = i-j
-        distanceMars.append(differenceMars)
-        modulusMars += differenceMars**2
-    modulusMars **= 1.5
-    marsForce = [item * (-gravConstMars/modulusMars) for item in distanceMars]
-    
-    # Update Mars' Velocity then update Mars' Position
-    for i in range(3): 
-        marsVelocity[i] += (dt/massMars)*marsForce[i]
-        marsPosition[i] += dt*marsVelocity[i]
-    
-    # Keep a history of Mars' position in each coordinate
-    xMarsHist.append(marsPosition[0])
-    yMarsHist.append(marsPosition[1])
-    zMarsHist.append(marsPosition[2])
-    
-    # Forces on the Sun - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-    enum = 0
-    for i,j in zip(earthForce, marsForce):
-        sunDeltaVelocity = (-dt/massSun)*(i+j)
-        sunVelocity[enum] += sunDeltaVelocity
-        sunPosition[enum] += dt*sunVelocity[enum]
-        enum += 1
-    
-    # Keep a history of the sun's position in each coordinate
-    xSunHist.append(sunPosition[0])
-    ySunHist.append(sunPosition[1])
-    zSunHist.append(sunPosition[2])
-
-    # Update time
-    t += dt
+# F = (G*M*m)/(r^2): every step the engine finds the force of the sun on Earth and Mars, updates their velocities and
+# positions, and moves the sun with the sum of the opposite forces
+nSteps = int(np.ceil(5*365.2422*secondsPerDay/dt))      # Simulating 5 years
+trajectory = TrajectoryBuffer(system.names, nSteps)
+system.run(nSteps, dt, recorder=trajectory)
+
+# The history of each body's position in each dimension (views into the trajectory, nothing is copied)
+xEarthHist, yEarthHist, zEarthHist = trajectory.body('earth').T
+xSunHist, ySunHist, zSunHist       = trajectory.body('sun').T
+xMarsHist, yMarsHist, zMarsHist    = trajectory.body('mars').T
 # ---------------------------------------------------------------------------------------------------------------------
 
 # Simulation Plotting -------------------------------------------------------------------------------------------------
-fig, ax = plt.subplots(figsize=(10,10))
-ax.set_aspect('equal')
-ax.grid()
-
-earthPath,     = ax.plot([],[],'-b',lw=1)
-earthMarker,    = ax.plot([earthAphelion], [0], marker="o", markersize=12, markeredgecolor="blue", markerfacecolor="blue")
-earthLabel      = ax.text(earthAphelion,0,'Earth')
-
-marsPath,     = ax.plot([],[],'-r',lw=1)
-marsMarker,    = ax.plot([marsAphelion], [0], marker="o", markersize=(0.151*12), markeredgecolor="red", markerfacecolor="red")
-marsLabel      = ax.text(marsAphelion,0,'Mars')
-
-sunPath,     = ax.plot([],[],'-g',lw=1)
-sunMarker,    = ax.plot([0], [0], marker="o", markersize=20, markeredgecolor="yellow", markerfacecolor="yellow")
-sunLabel      = ax.text(0,0,'Sun')
-
-earthXPath,earthYPath = [],[]               # Earth's path in two dimensions
-sunXPath,sunYPath = [],[]                   # Sun's path in two dimensions
-marsXPath,marsYPath = [],[]                 # Mars' path in two dimensions
-
-def update(i):
-    earthXPath.append(xEarthHist[i])
-    earthYPath.append(yEarthHist[i])
-    
-    marsXPath.append(xMarsHist[i])
-    marsYPath.append(yMarsHist[i])
-
-    sunXPath.append(xSunHist[i])
-    sunYPath.append(ySunHist[i])
-    
-    earthPath.set_data(earthXPath,earthYPath)
-    earthMarker.set_data(xEarthHist[i],yEarthHist[i])
-    earthLabel.set_position((xEarthHist[i],yEarthHist[i]))
-    
-    marsPath.set_data(marsXPath,marsYPath)
-    marsMarker.set_data(xMarsHist[i],yMarsHist[i])
-    marsLabel.set_position((xMarsHist[i],yMarsHist[i]))
-    
-    sunPath.set_data(sunXPath,sunYPath)
-    sunMarker.set_data(xSunHist[i],ySunHist[i])
-    sunLabel.set_position((xSunHist[i],ySunHist[i]))
-    
-    ax.axis('equal')
-    ax.set_xlim(-3*earthAphelion,3*earthAphelion)
-    ax.set_ylim(-3*earthAphelion,3*earthAphelion)
-
-    return earthPath,earthMarker,earthLabel,marsPath,marsMarker,marsLabel,sunPath,sunMarker,sunLabel
-
-anim = animation.FuncAnimation(fig,func=update,frames=len(xEarthHist),interval=1,blit=True)
+# Drawn by OrbitRenderer.py, Earth and Mars trailing their own colour and Mars' marker scaled to its volume next to
+# Earth's; the view is three times Earth's aphelion and is set once
+renderer = OrbitRenderer(trajectory, trailLength=730, limit=3*earthAphelion, trailColour=None,
+                         styles={'sun': ('yellow', 20), 'earth': ('blue', 12), 'mars': ('red', 0.151*12)})
+anim = renderer.animate(interval=1)
 plt.show()
 # ---------------------------------------------------------------------------------------------------------------------
\ No newline at end of file
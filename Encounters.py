@@ -0,0 +1,508 @@
+# Close approaches, collisions and ejections, detected while a simulation runs
+# Usage: python Encounters.py [years] [particles]
+#
+# Runs the catalog's solar system ('direct' force model, daily leapfrog steps) with that many massless comets on orbits
+# that cross the inner planets, a few of them sungrazers and a few on their way out of the solar system, and prints
+# the event log and how long the detection took next to the integration.
+
+import csv
+import json
+import os
+import sys
+import time
+import numpy as np
+from NBodyEngine import G, secondsPerDay, daysPerYear
+
+# Formulae ------------------------------------------------------------------------------------------------------------
+# Hill radius of body i at distance r_i from the sun of mass M (the region where its own pull dominates):
+# R_H,i = r_i*(m_i/(3*M))**(1/3)                                                                                    (0)
+# Bodies i and j (not the sun) are in a close approach while they are nearer than hillFactor Hill radii of the larger:
+# |r_j-r_i| < hillFactor*max(R_H,i, R_H,j)                                                                          (1)
+# Any two bodies, the sun included, collide when their distance drops below the sum of their radii:
+# |r_j-r_i| < R_i+R_j                                                                                               (2)
+# A body is ejected when it is further than ejectionDistance from the sun on an unbound orbit:
+# |v_i-v_0|**2/2 - G*(M+m_i)/|r_i-r_0| > 0                                                                          (3)
+#
+# Checking the states at the ends of the steps is not enough: with daily steps the Earth moves 2.6e9 m, more than its
+# Hill radius (1.5e9 m) and 400 times its diameter. Over a step every body is taken to follow the cubic Hermite curve
+# through its positions p0, p1 and velocities v0, v1 at both ends (as accurate as the step itself):
+# p(tau) = p0 + tau*(p1-p0) + tau*(1-tau)**2*a - tau**2*(1-tau)*b,   a = dt*v0-(p1-p0),  b = dt*v1-(p1-p0)           (4)
+# The relative position of two bodies is the same kind of curve, and the smallest distance along it (and the time at
+# which it crosses a threshold) is found with a few dozen iterations on all pairs at once. From formula 4, body i
+# stays within
+# w_i = |p1-p0|/2 + 4/27*(|a|+|b|)                                                                                  (5)
+# of the midpoint (p0+p1)/2 during the step, so two bodies whose midpoints are further apart than their thresholds
+# plus w_i+w_j cannot meet, and are never looked at.
+#
+# Events are found on the path the integrator took, so they are as good as that path: with daily steps, approach
+# times agree with a run of 64 times shorter steps to ~100 s and closest distances to ~1e-6, but a sungrazer whose
+# whole perihelion passage falls within one step is integrated past the sun ~1e10 m away and its collision is not
+# there to be found. Sungrazers need steps much shorter than their perihelion passage. After a collision the run
+# carries on through the singularity (which is how bodies used to be thrown out of the solar system without anybody
+# noticing); stopOn=('collision',) stops it instead.
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Settings ------------------------------------------------------------------------------------------------------------
+hillFactor          = 3.0                           # Close approaches are within this many Hill radii
+ejectionDistance    = 1.5e13                        # Unbound bodies further than this from the sun are ejected [m]
+skinSteps           = 8                             # Spare room of the grid, in steps of the fastest particle
+iterations          = 48                            # Most bisection and Newton iterations within a step
+samples             = 9                             # Points per step at which the distance is first looked at
+maxCells            = 2**16                         # Cells a query may visit before it looks at every particle instead
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Uniform grid --------------------------------------------------------------------------------------------------------
+# Points sorted by the cell of side cellSize they are in, so that the points of one cell are one slice of the sorted
+# order; np.searchsorted finds the slice of any cell, and empty cells take no memory. Cell coordinates are clipped to
+# 2**20 cells either side of the origin, which only puts far away points together in the edge cells.
+class UniformGrid:
+    halfOffsets = np.array([(i, j, k) for i in (-1, 0, 1) for j in (-1, 0, 1) for k in (-1, 0, 1)
+                            if (i, j, k) > (0, 0, 0)])
+
+    def __init__(self, position, cellSize):
+        self.cellSize = float(cellSize)
+        self.cells = self._cells(position)
+        keys = self._key(self.cells)
+        self.order = np.argsort(keys, kind='stable')
+        self.keys = keys[self.order]
+
+    def __len__(self):
+        return len(self.order)
+
+    def _cells(self, position):
+        return np.clip(np.floor(position/self.cellSize), -2**20, 2**20 - 1).astype(np.int64)
+
+    @staticmethod
+    def _key(cells):
+        cells = cells + 2**20
+        return (cells[..., 0]*2**21 + cells[..., 1])*2**21 + cells[..., 2]
+
+    # The points (positions in the sorted order) of the cells with the given keys, as (owner, point) pairs
+    def _expand(self, keys, owner):
+        start = np.searchsorted(self.keys, keys, 'left')
+        counts = np.searchsorted(self.keys, keys, 'right') - start
+        first = np.repeat(start - np.cumsum(counts) + counts, counts)
+        return np.repeat(owner, counts), first + np.arange(counts.sum())
+
+    # The points in the cells touched by the boxes around spheres (a superset of those in the spheres), for Q spheres
+    # at once, as (sphere, point index) pairs. A box of more cells than there are points takes every point instead.
+    def within(self, centre, radius):
+        low, high = self._cells(centre - radius[:, None]), self._cells(centre + radius[:, None])
+        size = high - low + 1
+        counts = np.prod(size, axis=1)
+        everything = np.flatnonzero(counts > min(maxCells, len(self.order)))
+        counts[everything] = 0
+        owner = np.repeat(np.arange(len(centre)), counts)
+        cell = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        ny, nz = size[owner, 1], size[owner, 2]
+        cells = low[owner] + np.stack([cell//(ny*nz), (cell//nz) % ny, cell % nz], axis=-1)
+        owner, point = self._expand(self._key(cells), owner)
+        owner = np.concatenate([owner, np.repeat(everything, len(self.order))])
+        point = np.concatenate([point, np.tile(np.arange(len(self.order)), len(everything))])
+        return owner, self.order[point]
+
+    # Every pair (i, j) of points in the same or in neighbouring cells, each pair once, as two index arrays
+    def neighbours(self):
+        sortedCells = self.cells[self.order]
+        owners = np.arange(len(self.order))
+        first, second = [], []
+        owner, point = self._expand(self.keys, owners)
+        keep = point > owner
+        first.append(owner[keep])
+        second.append(point[keep])
+        for offset in self.halfOffsets:
+            owner, point = self._expand(self._key(sortedCells + offset), owners)
+            first.append(owner)
+            second.append(point)
+        return self.order[np.concatenate(first)], self.order[np.concatenate(second)]
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Motion within a step ------------------------------------------------------------------------------------------------
+# Formula 4 for M curves at once; coefficients are (p0, p1-p0, a, b), each of shape (M,3), and tau has shape (M,) or
+# (M,K)
+def hermite(p0, p1, v0, v1, dt):
+    chord = p1 - p0
+    return p0, chord, dt*v0 - chord, dt*v1 - chord
+
+def _at(curve, tau):
+    p0, chord, a, b = curve
+    tau = tau[..., None]
+    if tau.ndim == 3:
+        p0, chord, a, b = p0[:, None], chord[:, None], a[:, None], b[:, None]
+    return p0 + tau*chord + tau*(1 - tau)**2*a - tau**2*(1 - tau)*b
+
+def _distance(curve, tau):
+    position = _at(curve, tau)
+    return np.sqrt(np.einsum('...j,...j->...', position, position))
+
+# The time of the smallest distance along every curve (as a fraction tau of the step) and that distance: the best of
+# a few evenly spaced points, refined with Newton's iteration on the derivative of the squared distance, p.p', kept
+# between the neighbouring points (bisecting when a Newton step would leave them). Given a level (one per curve), only
+# the curves that could come below it are refined: the speed along a curve is at most |p1-p0|+|a|+|b| per step, so no
+# point is closer than the best sample minus that speed times half the sample spacing.
+def closestApproach(curve, level=None):
+    p0, chord, a, b = curve
+    count = len(p0)
+    grid = np.broadcast_to(np.linspace(0, 1, samples), (count, samples))
+    distance = _distance(curve, grid)
+    best = np.argmin(distance, axis=1)
+    tau, closest = best/(samples - 1), distance[np.arange(count), best]
+    refine = np.arange(count)
+    if level is not None:
+        speed = np.linalg.norm(chord, axis=1) + np.linalg.norm(a, axis=1) + np.linalg.norm(b, axis=1)
+        refine = np.flatnonzero(closest - 0.5*speed/(samples - 1) < level)
+        if len(refine) == 0:
+            return tau, closest
+    p0, chord, a, b = part = tuple(item[refine] for item in curve)
+    low = np.maximum(best[refine] - 1, 0)/(samples - 1)
+    high = np.minimum(best[refine] + 1, samples - 1)/(samples - 1)
+    t = tau[refine]
+    for _ in range(iterations):
+        s = t[:, None]
+        position = _at(part, t)
+        velocity = chord + (1 - s)*(1 - 3*s)*a - s*(2 - 3*s)*b                   # dp/dtau
+        acceleration = (6*s - 4)*a + (6*s - 2)*b                                 # d2p/dtau2
+        slope = np.einsum('ij,ij->i', position, velocity)
+        curvature = np.einsum('ij,ij->i', velocity, velocity) + np.einsum('ij,ij->i', position, acceleration)
+        low, high = np.where(slope < 0, t, low), np.where(slope < 0, high, t)
+        newton = t - slope/np.where(curvature > 0, curvature, np.inf)
+        previous, t = t, np.where((curvature > 0) & (newton > low) & (newton < high), newton, 0.5*(low + high))
+        if np.all(np.abs(t - previous) <= 1e-12):
+            break
+    refined = _distance(part, t)
+    better = refined < closest[refine]
+    tau[refine[better]], closest[refine[better]] = t[better], refined[better]
+    return tau, closest
+
+# The time within [low, high] at which the distance along every curve passes level, by bisection; the distance has to
+# be on one side of level at low and on the other at high
+def crossing(curve, level, low, high):
+    low, high = np.array(low, dtype=np.float64), np.array(high, dtype=np.float64)
+    lowSide = _distance(curve, low) < level
+    for _ in range(iterations):
+        middle = 0.5*(low + high)
+        sameSide = (_distance(curve, middle) < level) == lowSide
+        low, high = np.where(sameSide, middle, low), np.where(sameSide, high, middle)
+    return 0.5*(low + high)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Detector ------------------------------------------------------------------------------------------------------------
+# Raised by the detector when an event of one of the kinds in stopOn happens, so that the run stops after that step
+class EncounterStop(Exception):
+    def __init__(self, event):
+        super().__init__('%s of %s at t = %.6g s' % (event['kind'], ' and '.join(
+            name for name in (event['body'], event['other']) if name), event['t']))
+        self.event = event
+
+# Radii of the bodies that are in the catalog (BodyCatalog.py), 0 for the others [m]
+def catalogRadii(names, catalog=None):
+    if catalog is None:
+        from BodyCatalog import loadCatalog
+        catalog = loadCatalog()
+    radius = np.array([catalog['radius'][catalog.index[name]] if name in catalog.index else 0.0 for name in names])
+    return np.nan_to_num(radius)
+
+# A recorder (see TrajectoryBuffer.py) that looks for events between every state it is given and the one before, and
+# keeps them in self.events, in the order they happen within a step. Every event is a dictionary with
+#   t         when it happened [s]
+#   kind      'approach', 'collision' or 'ejection'
+#   body      name of the body, and other, name of the other body (the sun for collisions with it, '' for ejections)
+#   distance  the distance at t [m]: the sum of the radii for a collision, ejectionDistance for an ejection, and the
+#             smallest distance so far for an approach, which also has
+#   closest   when that smallest distance was reached [s]
+#   end       the first step boundary after the bodies moved apart again (None while the approach goes on) [s]
+#   hillRadii the smallest distance in Hill radii of the larger body
+# A collision also has speed, the relative speed at impact [m/s], and an ejection energy, the orbital energy per unit
+# mass [J/kg]. Each pair collides and each body is ejected once; what happens to them afterwards is up to the run.
+#
+# Massive bodies (with their Hill spheres) are checked against each other pair by pair. The massless particles sit in
+# a UniformGrid built around the midpoints of a step, with spare room (the skin) for skinSteps steps of the fastest
+# particle: every massive body only looks at the particles in the cells near it, and the grid is only rebuilt once a
+# particle has left its spare room. Collisions between two particles (which are usually tracers with no size) are
+# only looked for with particleCollisions=True. The sun is checked against every body, which costs O(N) per step.
+class EncounterDetector:
+    def __init__(self, system, radius=None, hillFactor=hillFactor, ejectionDistance=ejectionDistance,
+                 particleCollisions=False, stopOn=(), skinSteps=skinSteps):
+        self.names = list(system.names)
+        self.mass = system.mass.copy()                                            # [kg]
+        if radius is None:
+            radius = catalogRadii(self.names)
+        elif isinstance(radius, dict):
+            radius = [radius.get(name, 0.0) for name in self.names]
+        self.radius = np.nan_to_num(np.array(radius, dtype=np.float64).reshape(-1))   # [m]
+        if len(self.radius) != len(self.names):
+            raise ValueError('radius must give one radius per body')
+        self.hillFactor = hillFactor
+        self.ejectionDistance = ejectionDistance
+        self.particleCollisions = particleCollisions
+        self.stopOn = set(stopOn)
+        self.skinSteps = skinSteps
+        self.mu = G*(self.mass[0] + self.mass)                                    # [m^3*s^(-2)]
+        self.hillScale = np.cbrt(self.mass/(3*self.mass[0]))                      # Formula 0 without r_i
+        self.hillScale[0] = 0.0
+        self.massive = np.flatnonzero(self.mass[1:] > 0) + 1
+        self.particles = np.flatnonzero(self.mass[1:] == 0) + 1
+
+        self.events = []
+        self._active = {}                           # (i, j): the event of every close approach going on
+        self._collided = set()
+        self._ejected = np.zeros(len(self.names), dtype=bool)
+        self._grid = None
+        self.checks = 0
+        self.rebuilds = 0
+        self._previous = (system.t, system.position.copy(), system.velocity.copy())
+
+    def record(self, t, position, velocity=None):
+        if velocity is None:
+            raise ValueError('the encounter detector needs the velocities as well as the positions')
+        t0, p0, v0 = self._previous
+        self._previous = (t, position.copy(), velocity.copy())
+        dt = t - t0
+        if dt == 0:
+            return
+        self.checks += 1
+        self._step = (t0, dt, p0, v0, position, velocity)
+        middle = 0.5*(p0 + position)
+        chord = position - p0
+        sweep = 0.5*np.linalg.norm(chord, axis=1) + 4/27*(np.linalg.norm(dt*v0 - chord, axis=1) +
+                                                          np.linalg.norm(dt*velocity - chord, axis=1))   # Formula 5
+        distance = np.linalg.norm(middle - middle[0], axis=1)
+        hill = self.hillFactor*self.hillScale*distance                           # Formula 1 threshold per body
+
+        new = self._sun(middle, sweep) + self._ejections(position, velocity)
+        first, second = self._candidates(middle, sweep, hill)
+        new += self._pairs(first, second, hill)
+        new.sort(key=lambda event: event['t'])
+        self.events += new
+        for event in new:
+            if event['kind'] in self.stopOn:
+                raise EncounterStop(event)
+
+    # The curves of formula 4 of body j relative to body i over the current step
+    def _relative(self, i, j):
+        t0, dt, p0, v0, p1, v1 = self._step
+        return hermite(p0[j] - p0[i], p1[j] - p1[i], v0[j] - v0[i], v1[j] - v1[i], dt)
+
+    def _event(self, t, kind, body, other, distance, **extra):
+        event = {'t': float(t), 'kind': kind, 'body': self.names[body], 'other': '' if other is None else
+                 self.names[other], 'distance': float(distance)}
+        event.update(extra)
+        return event
+
+    # Collisions of every body with the sun
+    def _sun(self, middle, sweep):
+        reach = self.radius[0] + self.radius[1:]
+        gap = np.linalg.norm(middle[1:] - middle[0], axis=1) - sweep[1:] - sweep[0]
+        candidates = np.flatnonzero((gap <= reach) & (reach > 0)) + 1
+        candidates = np.array([j for j in candidates if (0, j) not in self._collided], dtype=np.int64)
+        return self._collisions(np.zeros(len(candidates), dtype=np.int64), candidates)
+
+    def _collisions(self, first, second, tau=None, closest=None):
+        if len(first) == 0:
+            return []
+        t0, dt = self._step[:2]
+        curve = self._relative(first, second)
+        reach = self.radius[first] + self.radius[second]
+        if tau is None:
+            tau, closest = closestApproach(curve, reach)
+        hit = closest < reach
+        if not hit.any():
+            return []
+        curve = tuple(part[hit] for part in curve)
+        tau = crossing(curve, reach[hit], np.zeros(hit.sum()), tau[hit])
+        position = _at(curve, tau)
+        # The derivative of formula 4 along the step, divided by dt
+        p0, chord, a, b = curve
+        s = tau[:, None]
+        speed = np.linalg.norm(chord + (1 - s)*(1 - 3*s)*a - s*(2 - 3*s)*b, axis=1)/abs(dt)
+        events = []
+        for i, j, k in zip(first[hit], second[hit], range(hit.sum())):
+            self._collided.add((i, j))
+            events.append(self._event(t0 + tau[k]*dt, 'collision', j if i == 0 else i, i if i == 0 else j,
+                                      np.linalg.norm(position[k]), speed=float(speed[k])))
+        return events
+
+    # Bodies that are further than ejectionDistance from the sun, at the end of the step, on unbound orbits
+    def _ejections(self, position, velocity):
+        t0, dt, p0, v0 = self._step[:4]
+        distance = np.linalg.norm(position[1:] - position[0], axis=1)
+        speed2 = np.einsum('ij,ij->i', velocity[1:] - velocity[0], velocity[1:] - velocity[0])
+        energy = np.concatenate([[0.0], 0.5*speed2 - self.mu[1:]/distance])      # Formula 3 [J/kg]
+        bodies = np.flatnonzero((distance > self.ejectionDistance) & (energy[1:] > 0) & ~self._ejected[1:]) + 1
+        if len(bodies) == 0:
+            return []
+        self._ejected[bodies] = True
+        zeros = np.zeros(len(bodies), dtype=np.int64)
+        curve = self._relative(zeros, bodies)
+        inside = np.linalg.norm(p0[bodies] - p0[0], axis=1) <= self.ejectionDistance
+        tau = np.where(inside, crossing(curve, self.ejectionDistance, np.zeros(len(bodies)), np.ones(len(bodies))),
+                       1.0)
+        return [self._event(t0 + tau[k]*dt, 'ejection', j, None, self.ejectionDistance, energy=float(energy[j]))
+                for k, j in enumerate(bodies)]
+
+    # Pairs of bodies (not the sun) that could come within their thresholds during the step
+    def _candidates(self, middle, sweep, hill):
+        reach = np.maximum(hill, self.radius)
+        first, second = np.triu_indices(len(self.massive), 1)
+        first, second = [self.massive[first]], [self.massive[second]]
+
+        particles = self.particles
+        if len(particles):
+            grid = self._gridFor(middle, sweep)
+            skin = self._skin
+            outer = self.radius[particles].max() + 0.5*skin
+            owner, inside = grid.within(middle[self.massive], reach[self.massive] + sweep[self.massive] + outer)
+            first.append(self.massive[owner])
+            second.append(particles[inside])
+            if self.particleCollisions:
+                i, j = grid.neighbours()
+                i, j = particles[i], particles[j]
+                sized = self.radius[i] + self.radius[j] > 0
+                first.append(i[sized])
+                second.append(j[sized])
+        first, second = np.concatenate(first).astype(np.int64), np.concatenate(second).astype(np.int64)
+        first, second = np.minimum(first, second), np.maximum(first, second)
+        near = np.linalg.norm(middle[second] - middle[first], axis=1) <= reach[first] + reach[second] + \
+            sweep[first] + sweep[second]
+        return first[near], second[near]
+
+    # The grid of the particles, rebuilt around the current midpoints once a particle could have left its skin
+    def _gridFor(self, middle, sweep):
+        particles = self.particles
+        if self._grid is not None:
+            moved = np.linalg.norm(middle[particles] - self._built, axis=1) + sweep[particles]
+            if moved.max() <= 0.5*self._skin:
+                return self._grid
+        self._skin = max(2*self.skinSteps*sweep[particles].max(), 1.0)
+        self._built = middle[particles].copy()
+        self._grid = UniformGrid(self._built, 2*self.radius[particles].max() + self._skin)
+        self.rebuilds += 1
+        return self._grid
+
+    # Close approaches and collisions of the candidate pairs, and the end of the approaches that are over
+    def _pairs(self, first, second, hill):
+        t0, dt = self._step[:2]
+        events = []
+        inside = set()
+        if len(first):
+            threshold = np.maximum(hill[first], hill[second])
+            # Approaches going on only need the exact distance when it could beat the smallest one so far
+            level = threshold.copy()
+            for k, pair in enumerate(zip(first, second)):
+                if pair in self._active:
+                    level[k] = min(threshold[k], self._active[pair]['distance'])
+            tau, closest = closestApproach(self._relative(first, second),
+                                           np.maximum(level, self.radius[first] + self.radius[second]))
+            approach = np.flatnonzero(closest < threshold)
+            entering = np.array([k for k in approach if (first[k], second[k]) not in self._active], dtype=np.int64)
+            if len(entering):
+                curve = self._relative(first[entering], second[entering])
+                start = crossing(curve, threshold[entering], np.zeros(len(entering)), tau[entering])
+                startsInside = _distance(curve, np.zeros(len(entering))) < threshold[entering]
+                start = np.where(startsInside, 0.0, start)
+            for k in approach:
+                pair = (first[k], second[k])
+                inside.add(pair)
+                scale = threshold[k]/self.hillFactor
+                event = self._active.get(pair)
+                if event is None:
+                    i, j = pair if self.mass[pair[0]] >= self.mass[pair[1]] else pair[::-1]
+                    event = self._event(t0 + start[np.searchsorted(entering, k)]*dt, 'approach', j, i, closest[k],
+                                        closest=float(t0 + tau[k]*dt), end=None,
+                                        hillRadii=float(closest[k]/scale))
+                    self._active[pair] = event
+                    events.append(event)
+                elif closest[k] < event['distance']:
+                    event.update(distance=float(closest[k]), closest=float(t0 + tau[k]*dt),
+                                 hillRadii=float(closest[k]/scale))
+            collide = [k for k in np.flatnonzero(closest < self.radius[first] + self.radius[second])
+                       if (first[k], second[k]) not in self._collided]
+            events += self._collisions(first[collide], second[collide], tau[collide], closest[collide])
+        for pair in [pair for pair in self._active if pair not in inside]:
+            self._active.pop(pair)['end'] = float(t0)
+        return events
+
+    def summary(self):
+        counts = {}
+        for event in self.events:
+            counts[event['kind']] = counts.get(event['kind'], 0) + 1
+        return {'checks': self.checks, 'gridRebuilds': self.rebuilds, 'events': counts,
+                'ongoingApproaches': len(self._active)}
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Event log -----------------------------------------------------------------------------------------------------------
+eventColumns = ['t', 'kind', 'body', 'other', 'distance', 'closest', 'end', 'hillRadii', 'speed', 'energy']
+
+# Writing the events as JSON or, for a path ending in .csv, as a CSV table with one row per event
+def writeEvents(path, events, **extra):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if path.lower().endswith('.csv'):
+        with open(path, 'w', newline='') as handle:
+            writer = csv.writer(handle)
+            writer.writerow(eventColumns)
+            for event in events:
+                writer.writerow(['' if event.get(column) is None else event[column] for column in eventColumns])
+        return
+    with open(path, 'w') as handle:
+        json.dump(dict(extra, events=events), handle, indent=1)
+# ---------------------------------------------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    from BodyCatalog import loadCatalog
+    from Integrators import makeIntegrator
+
+    years = float(sys.argv[1]) if len(sys.argv) > 1 else 20.0
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    dt = secondsPerDay
+    nSteps = int(np.ceil(years*daysPerYear*secondsPerDay/dt))
+    catalog = loadCatalog()
+    system = catalog.system(forceModel='direct')
+
+    # Comets with perihelia inside the Earth's orbit, random orientations and phases; the first few graze the sun and
+    # the last few leave on hyperbolic orbits
+    rng = np.random.default_rng(2)
+    mu = G*system.mass[0]
+    perihelion = rng.uniform(0.3, 1.2, count)*1.496e11
+    perihelion[:count//100] = rng.uniform(0.5, 0.9, count//100)*catalog['radius'][0]
+    aphelion = rng.uniform(1.5, 6.0, count)*1.496e11
+    semiMajor = 0.5*(perihelion + aphelion)
+    distance = aphelion*rng.uniform(0.2, 1.0, count) + perihelion
+    distance = np.minimum(distance, aphelion)
+    speed = np.sqrt(mu*(2/distance - 1/semiMajor))
+    speed[-(count//100):] = np.sqrt(2*mu/distance[-(count//100):])*1.5
+    radial = rng.normal(size=(count, 3))
+    radial /= np.linalg.norm(radial, axis=1)[:, None]
+    radial[:, 2] *= 0.1
+    radial /= np.linalg.norm(radial, axis=1)[:, None]
+    # Angular momentum from the perihelion: h = sqrt(mu*q*(1+e)), so the flight angle follows from h = r*v*cos(angle)
+    eccentricity = (aphelion - perihelion)/(aphelion + perihelion)
+    cosine = np.clip(np.sqrt(mu*perihelion*(1 + eccentricity))/(distance*speed), 0, 1)
+    tangent = np.cross(radial, rng.normal(size=(count, 3)))
+    tangent /= np.linalg.norm(tangent, axis=1)[:, None]
+    sign = np.where(rng.random(count) < 0.5, -1.0, 1.0)
+    velocity = speed[:, None]*(cosine[:, None]*tangent + sign[:, None]*np.sqrt(1 - cosine**2)[:, None]*radial)
+    system.addTestParticles(distance[:, None]*radial, velocity)
+
+    radius = catalogRadii(system.names, catalog)
+    radius[system.mass == 0] = 5e3
+    detector = EncounterDetector(system, radius)
+    integrator = makeIntegrator('leapfrog')
+
+    start = time.perf_counter()
+    system.run(nSteps, dt, integrator=integrator)
+    runTime = time.perf_counter() - start
+
+    system = catalog.system(forceModel='direct')
+    system.addTestParticles(distance[:, None]*radial, velocity)
+    start = time.perf_counter()
+    system.run(nSteps, dt, detector, makeIntegrator('leapfrog'))
+    detectTime = time.perf_counter() - start - runTime
+
+    print('%g years, %d bodies: integration %.2f s, detection %.2f s more' % (years, system.n, runTime, detectTime))
+    print(detector.summary())
+    for event in detector.events[:40]:
+        print('%10.2f d  %-10s %-14s %-14s %10.4g m' % (event['t']/secondsPerDay, event['kind'], event['body'],
+                                                       event['other'], event['distance']),
+              '' if event['kind'] != 'approach' else '%.3g Hill radii' % event['hillRadii'])
@@ -0,0 +1,215 @@
+# Ensembles of runs: parameter sweeps and Monte Carlo perturbations of the initial conditions
+# Usage: python EnsembleRunner.py spec.json [--workers 8] [--output results.json]
+#
+# A spec is a JSON file (or dictionary) such as
+# {
+#     "base":   {"bodies": "all", "years": 10, "dt": 1, "integrator": "leapfrog", "forceModel": "sun"},
+#     "sweep":  {"initialVelocity.earth": [29000, 29290, 29500], "mass.jupiter": [1.0e27, 1.9e27, 3.8e27]},
+#     "sample": {"count": 100, "seed": 1,
+#                "perturb": {"initialVelocity.*": {"normal": 0.001}, "aphelion.mars": {"uniform": [-0.01, 0.01]}}}
+# }
+# Parameters are written "quantity.body", where quantity is mass, aphelion or initialVelocity (the dictionaries of
+# SolarSystemSimulation.py) and body '*' stands for every planet. Every combination of the "sweep" values is run
+# (their values replace the catalog's), and for each combination "count" random members are drawn in which every
+# "perturb" parameter is scaled by (1 + a random number) from a normal distribution with the given relative
+# standard deviation or a uniform distribution between the given relative bounds.
+# "bodies" is "all" for every planet, or the catalog names of the bodies to include, either as a list
+# (["earth", "mars"]) or comma separated like RunSimulation.py's --bodies ("earth,mars"). The sun is always included.
+
+import argparse
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from NBodyEngine import NBodySystem, secondsPerDay, daysPerYear
+from Integrators import makeIntegrator
+from BodyCatalog import loadCatalog
+from BatchedSystems import BatchedSystem, checkIntegrator
+from Diagnostics import totalEnergy
+
+# Settings ------------------------------------------------------------------------------------------------------------
+baseDefaults = {'bodies': 'all', 'years': 5.0, 'dt': 1.0, 'integrator': 'euler', 'forceModel': 'sun'}
+parameterQuantities = {'mass': 'mass', 'aphelion': 'aphelion', 'initialVelocity': 'minVelocity'}
+escapeDistance = 1e14                               # Bodies further than this from the sun are counted as ejected [m]
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Ensemble members ----------------------------------------------------------------------------------------------------
+# The base dictionaries (mass, aphelion, initialVelocity) for the bodies of a spec, taken from the catalog
+def baseDictionaries(catalog, base):
+    bodies = base['bodies']
+    if bodies == 'all':
+        planets = catalog.planets
+    else:
+        bodies = bodies.split(',') if isinstance(bodies, str) else bodies
+        planets = [name.strip().lower() for name in bodies]
+        unknown = [name for name in planets if name not in catalog.index]
+        if unknown:
+            raise ValueError('Unknown bodies: %s (the catalog has %s)' % (', '.join(unknown), ', '.join(catalog.names)))
+        planets = [name for name in planets if name != catalog.names[0]]
+    return {
+        'mass':             catalog.asDict('mass', [catalog.names[0]] + planets),
+        'aphelion':         catalog.asDict('aphelion', planets),
+        'initialVelocity':  catalog.asDict('minVelocity', planets),
+    }
+
+def _parameters(key, dictionaries):
+    quantity, body = key.split('.', 1)
+    if quantity not in parameterQuantities:
+        raise ValueError("Unknown parameter '%s', expected one of %s" % (key, ', '.join(parameterQuantities)))
+    bodies = list(dictionaries['aphelion']) if body == '*' else [body.lower()]
+    return [(quantity, name) for name in bodies]
+
+# Turning a spec into a list of members, each a dictionary of {(quantity, body): value} overrides
+def expandSpec(spec, dictionaries):
+    sweep = spec.get('sweep', {})
+    sample = spec.get('sample', {})
+    keys = list(sweep)
+    combinations = list(itertools.product(*[sweep[key] for key in keys])) if keys else [()]
+
+    rng = np.random.default_rng(sample.get('seed'))
+    count = int(sample.get('count', 1)) if sample else 1
+    members = []
+    for combination in combinations:
+        for _ in range(count):
+            member = {}
+            for key, value in zip(keys, combination):
+                for parameter in _parameters(key, dictionaries):
+                    member[parameter] = float(value)
+            for key, distribution in sample.get('perturb', {}).items():
+                for quantity, body in _parameters(key, dictionaries):
+                    value = member.get((quantity, body), dictionaries[quantity][body])
+                    if 'normal' in distribution:
+                        value *= 1 + rng.normal(0, distribution['normal'])
+                    elif 'uniform' in distribution:
+                        value *= 1 + rng.uniform(*distribution['uniform'])
+                    else:
+                        raise ValueError("'%s' needs a 'normal' or 'uniform' distribution" % key)
+                    member[quantity, body] = value
+            members.append(member)
+    return members
+
+# The system of one member: the base dictionaries with the member's overrides, started at aphelion like the scripts
+def memberSystem(dictionaries, member, forceModel='sun'):
+    values = {quantity: dict(dictionary) for quantity, dictionary in dictionaries.items()}
+    for (quantity, body), value in member.items():
+        values[quantity][body] = value
+    return NBodySystem.fromAphelion(values['mass'], values['aphelion'], values['initialVelocity'],
+                                    forceModel=forceModel)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Summaries -----------------------------------------------------------------------------------------------------------
+# A recorder that keeps running extremes instead of a trajectory: the closest and furthest each body got from the sun.
+# It works for one system (shape (N,3)) or a batch of them (shape (M,N,3), see BatchedSystems.py).
+class DistanceExtremes:
+    def __init__(self, shape):
+        self.closest = np.full(shape[:-2] + (shape[-2] - 1,), np.inf)               # [m]
+        self.furthest = np.zeros(shape[:-2] + (shape[-2] - 1,))                     # [m]
+
+    def record(self, t, position, velocity=None):
+        distance = position[..., 1:, :] - position[..., :1, :]
+        distance = np.sqrt(np.einsum('...j,...j->...', distance, distance))
+        np.minimum(self.closest, distance, out=self.closest)
+        np.maximum(self.furthest, distance, out=self.furthest)
+
+def summarise(system, initialEnergy, closest, furthest):
+    return {
+        'energyError':  float(abs((totalEnergy(system) - initialEnergy)/initialEnergy)),
+        'closest':      dict(zip(system.names[1:], closest.tolist())),                             # [m]
+        'furthest':     dict(zip(system.names[1:], furthest.tolist())),                            # [m]
+        'ejected':      [name for name, r in zip(system.names[1:], furthest) if r > escapeDistance],
+        'finalPosition': dict(zip(system.names, system.position.tolist())),                        # [m]
+    }
+
+# Mean, standard deviation, minimum and maximum over the members of every number in the summaries
+def aggregate(summaries):
+    statistics = {'members': len(summaries), 'ejections': sum(len(summary['ejected']) for summary in summaries)}
+    values = {'energyError': [summary['energyError'] for summary in summaries]}
+    for key in ('closest', 'furthest'):
+        for body in summaries[0][key] if summaries else []:
+            values['%s.%s' % (key, body)] = [summary[key][body] for summary in summaries]
+    for key, column in values.items():
+        column = np.array(column)
+        statistics[key] = {'mean': float(column.mean()), 'std': float(column.std()),
+                           'min': float(column.min()), 'max': float(column.max())}
+    return statistics
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Running members in parallel -----------------------------------------------------------------------------------------
+# The catalog data every worker needs is handed over once, when the worker process starts, rather than with every
+# member, and is only ever read.
+_shared = {}
+
+def _initialiseWorker(dictionaries, base):
+    _shared['dictionaries'] = dictionaries
+    _shared['base'] = base
+
+def runMember(member, dictionaries=None, base=None):
+    dictionaries = _shared['dictionaries'] if dictionaries is None else dictionaries
+    base = _shared['base'] if base is None else base
+    system = memberSystem(dictionaries, member, base['forceModel'])
+    integrator = makeIntegrator(base['integrator'])
+    dt = base['dt']*secondsPerDay
+    nSteps = int(np.ceil(base['years']*daysPerYear*secondsPerDay/dt))
+
+    initialEnergy = totalEnergy(system)
+    extremes = DistanceExtremes(system.position.shape)
+    system.run(nSteps, dt, recorder=extremes, integrator=integrator)
+    return summarise(system, initialEnergy, extremes.closest, extremes.furthest)
+
+# Running every member at once as one batch (see BatchedSystems.py), which suits many small systems
+def runBatch(members, dictionaries, base):
+    checkIntegrator(base['integrator'])
+    systems = [memberSystem(dictionaries, member, base['forceModel']) for member in members]
+    batch = BatchedSystem.fromSystems(systems)
+    integrator = makeIntegrator(base['integrator'])
+    dt = base['dt']*secondsPerDay
+    nSteps = int(np.ceil(base['years']*daysPerYear*secondsPerDay/dt))
+
+    extremes = DistanceExtremes(batch.position.shape)
+    batch.run(nSteps, dt, recorder=extremes, integrator=integrator)
+    return [summarise(batch.member(k), totalEnergy(system), extremes.closest[k], extremes.furthest[k])
+            for k, system in enumerate(systems)]
+
+# Running every member of a spec, either one at a time on a pool of worker processes (one per core by default) or,
+# with batched=True, all together as one batch in this process
+def runEnsemble(spec, workers=None, catalog=None, batched=False):
+    catalog = loadCatalog() if catalog is None else catalog
+    base = dict(baseDefaults, **spec.get('base', {}))
+    dictionaries = baseDictionaries(catalog, base)
+    members = expandSpec(spec, dictionaries)
+
+    workers = os.cpu_count() if workers is None else workers
+    if batched:
+        summaries = runBatch(members, dictionaries, base)
+    elif workers <= 1:
+        summaries = [runMember(member, dictionaries, base) for member in members]
+    else:
+        with ProcessPoolExecutor(workers, initializer=_initialiseWorker, initargs=(dictionaries, base)) as pool:
+            summaries = list(pool.map(runMember, members, chunksize=max(1, len(members)//(4*workers))))
+
+    for member, summary in zip(members, summaries):
+        summary['parameters'] = {'%s.%s' % key: value for key, value in member.items()}
+    return {'base': base, 'statistics': aggregate(summaries), 'members': summaries}
+# ---------------------------------------------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run an ensemble of perturbed solar system simulations.')
+    parser.add_argument('spec', help='JSON ensemble spec')
+    parser.add_argument('--workers', type=int, help='number of worker processes (default: one per core)')
+    parser.add_argument('--output', help='write every member summary and the statistics to this JSON file')
+    parser.add_argument('--batched', action='store_true',
+                        help='advance all members together as one batch instead of one at a time')
+    options = parser.parse_args()
+
+    with open(options.spec) as handle:
+        spec = json.load(handle)
+    start = time.perf_counter()
+    results = runEnsemble(spec, options.workers, batched=options.batched)
+    elapsed = time.perf_counter() - start
+    print(json.dumps(results['statistics'], indent=1))
+    print('%d members in %.3g s' % (len(results['members']), elapsed))
+    if options.output:
+        with open(options.output, 'w') as handle:
+            json.dump(results, handle, indent=1)
@@ -0,0 +1,298 @@
+# Chebyshev ephemerides of stored runs, for fast state queries at any time
+# Usage: python Ephemeris.py build runs/century ephemerides/century [--degree 12] [--tolerance 1]
+#        python Ephemeris.py query ephemerides/century mars 712 [713.5 ...]
+#
+# To know where Mars is on day 712 nobody should have to run the simulation again or search a trajectory: the run is
+# fitted once with piecewise Chebyshev polynomials, as the JPL ephemerides are, and the coefficients are kept on disk.
+# A query then costs a few multiply-adds per coordinate, for whole arrays of times at once.
+
+import argparse
+import json
+import os
+import sys
+from collections import OrderedDict
+import numpy as np
+from numpy.polynomial import chebyshev
+from NBodyEngine import secondsPerDay
+
+# Formulae ------------------------------------------------------------------------------------------------------------
+# On a segment [t_a, t_a+L] every coordinate of a body is a Chebyshev series of degree n in x:
+# x = 2*(t-t_a)/L - 1,   p(t) = sum_(k=0..n) c_k*T_k(x),   T_0 = 1, T_1 = x, T_(k+1) = 2*x*T_k - T_(k-1)            (0)
+# and its velocity is the derivative, another Chebyshev series (whose coefficients numpy's chebder works out):
+# v(t) = 2/L*sum_(k=0..n) c_k*T_k'(x)                                                                               (1)
+# The coefficients of a segment are the least squares fit to the positions recorded in it. The JPL fits also take in
+# the velocities (times L/2 here, so that both residuals are in metres), and velocities=True does the same; but the
+# velocities of a low order integrator are not the derivative of its positions to better than O(dt^2) (~5 m/s for
+# Mercury with half day leapfrog steps), so by default only the positions are fitted and the velocities are those of
+# formula 1, the derivative of the fitted path.
+# Neighbouring segments share their end record, so the pieces join up to within the fit error.
+#
+# Every body gets its own segment length, as in the JPL ephemerides (8 days for Mercury, 32 for Jupiter): the longest
+# power of two number of steps between records for which the largest residual stays within the tolerance. Residuals
+# are only seen at the records, so a segment holds at least twice as many records as there are coefficients. When
+# even the shortest segment misses the tolerance (a run recorded too sparsely, or in float32) it is used anyway, and
+# the error it reaches is stored with the body.
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Settings ------------------------------------------------------------------------------------------------------------
+degree = 12                                         # Degree of the series (13 coefficients per coordinate)
+tolerance = 1.0                                     # Largest fit residual allowed [m]
+blockSegments = 64                                  # Segments read from disk and cached together
+cacheBlocks = 256                                   # Blocks kept in memory, the least recently used dropped first
+queryChunk = 2**16                                  # Query times evaluated at once, bounding the memory of a batch
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Fitting -------------------------------------------------------------------------------------------------------------
+# Design matrix of formulae 0 and 1 on `records` evenly spaced records of a segment: rows for the positions, then rows
+# for the velocities times L/2
+def _designMatrix(records, nCoefficients, withVelocities):
+    x = np.linspace(-1.0, 1.0, records)
+    matrix = chebyshev.chebvander(x, nCoefficients - 1)
+    if not withVelocities:
+        return matrix
+    derivative = chebyshev.chebder(np.eye(nCoefficients), axis=0)               # column k: the series of T_k'
+    return np.vstack([matrix, chebyshev.chebvander(x, nCoefficients - 2) @ derivative])
+
+# Fitting one body with segments of `span` steps between records (span+1 records each); the last segment is moved
+# back so that it is full. Returns the first record of every segment, the coefficients (segments, n+1, 3) and the
+# largest residual [m].
+def _fitBody(position, velocity, spacing, span, nCoefficients):
+    records = len(position)
+    count = -(-(records - 1)//span)
+    starts = np.minimum(np.arange(count)*span, records - 1 - span)
+    index = starts[:, None] + np.arange(span + 1)
+    samples = position[index]
+    if velocity is not None:
+        samples = np.concatenate([samples, velocity[index]*(span*spacing/2)], axis=1)
+    matrix = _designMatrix(span + 1, nCoefficients, velocity is not None)
+    coefficients = np.einsum('kr,grc->gkc', np.linalg.pinv(matrix), samples)
+    residual = np.einsum('rk,gkc->grc', matrix, coefficients) - samples
+    return starts, coefficients, float(np.sqrt(np.einsum('grc,grc->gr', residual, residual).max()))
+
+# Fitting the bodies of a run (a TrajectoryBuffer, or a StoredTrajectory from TrajectoryIO.openTrajectory) recorded
+# at evenly spaced times. With velocities=True the recorded velocities are fitted too, when the run has them.
+# The first record of a run is one step after its start, so the initial state that a stored run keeps next to its
+# records is fitted as well, and the ephemeris covers the run from its start time (a TrajectoryBuffer has no initial
+# state, so its ephemeris starts at the first record).
+def fitEphemeris(trajectory, bodies=None, degree=degree, tolerance=tolerance, velocities=False):
+    times = np.asarray(trajectory.times(), dtype=np.float64)
+    initial = getattr(trajectory, 'initialPosition', None) is not None
+    if initial and len(times) > 1:
+        startTime = trajectory.metadata.get('startTime', times[0] - (times[1] - times[0]))
+        initial = np.isclose(times[0] - startTime, times[1] - times[0], rtol=1e-6, atol=0.0)
+        if initial:
+            times = np.concatenate([[startTime], times])
+    nCoefficients = degree + 1
+    shortest = 2**int(np.ceil(np.log2(2*nCoefficients - 1)))
+    if len(times) < shortest + 1:
+        raise ValueError('an ephemeris of degree %d needs at least %d records, the run has %d'
+                         % (degree, shortest + 1, len(times)))
+    spacing = (times[-1] - times[0])/(len(times) - 1)
+    if not np.allclose(np.diff(times), spacing, rtol=1e-6, atol=0.0):
+        raise ValueError('the records of the run are not evenly spaced in time')
+    if velocities:
+        try:
+            trajectory.velocities()
+        except ValueError:
+            velocities = False
+
+    names = list(trajectory.names) if bodies is None else list(bodies)
+    entries, tables, offset = [], [], 0
+    for name in names:
+        k = trajectory.index[name]
+        position = np.asarray(trajectory.positions()[:, k, :], dtype=np.float64)
+        velocity = np.asarray(trajectory.velocities()[:, k, :], dtype=np.float64) if velocities else None
+        if initial:
+            position = np.concatenate([trajectory.initialPosition[k:k+1], position])
+            if velocity is not None:
+                velocity = np.concatenate([trajectory.initialVelocity[k:k+1], velocity])
+
+        # Doubling the segments for as long as they fit (the residual grows with the length of the segment)
+        span = shortest
+        fit = _fitBody(position, velocity, spacing, span, nCoefficients)
+        while 2*span <= len(times) - 1:
+            longer = _fitBody(position, velocity, spacing, 2*span, nCoefficients)
+            if longer[2] > tolerance:
+                break
+            span, fit = 2*span, longer
+        starts, coefficients, error = fit
+        entries.append({'name': name, 'offset': offset, 'count': len(starts), 'span': span,
+                        'start': float(times[0]),                                       # [s]
+                        'length': float(span*spacing),                                  # [s]
+                        'lastStart': float(times[0] + starts[-1]*spacing),              # [s]
+                        'fitError': error})                                             # [m]
+        tables.append(coefficients)
+        offset += len(starts)
+
+    metadata = {'names': names, 'degree': degree, 'tolerance': tolerance, 'velocitiesFitted': bool(velocities),
+                'start': float(times[0]), 'end': float(times[-1]), 'spacing': float(spacing), 'bodies': entries}
+    run = getattr(trajectory, 'metadata', None)
+    if run is not None:
+        metadata['run'] = {key: run[key] for key in ('dt', 'integrator', 'forceModel') if key in run}
+    return Ephemeris(metadata, np.concatenate(tables))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Ephemeris -----------------------------------------------------------------------------------------------------------
+# The coefficient table (segments, degree+1, 3) of all the bodies, one after the other, and its metadata. Opened from
+# disk the table is a memory map, and segments are read from it blockSegments at a time. A read block is decoded
+# (copied into memory, with the coefficients of the velocity series of formula 1 worked out) and kept in an LRU cache
+# of cacheBlocks blocks, so the intervals that keep being asked about stay in memory.
+class Ephemeris:
+    def __init__(self, metadata, coefficients, cacheBlocks=cacheBlocks):
+        self.metadata = metadata
+        self.names = metadata['names']
+        self.index = {name: k for k, name in enumerate(self.names)}
+        self.bodies = metadata['bodies']
+        self.start, self.end = metadata['start'], metadata['end']                      # [s]
+        self.coefficients = coefficients
+        self.cacheBlocks = cacheBlocks
+        self._blocks = OrderedDict()
+        self.hits, self.misses = 0, 0
+
+    def _block(self, body, block):
+        key = (body, block)
+        if key in self._blocks:
+            self._blocks.move_to_end(key)
+            self.hits += 1
+            return self._blocks[key]
+        self.misses += 1
+        entry = self.bodies[body]
+        first = entry['offset'] + block*blockSegments
+        last = entry['offset'] + min(entry['count'], (block + 1)*blockSegments)
+        position = np.array(self.coefficients[first:last], dtype=np.float64)
+        decoded = (position, chebyshev.chebder(position, axis=1)*(2.0/entry['length']))
+        self._blocks[key] = decoded
+        if len(self._blocks) > self.cacheBlocks:
+            self._blocks.popitem(last=False)
+        return decoded
+
+    # Position (and velocity) of one body at the times t (1d, within the ephemeris), both of shape (times,3)
+    def _evaluate(self, body, t, velocities):
+        entry = self.bodies[body]
+        count, length = entry['count'], entry['length']
+        segment = np.clip(((t - entry['start'])//length).astype(np.int64), 0, count - 1)
+        start = np.where(segment == count - 1, entry['lastStart'], entry['start'] + segment*length)
+        x = 2.0*(t - start)/length - 1.0
+
+        # Gathering the coefficients of every query from the blocks it falls in
+        block = segment//blockSegments
+        present = np.bincount(block, minlength=1) > 0
+        used = np.flatnonzero(present)
+        decoded = [self._block(body, int(k)) for k in used]
+        if len(decoded) == 1:
+            row = segment - used[0]*blockSegments
+            positionTable, velocityTable = decoded[0]
+        else:
+            slot = np.cumsum(present) - 1
+            row = slot[block]*blockSegments + segment % blockSegments
+            positionTable = np.concatenate([part[0] for part in decoded])
+            velocityTable = np.concatenate([part[1] for part in decoded])
+
+        # T_k(x) of every query (formula 0), then each series as a (1,n+1) by (n+1,3) product per query
+        nCoefficients = positionTable.shape[1]
+        basis = np.empty((len(t), 1, nCoefficients))
+        basis[:, 0, 0], basis[:, 0, 1] = 1.0, x
+        for k in range(2, nCoefficients):
+            basis[:, 0, k] = 2.0*x*basis[:, 0, k-1] - basis[:, 0, k-2]
+        position = (basis @ positionTable[row])[:, 0]
+        if not velocities:
+            return position, None
+        return position, (basis[:, :, :-1] @ velocityTable[row])[:, 0]
+
+    # Positions [m] and velocities [m/s] of the bodies at the times t [s] (a number or an array of any shape), of
+    # shape t.shape+(bodies,3). bodies is a list of names, None for all of them, or one name (then without the bodies
+    # axis). With velocities=False only the positions are worked out, and the velocities returned are None.
+    def state(self, t, bodies=None, velocities=True):
+        single = isinstance(bodies, str)
+        names = self.names if bodies is None else ([bodies] if single else list(bodies))
+        unknown = [name for name in names if name not in self.index]
+        if unknown:
+            raise ValueError('No ephemeris for %s (it has %s)' % (', '.join(unknown), ', '.join(self.names)))
+        t = np.asarray(t, dtype=np.float64)
+        flat = t.reshape(-1)
+        slack = 1e-9*max(abs(self.start), abs(self.end), 1.0)
+        if flat.size and (flat.min() < self.start - slack or flat.max() > self.end + slack):
+            raise ValueError('Times outside the ephemeris, which covers %.6g to %.6g s' % (self.start, self.end))
+
+        position = np.empty((flat.size, len(names), 3))
+        velocity = np.empty_like(position) if velocities else None
+        for first in range(0, flat.size, queryChunk):
+            chunk = flat[first:first + queryChunk]
+            for column, name in enumerate(names):
+                p, v = self._evaluate(self.index[name], chunk, velocities)
+                position[first:first + len(chunk), column] = p
+                if velocities:
+                    velocity[first:first + len(chunk), column] = v
+        shape = t.shape if single else t.shape + (len(names),)
+        position = position.reshape(shape + (3,))
+        return position, (velocity.reshape(shape + (3,)) if velocities else None)
+
+    def position(self, t, bodies=None):
+        return self.state(t, bodies, velocities=False)[0]
+
+    def velocity(self, t, bodies=None):
+        return self.state(t, bodies)[1]
+
+    def summary(self):
+        return {'bodies': {entry['name']: {'segmentDays': entry['length']/secondsPerDay, 'segments': entry['count'],
+                                           'fitError': entry['fitError']} for entry in self.bodies},
+                'bytes': int(np.prod(self.coefficients.shape))*8,
+                'cachedBlocks': len(self._blocks), 'cacheHits': self.hits, 'cacheMisses': self.misses}
+
+    # An ephemeris is a directory: ephemeris.json and the coefficient table coefficients.npy
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'coefficients.npy'), np.asarray(self.coefficients, dtype=np.float64))
+        with open(os.path.join(path, 'ephemeris.json'), 'w') as handle:
+            json.dump(self.metadata, handle, indent=1)
+
+# Opening a saved ephemeris without loading its table
+def openEphemeris(path, cacheBlocks=cacheBlocks):
+    with open(os.path.join(path, 'ephemeris.json')) as handle:
+        metadata = json.load(handle)
+    return Ephemeris(metadata, np.load(os.path.join(path, 'coefficients.npy'), mmap_mode='r'), cacheBlocks)
+# ---------------------------------------------------------------------------------------------------------------------
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='Build Chebyshev ephemerides of stored runs, and query them.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help='fit a run stored by RunSimulation.py --output')
+    build.add_argument('trajectory', help='the stored run (see TrajectoryIO.py)')
+    build.add_argument('ephemeris', help='directory to write the ephemeris to')
+    build.add_argument('--bodies', help='comma separated bodies (default: all)')
+    build.add_argument('--degree', type=int, default=degree, help='degree of the series (default: %d)' % degree)
+    build.add_argument('--tolerance', type=float, default=tolerance,
+                       help='largest fit residual [m] (default: %g)' % tolerance)
+    query = commands.add_parser('query', help='print the state of a body at some times')
+    query.add_argument('ephemeris')
+    query.add_argument('body')
+    query.add_argument('days', type=float, nargs='+', help='times [days]')
+    options = parser.parse_args(arguments)
+
+    if options.command == 'build':
+        from TrajectoryIO import openTrajectory
+        with openTrajectory(options.trajectory) as trajectory:
+            bodies = None if options.bodies is None else [name.strip().lower() for name in options.bodies.split(',')]
+            ephemeris = fitEphemeris(trajectory, bodies, options.degree, options.tolerance)
+            stored = trajectory.positions().shape
+        ephemeris.save(options.ephemeris)
+        summary = ephemeris.summary()
+        print('%-12s %14s %10s %14s' % ('body', 'segment [d]', 'segments', 'fit error [m]'))
+        for name, entry in summary['bodies'].items():
+            print('%-12s %14.4g %10d %14.3g' % (name, entry['segmentDays'], entry['segments'], entry['fitError']))
+        print('%.3g MB of coefficients for %d records of %d bodies' % (summary['bytes']/1e6, stored[0], stored[1]))
+        return ephemeris
+
+    ephemeris = openEphemeris(options.ephemeris)
+    try:
+        position, velocity = ephemeris.state(np.array(options.days)*secondsPerDay, options.body)
+    except ValueError as error:
+        sys.exit(str(error))
+    print('%10s %15s %15s %15s %13s %13s %13s' % ('day', 'x [m]', 'y [m]', 'z [m]', 'vx [m/s]', 'vy [m/s]',
+                                                  'vz [m/s]'))
+    for day, p, v in zip(options.days, position, velocity):
+        print('%10.4f %15.8e %15.8e %15.8e %13.6e %13.6e %13.6e' % ((day,) + tuple(p) + tuple(v)))
+    return ephemeris
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+# Rendering a saved trajectory to a video, a GIF or a numbered PNG sequence, without a display
+# Usage: python ExportAnimation.py runs/century orbits.mp4 [--stride 10] [--trail 500] [--width 1920 --height 1080]
+#        python ExportAnimation.py runs/century frames/ [--workers 8]
+#
+# The frames are drawn by OrbitRenderer.py on the Agg backend, split into blocks of consecutive frames over a pool of
+# worker processes. Each worker opens the trajectory itself (a memory map, see TrajectoryIO.py) and keeps one figure
+# for all its blocks. PNG frames are written by the workers straight into the directory; for a video or GIF the
+# workers hand back the raw pixels in order and this process streams them into ffmpeg (or Pillow, for a GIF when
+# ffmpeg is not installed), with only a few blocks in flight at a time.
+
+import argparse
+import os
+import shutil
+import subprocess
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from TrajectoryIO import openTrajectory
+from OrbitRenderer import OrbitRenderer
+
+# Settings ------------------------------------------------------------------------------------------------------------
+dpi         = 100                                   # Pixels per inch of the figure (width and height are in pixels)
+blockFrames = 32                                    # Consecutive frames per task handed to a worker
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Drawing frames ------------------------------------------------------------------------------------------------------
+# Everything but the bodies (grid, axes, ticks) is drawn once and copied back in for every frame, and only the trails,
+# markers and labels are drawn on top: the same blitting as on screen, so a frame costs little more than its bodies.
+class FrameRenderer:
+    def __init__(self, path, width, height, stride, trailLength, bodies=None, limit=None):
+        self.trajectory = openTrajectory(path)
+        fig = plt.figure(figsize=(width/dpi, height/dpi), dpi=dpi)
+        ax = fig.add_axes([0.06, 0.06, 0.9, 0.9])
+        self.renderer = OrbitRenderer(self.trajectory, bodies, ax, trailLength, stride, limit)
+        self.canvas = fig.canvas
+        for artist in self.renderer.artists:
+            artist.set_animated(True)
+        self.canvas.draw()
+        self.background = self.canvas.copy_from_bbox(fig.bbox)
+        self.next = None                            # Frame that follows the last one drawn
+
+    @property
+    def frames(self):
+        return self.renderer.frames
+
+    # Frame i as an (height, width, 3) array of pixels
+    def draw(self, i):
+        if i != self.next:
+            self.renderer.seek(i)
+        self.renderer.update(i)
+        self.next = i + 1
+        self.canvas.restore_region(self.background)
+        for artist in self.renderer.artists:
+            self.renderer.ax.draw_artist(artist)
+        return np.asarray(self.canvas.buffer_rgba())[:, :, :3]
+
+_shared = {}
+
+def _initialiseWorker(*settings):
+    _shared['renderer'] = FrameRenderer(*settings)
+
+# One block of frames: written as PNG files when there is a directory, otherwise returned as raw RGB bytes
+def renderBlock(start, stop, directory=None, renderer=None):
+    from PIL import Image
+
+    renderer = _shared['renderer'] if renderer is None else renderer
+    pixels = []
+    for i in range(start, stop):
+        frame = renderer.draw(i)
+        if directory is None:
+            pixels.append(frame.tobytes())
+        else:
+            Image.fromarray(frame).save(os.path.join(directory, 'frame%06d.png' % i), compress_level=1)
+    return pixels
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Encoders ------------------------------------------------------------------------------------------------------------
+# Raw RGB frames piped into ffmpeg, which writes whatever the file name asks for (MP4, GIF, WebM, ...)
+class FfmpegEncoder:
+    def __init__(self, output, width, height, fps):
+        command = ['ffmpeg', '-loglevel', 'error', '-y', '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+                   '-s', '%dx%d' % (width, height), '-r', str(fps), '-i', '-']
+        if output.lower().endswith('.mp4'):
+            command += ['-c:v', 'libx264', '-pix_fmt', 'yuv420p']
+        self.process = subprocess.Popen(command + [output], stdin=subprocess.PIPE)
+
+    def write(self, frame):
+        self.process.stdin.write(frame)
+
+    def close(self):
+        self.process.stdin.close()
+        if self.process.wait() != 0:
+            raise RuntimeError('ffmpeg failed with exit code %d' % self.process.returncode)
+
+# GIFs without ffmpeg: Pillow needs every frame before it can write the file, so this suits short clips
+class PillowGifEncoder:
+    def __init__(self, output, width, height, fps):
+        self.output, self.size, self.duration = output, (width, height), 1000.0/fps
+        self.frames = []
+
+    def write(self, frame):
+        from PIL import Image
+        self.frames.append(Image.frombytes('RGB', self.size, frame).quantize(colors=64))
+
+    def close(self):
+        self.frames[0].save(self.output, save_all=True, append_images=self.frames[1:], duration=self.duration, loop=0)
+
+def makeEncoder(output, width, height, fps):
+    if shutil.which('ffmpeg'):
+        return FfmpegEncoder(output, width, height, fps)
+    if output.lower().endswith('.gif'):
+        return PillowGifEncoder(output, width, height, fps)
+    raise RuntimeError('Writing %s needs ffmpeg on the PATH (a .gif or a PNG directory does not)' % output)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Export --------------------------------------------------------------------------------------------------------------
+# Rendering every frame of a saved trajectory into output: a directory (PNG sequence) or a video/GIF file. Width and
+# height are in pixels (even numbers suit most video codecs). Returns the number of frames and frames per second.
+def exportAnimation(path, output, width=1280, height=1280, stride=1, trailLength=500, bodies=None, limit=None,
+                    fps=30, workers=None, progress=True):
+    start = time.perf_counter()
+    settings = (path, width, height, stride, trailLength, bodies, limit)
+    with openTrajectory(path) as trajectory:
+        nFrames = len(trajectory)//max(1, int(stride))
+    blocks = [(first, min(first + blockFrames, nFrames)) for first in range(0, nFrames, blockFrames)]
+
+    directory = None
+    encoder = None
+    if os.path.splitext(output)[1] == '':
+        directory = output
+        os.makedirs(directory, exist_ok=True)
+    else:
+        encoder = makeEncoder(output, width, height, fps)
+
+    def finished(pixels, done):
+        for frame in pixels:
+            encoder.write(frame)
+        if progress:
+            print('%5.1f%%  %d frames' % (100.0*done/nFrames, done), flush=True)
+
+    workers = os.cpu_count() if workers is None else workers
+    if workers <= 1:
+        renderer = FrameRenderer(*settings)
+        for first, last in blocks:
+            finished(renderBlock(first, last, directory, renderer), last)
+    else:
+        # Blocks go out in order and come back in order; only a few per worker are in flight, so frames waiting for
+        # the encoder never pile up in memory
+        with ProcessPoolExecutor(workers, initializer=_initialiseWorker, initargs=settings) as pool:
+            pending = deque()
+            for first, last in blocks:
+                pending.append((pool.submit(renderBlock, first, last, directory), last))
+                if len(pending) >= 2*workers:
+                    future, done = pending.popleft()
+                    finished(future.result(), done)
+            while pending:
+                future, done = pending.popleft()
+                finished(future.result(), done)
+
+    if encoder is not None:
+        encoder.close()
+    return nFrames, nFrames/(time.perf_counter() - start)
+# ---------------------------------------------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Render a saved trajectory to a video, GIF or PNG sequence.')
+    parser.add_argument('path', help='trajectory directory or HDF5 file')
+    parser.add_argument('output', help='video or GIF file (e.g. orbits.mp4), or a directory for numbered PNG frames')
+    parser.add_argument('--bodies', help='comma separated bodies to draw (default: all)')
+    parser.add_argument('--width', type=int, default=1280, help='frame width [pixels] (default: 1280)')
+    parser.add_argument('--height', type=int, default=1280, help='frame height [pixels] (default: 1280)')
+    parser.add_argument('--stride', type=int, default=1, help='records per frame (default: 1)')
+    parser.add_argument('--trail', type=int, default=500, help='frames of trail behind each body (default: 500)')
+    parser.add_argument('--limit', type=float, help='half-width of the view [m] (default: fits the first record)')
+    parser.add_argument('--fps', type=int, default=30, help='frames per second of the video (default: 30)')
+    parser.add_argument('--workers', type=int, help='number of worker processes (default: one per core)')
+    parser.add_argument('--quiet', action='store_true', help='do not print progress')
+    options = parser.parse_args()
+
+    bodies = None if options.bodies is None else [name.strip().lower() for name in options.bodies.split(',')]
+    nFrames, rate = exportAnimation(options.path, options.output, options.width, options.height, options.stride,
+                                    options.trail, bodies, options.limit, options.fps, options.workers,
+                                    not options.quiet)
+    print('%d frames written to %s, %.1f frames/s' % (nFrames, options.output, rate))
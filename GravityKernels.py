@@ -0,0 +1,197 @@
+# Source for the tree algorithm: J. Barnes and P. Hut, "A hierarchical O(N log N) force-calculation algorithm",
+# Nature 324, 446-449 (1986)
+
+import numpy as np
+from NBodyEngine import G
+
+# Settings ------------------------------------------------------------------------------------------------------------
+blockElements   = 2**20                             # Largest number of (target, source) pairs held in memory at once
+leafSize        = 8                                 # Largest number of bodies kept in one leaf of the octree
+maxDepth        = 48                                # Deepest level of the octree (stops coincident bodies splitting)
+autoCrossover   = 1000                              # Number of massive bodies above which 'auto' uses the tree
+                                                    # (BenchmarkGravity.py measures the tree as faster from ~500
+                                                    # bodies; below ~1000 the saving is small next to its error)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Formulae ------------------------------------------------------------------------------------------------------------
+# The acceleration of body i due to every other body j is
+# a_i = G * sum_j m_j*(r_j-r_i)/(|r_j-r_i|^2+eps^2)^1.5                                                             (0)
+# where eps is an optional softening length that keeps close encounters finite.
+#
+# The direct kernel evaluates formula 0 for every pair, in blocks of targets so that memory stays bounded.
+#
+# The Barnes-Hut kernel groups far away bodies into the cells of an octree. A cell of side length s seen from a
+# distance d is replaced by a single body of the cell's total mass at its centre of mass when
+# s/d < theta                                                                                                       (1)
+# theta = 0 is the direct sum, larger theta is faster and less accurate (0.5 is the usual compromise).
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Direct summation ----------------------------------------------------------------------------------------------------
+# Acceleration of every target due to every source [m*s^(-2)]; a target on top of a source (itself) is skipped
+def directAcceleration(targets, sources, sourceMass, softening=0.0):
+    acceleration = np.zeros_like(targets)
+    blockSize = max(1, blockElements//max(1, len(sources)))
+
+    for start in range(0, len(targets), blockSize):
+        block = targets[start:start+blockSize]
+        distance = sources[None, :, :] - block[:, None, :]                         # [m]    shape (B,S,3)
+        modulus = np.einsum('ijk,ijk->ij', distance, distance) + softening**2       # [m^2]  shape (B,S)
+        modulus *= np.sqrt(modulus)                                                 # [m^3]
+        with np.errstate(divide='ignore'):
+            weight = np.where(modulus > 0, G*sourceMass/modulus, 0.0)               # [s^(-2)]
+        acceleration[start:start+blockSize] = np.einsum('ij,ijk->ik', weight, distance)
+
+    return acceleration
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Octree --------------------------------------------------------------------------------------------------------------
+# The tree is built one level at a time with array operations instead of recursion. The bodies are kept in an order
+# (self.order) in which the bodies of every cell are contiguous, so each cell only stores where its bodies start and
+# how many there are. Masses and centres of mass then come from running sums over that order.
+class Octree:
+    def __init__(self, position, mass):
+        self.position = position
+        self.mass = mass
+        nBodies = len(position)
+
+        low, high = position.min(axis=0), position.max(axis=0)
+        # Cell properties, one entry per cell; cell 0 is the root
+        centre  = ((low+high)/2)[None, :]                                   # [m]
+        half    = np.array([max((high-low).max()/2, 1.0)])                  # Half of the side length [m]
+        start   = np.array([0])
+        count   = np.array([nBodies])
+        parent  = np.array([-1])
+        octant  = np.array([0])
+        order   = np.arange(nBodies)
+
+        offsets = np.array([[(k >> 0) & 1, (k >> 1) & 1, (k >> 2) & 1] for k in range(8)])*2 - 1
+
+        level = np.array([0]) if nBodies > leafSize else np.array([], dtype=int)
+        depth = 0
+        while len(level) and depth < maxDepth:
+            levelStart, levelCount = start[level], count[level]
+
+            # Slots in self.order belonging to the cells being split, cell after cell
+            cell = np.repeat(np.arange(len(level)), levelCount)
+            slot = np.repeat(levelStart - np.cumsum(levelCount) + levelCount, levelCount) + np.arange(cell.size)
+            bodies = order[slot]
+
+            # Which octant of its cell every body falls in, then sorting the bodies by (cell, octant)
+            side = position[bodies] > centre[level][cell]
+            key = cell*8 + side[:, 0] + 2*side[:, 1] + 4*side[:, 2]
+            sort = np.argsort(key, kind='stable')
+            order[slot] = bodies[sort]
+
+            childCount = np.bincount(key, minlength=8*len(level)).reshape(-1, 8)
+            childStart = levelStart[:, None] + np.cumsum(childCount, axis=1) - childCount
+
+            # One new cell for every octant that holds at least one body
+            j, k = np.nonzero(childCount)
+            childHalf = half[level[j]]/2
+            newCells = len(count) + np.arange(len(j))
+            centre  = np.concatenate([centre, centre[level[j]] + offsets[k]*childHalf[:, None]])
+            half    = np.concatenate([half, childHalf])
+            start   = np.concatenate([start, childStart[j, k]])
+            count   = np.concatenate([count, childCount[j, k]])
+            parent  = np.concatenate([parent, level[j]])
+            octant  = np.concatenate([octant, k])
+
+            level = newCells[childCount[j, k] > leafSize]
+            depth += 1
+
+        self.order  = order
+        self.centre = centre
+        self.half   = half
+        self.start  = start
+        self.count  = count
+
+        # Children of every cell (-1 where an octant is empty)
+        self.children = -np.ones((len(self.count), 8), dtype=int)
+        self.children[parent[1:], octant[1:]] = np.arange(1, len(parent))
+        self.isLeaf = (self.children < 0).all(axis=1)
+
+        # Total mass and centre of mass of every cell from running sums over the ordered bodies
+        orderedMass = mass[order]
+        runningMass = np.concatenate([[0.0], np.cumsum(orderedMass)])
+        runningMoment = np.concatenate([np.zeros((1, 3)), np.cumsum(orderedMass[:, None]*position[order], axis=0)])
+        end = self.start + self.count
+        self.cellMass = runningMass[end] - runningMass[self.start]                          # [kg]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.centreOfMass = (runningMoment[end] - runningMoment[self.start])/self.cellMass[:, None]    # [m]
+        self.centreOfMass[self.cellMass <= 0] = self.centre[self.cellMass <= 0]
+
+    # Acceleration of every target [m*s^(-2)], walking the tree for a batch of targets at a time
+    def acceleration(self, targets, theta=0.5, softening=0.0, batchSize=4096):
+        acceleration = np.zeros_like(targets)
+        eps2 = softening**2
+        for first in range(0, len(targets), batchSize):
+            batch = targets[first:first+batchSize]
+            nBatch = len(batch)
+            result = np.zeros((nBatch, 3))
+
+            # Every (target, cell) pair still to be looked at, starting from the root
+            target = np.arange(nBatch)
+            cell = np.zeros(nBatch, dtype=int)
+            while target.size:
+                distance = self.centreOfMass[cell] - batch[target]
+                modulus = np.einsum('ij,ij->i', distance, distance)
+                # Formula 1, written without the square root as s^2 < theta^2*d^2
+                accept = (2*self.half[cell])**2 < theta**2*modulus
+                accept &= self.cellMass[cell] > 0
+
+                # Far cells act as a single body at their centre of mass
+                if accept.any():
+                    self._accumulate(result, target[accept], distance[accept], modulus[accept],
+                                     self.cellMass[cell[accept]], eps2)
+
+                # Near leaves are summed body by body
+                leaf = ~accept & self.isLeaf[cell]
+                if leaf.any():
+                    leafTarget, leafCell = target[leaf], cell[leaf]
+                    n = self.count[leafCell]
+                    pairTarget = np.repeat(leafTarget, n)
+                    slot = np.repeat(self.start[leafCell] - np.cumsum(n) + n, n) + np.arange(n.sum())
+                    body = self.order[slot]
+                    pairDistance = self.position[body] - batch[pairTarget]
+                    pairModulus = np.einsum('ij,ij->i', pairDistance, pairDistance)
+                    self._accumulate(result, pairTarget, pairDistance, pairModulus, self.mass[body], eps2)
+
+                # Near cells that are not leaves are opened into their children
+                opened = ~accept & ~self.isLeaf[cell]
+                children = self.children[cell[opened]]
+                valid = children >= 0
+                target = np.repeat(target[opened], valid.sum(axis=1))
+                cell = children[valid]
+
+            acceleration[first:first+batchSize] = result
+        return acceleration
+
+    # Adding G*m*d/(|d|^2+eps^2)^1.5 to the acceleration of each target, skipping a target on top of a body (itself)
+    @staticmethod
+    def _accumulate(result, target, distance, modulus, mass, eps2):
+        modulus = modulus + eps2
+        modulus *= np.sqrt(modulus)
+        with np.errstate(divide='ignore'):
+            weight = np.where(modulus > 0, G*mass/modulus, 0.0)
+        for i in range(3):
+            result[:, i] += np.bincount(target, weights=weight*distance[:, i], minlength=len(result))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Force evaluation ----------------------------------------------------------------------------------------------------
+# Acceleration of every body due to every massive body [m*s^(-2)]
+#   method = 'direct'     all pairs, exact, O(N^2)
+#            'barnesHut'  octree with opening angle theta, O(N log N)
+#            'auto'       direct below autoCrossover massive bodies, the tree above
+# Bodies with zero mass (test particles) feel the massive bodies but are never used as sources.
+def acceleration(position, mass, method='auto', theta=0.5, softening=0.0):
+    massive = mass > 0
+    sources, sourceMass = position[massive], mass[massive]
+
+    if method == 'auto':
+        method = 'direct' if len(sources) < autoCrossover else 'barnesHut'
+    if method == 'direct':
+        return directAcceleration(position, sources, sourceMass, softening)
+    if method == 'barnesHut':
+        return Octree(sources, sourceMass).acceleration(position, theta, softening)
+    raise ValueError("Unknown force method '%s', expected 'direct', 'barnesHut' or 'auto'" % method)
+# ---------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,267 @@
+# Analytic Kepler orbits where they are good enough, numerical integration only where they are not
+# Usage: python HybridPropagation.py [years] [threshold]
+#
+# Propagates the catalog's solar system (sun force model, as in SolarSystemSimulation.py) for that many years with
+# the hybrid propagator and with the original daily Euler step, and prints how long each took and how far each
+# planet ends up from an accurate (rkf45) run of the same force model.
+
+import sys
+import time
+import numpy as np
+from NBodyEngine import G, NBodySystem, secondsPerDay, daysPerYear
+from KeplerOrbits import KeplerOrbits, keplerDrift
+import GravityKernels
+
+# Formulae ------------------------------------------------------------------------------------------------------------
+# Relative to the sun, the acceleration of body i is its two-body (Kepler) part plus a perturbation:
+# a_i = -G*(M+m_i)*r_i/|r_i|^3 + p_i                                                                                (0)
+# p_i = G*sum_j m_j*(r_j-r_i)/|r_j-r_i|^3 - G*sum_(j!=i) m_j*r_j/|r_j|^3                                            (1)
+# The first sum (the direct pull of the other bodies) is there for the 'direct' force model only. The second (the
+# indirect term, from the sun being pulled by the other bodies) is there for every force model, the 'sun' model
+# included. The size of the perturbation next to the pull of the sun,
+# ratio_i = |p_i|*|r_i|^2/(G*(M+m_i))                                                                              (2)
+# decides how body i is propagated: below the threshold it follows its Kepler orbit (see KeplerOrbits.py), exactly
+# and at any time without stepping; above it (a close encounter, a strong resonance) it is integrated numerically
+# with Kepler drifts and kicks from formula 1, in which the other bodies are wherever their own propagation puts
+# them. For the planets the ratio goes from ~1e-5 (Mercury) to ~0.1 (Pluto, which feels the sun being swung around
+# by Jupiter and Saturn more than anything else).
+#
+# An analytic body drifts from the force model by roughly its ratio times the square of the number of orbits it has
+# made: over ten years in the 'sun' model Mercury to Mars end up ~0.5% of their distance from the sun away from an
+# accurate run (the daily Euler step of the original scripts is ~60% off for Mercury), while the numerical bodies
+# stay within ~1e-5 with dt of 30 days (~1e-7 with 5 days, at six times the cost).
+#
+# Cost: the checks are cheap (one set of array operations for all bodies), the numerical steps are not. A step is a
+# Kepler drift of the numerical bodies plus the analytic positions for its kick, about as much work as 25-30 daily
+# Euler steps of the whole system, so once any body is numerical the hybrid runs at about the speed of daily Euler
+# (0.1 s for ten years of the catalog with the defaults, as BenchmarkSuite.py and the comparison below show) and what
+# it buys is accuracy, not time. Only while every body is analytic is it faster: threshold=np.inf keeps every body
+# on its orbit, and any time is then reached in a millisecond. A lower threshold or a shorter dt trades speed for
+# accuracy.
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Settings ------------------------------------------------------------------------------------------------------------
+threshold       = 1e-4                              # Perturbation ratio above which a body is integrated numerically
+hysteresis      = 0.5                               # A numerical body goes back to its orbit below hysteresis*threshold
+checkInterval   = 30*secondsPerDay                  # How often the ratios are checked [s]
+stepLength      = 30*secondsPerDay                  # Longest step of the numerical bodies [s]
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Hybrid propagator ---------------------------------------------------------------------------------------------------
+# Holds the bodies of an NBodySystem relative to its sun: every body is either analytic (its KeplerOrbits orbit is
+# its state at any time) or numerical (its position and velocity are stepped with dt). The ratios of the analytic
+# bodies are checked every checkInterval; as long as there are no numerical bodies, a whole stretch of checks is one
+# set of array operations, so jumping years ahead costs no steps at all. The sun is put back where momentum
+# conservation says it is, so state() and system() return the same frame as the NBodySystem they started from.
+class HybridPropagator:
+    def __init__(self, system, threshold=threshold, dt=stepLength, checkInterval=checkInterval):
+        if system.forceModel not in ('sun', 'direct'):
+            raise ValueError("The hybrid propagator supports the 'sun' and 'direct' force models, not '%s'"
+                             % system.forceModel)
+        self.initial = system.copy()
+        self.names = list(system.names)
+        self.forceModel = system.forceModel
+        self.softening = system.softening
+        self.threshold = threshold
+        self.dt = dt
+        self.checkInterval = checkInterval
+        self.mass = system.mass[1:]                                               # [kg]
+        self.mu = G*(system.mass[0] + self.mass)                                  # [m^3*s^(-2)]
+        # The barycentre moves in a straight line, which is all that is needed to put the sun back
+        total = system.mass.sum()
+        self._barycentre = (system.mass @ system.position/total, system.mass @ system.velocity/total, system.t)
+        self._total = total
+        self._reset(system)
+
+    def _reset(self, system):
+        self.t = system.t                                                         # [s]
+        self.position = system.position[1:] - system.position[0]                  # [m]    heliocentric
+        self.velocity = system.velocity[1:] - system.velocity[0]                  # [m/s]
+        self.numerical = np.zeros(len(self.mass), dtype=bool)
+        self._kick = None
+        self._evaluated = None                                                    # Time of the analytic states [s]
+        self.steps = 0
+        self.checks = 0
+        self.events = []                                                          # (t [s], body, 'numerical'/'analytic')
+        self._classify(self.position)
+        self._refit()
+
+    # Formula 1 for every body, at one time (shape (N,3)) or several (shape (T,N,3))
+    def perturbation(self, position):
+        massive = self.mass > 0
+        r2 = np.einsum('...j,...j->...', position, position)
+        pull = (G*self.mass/(r2*np.sqrt(r2)))[..., None]*position                # G*m_j*r_j/|r_j|^3
+        indirect = pull.sum(axis=-2, keepdims=True) - pull
+        if self.forceModel == 'sun':
+            return -indirect
+        if position.ndim == 2:
+            direct = GravityKernels.directAcceleration(position, position[massive], self.mass[massive],
+                                                       self.softening)
+        else:
+            direct = np.stack([GravityKernels.directAcceleration(p, p[massive], self.mass[massive], self.softening)
+                               for p in position])
+        return direct - indirect
+
+    # Formula 2
+    def ratios(self, position):
+        p = self.perturbation(position)
+        return np.sqrt(np.einsum('...j,...j->...', p, p)*np.einsum('...j,...j->...', position, position)**2)/self.mu
+
+    # Moving bodies between the two kinds of propagation according to their ratios at the current time
+    def _classify(self, position):
+        ratio = self.ratios(position)
+        self.checks += 1
+        toNumerical = ~self.numerical & (ratio > self.threshold)
+        toAnalytic = self.numerical & (ratio < hysteresis*self.threshold)
+        for body in np.flatnonzero(toNumerical):
+            self.events.append((self.t, self.names[body + 1], 'numerical'))
+        for body in np.flatnonzero(toAnalytic):
+            self.events.append((self.t, self.names[body + 1], 'analytic'))
+        if toNumerical.any() or toAnalytic.any():
+            self.numerical = (self.numerical | toNumerical) & ~toAnalytic
+            self._kick = None
+        return toAnalytic.any()
+
+    # New orbits through the current states of the analytic bodies (unbound bodies stay numerical)
+    def _refit(self):
+        r = np.sqrt(np.einsum('ij,ij->i', self.position, self.position))
+        v2 = np.einsum('ij,ij->i', self.velocity, self.velocity)
+        self.numerical |= v2 >= 2*self.mu/r
+        self._orbitBodies = np.flatnonzero(~self.numerical)
+        self._slot = np.full(len(self.mass), -1)
+        self._slot[self._orbitBodies] = np.arange(len(self._orbitBodies))
+        self.orbits = KeplerOrbits.fromState(self.position[self._orbitBodies], self.velocity[self._orbitBodies],
+                                             self.mu[self._orbitBodies], self.t)
+        self._kick = None
+        self._evaluated = None
+
+    # Heliocentric states of every body at the current time (the analytic ones taken from their orbits, once per time)
+    def _current(self):
+        analytic = np.flatnonzero(~self.numerical)
+        if len(analytic) and self._evaluated != self.t:
+            self.position[analytic], self.velocity[analytic] = self.orbits.stateAt(self._slot[analytic], self.t)
+            self._evaluated = self.t
+        return self.position, self.velocity
+
+    # One kick-drift-kick step of the numerical bodies; the analytic ones are only evaluated where the kicks need them
+    def _step(self, h):
+        numerical = self.numerical
+        if self._kick is None:
+            self._kick = self.perturbation(self._current()[0])[numerical]
+        self.velocity[numerical] += 0.5*h*self._kick
+        self.position[numerical], self.velocity[numerical] = keplerDrift(self.position[numerical],
+                                                                         self.velocity[numerical],
+                                                                         self.mu[numerical], h)
+        self.t += h
+        self._kick = self.perturbation(self._current()[0])[numerical]
+        self.velocity[numerical] += 0.5*h*self._kick
+        self.steps += 1
+
+    # The first check time at which an analytic body goes over the threshold, between now and t (None if there is
+    # none), checking as many times at once as GravityKernels.blockElements allows
+    def _firstFlagged(self, checkTimes):
+        blockSize = max(1, GravityKernels.blockElements//len(self.mass))
+        for start in range(0, len(checkTimes), blockSize):
+            block = checkTimes[start:start+blockSize]
+            position = np.empty((len(block), len(self.mass), 3))
+            position[:, self._orbitBodies] = self.orbits.positions(block)
+            flagged = np.flatnonzero((self.ratios(position) > self.threshold).any(axis=1))
+            if len(flagged):
+                self.checks += start + flagged[0]
+                return block[flagged[0]]
+        self.checks += len(checkTimes)
+        return None
+
+    # Advancing to time t [s], with a check of the ratios at every multiple of checkInterval on the way
+    def advance(self, t):
+        if t < self.t:
+            self._reset(self.initial.copy())
+        while self.t < t:
+            elapsed = self.t - self.initial.t
+            boundary = self.initial.t + (np.floor(elapsed/self.checkInterval + 1e-9) + 1)*self.checkInterval
+            if not self.numerical.any():
+                # Every check up to t at once, straight from the orbits
+                checkTimes = np.arange(boundary, t + 0.5*self.checkInterval, self.checkInterval)
+                flagged = self._firstFlagged(checkTimes[checkTimes <= t])
+                self.t = t if flagged is None else flagged
+                self._current()
+                if flagged is not None:
+                    self._classify(self.position)
+                continue
+
+            # Steps of at most dt that land exactly on the next check (or on t)
+            stop = min(t, boundary)
+            nSteps = int(np.ceil((stop - self.t)/self.dt - 1e-9))
+            h = (stop - self.t)/nSteps
+            for _ in range(nSteps):
+                self._step(h)
+            self.t = stop
+            if stop == boundary and self._classify(self._current()[0]):
+                self._refit()
+        return self
+
+    # Heliocentric positions [m] and velocities [m/s] of every body (not the sun) at time t [s]
+    def heliocentric(self, t):
+        self.advance(t)
+        return self._current()[0].copy(), self.velocity.copy()
+
+    # Positions and velocities of every body at time t, sun included, in the frame of the starting system
+    def state(self, t):
+        position, velocity = self.heliocentric(t)
+        centre, drift, t0 = self._barycentre
+        sun = centre + drift*(t - t0) - self.mass @ position/self._total
+        sunVelocity = drift - self.mass @ velocity/self._total
+        return np.vstack([sun, sun + position]), np.vstack([sunVelocity, sunVelocity + velocity])
+
+    # The state at time t as an NBodySystem, e.g. to carry on with any integrator
+    def system(self, t):
+        position, velocity = self.state(t)
+        return NBodySystem(self.names, self.initial.mass, position, velocity, t, self.forceModel,
+                           softening=self.softening)
+
+    # Recording the state at each of the given times (in increasing order) with a recorder (see TrajectoryBuffer.py)
+    def propagate(self, times, recorder):
+        for t in times:
+            position, velocity = self.state(t)
+            recorder.record(t, position, velocity)
+        return recorder
+
+    def report(self):
+        return {'integrator': 'hybrid', 'steps': self.steps, 'checks': self.checks,
+                'numerical': [self.names[body + 1] for body in np.flatnonzero(self.numerical)],
+                'switches': len(self.events)}
+# ---------------------------------------------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    from BodyCatalog import loadCatalog
+    from Integrators import makeIntegrator
+
+    years = float(sys.argv[1]) if len(sys.argv) > 1 else 10.0
+    limit = float(sys.argv[2]) if len(sys.argv) > 2 else threshold
+    dt = secondsPerDay
+    nSteps = int(np.ceil(years*daysPerYear*secondsPerDay/dt))
+    system = loadCatalog().system()
+
+    start = time.perf_counter()
+    hybrid = HybridPropagator(system, threshold=limit)
+    position, velocity = hybrid.state(nSteps*dt)
+    hybridTime = time.perf_counter() - start
+
+    start = time.perf_counter()
+    stepped = system.copy()
+    stepped.run(nSteps, dt)
+    steppedTime = time.perf_counter() - start
+
+    reference = system.copy()
+    reference.run(int(np.ceil(years*12)), nSteps*dt/np.ceil(years*12), integrator=makeIntegrator('rkf45'))
+
+    def error(position):
+        distance = (position[1:] - position[0]) - (reference.position[1:] - reference.position[0])
+        return np.linalg.norm(distance, axis=1)/np.linalg.norm(reference.position[1:] - reference.position[0], axis=1)
+
+    print('%g years, %d bodies, threshold %g' % (years, system.n, limit))
+    print('daily Euler steps: %8.4f s' % steppedTime)
+    print('hybrid:            %8.4f s  %s' % (hybridTime, hybrid.report()))
+    print('distance from an rkf45 run, relative to the distance from the sun:')
+    for name, eulerError, hybridError in zip(system.names[1:], error(stepped.position), error(position)):
+        print('%-8s  euler %8.2g   hybrid %8.2g' % (name, eulerError, hybridError))
@@ -0,0 +1,257 @@
+# Sources for formulae:
+#   Leapfrog/velocity Verlet: https://en.wikipedia.org/wiki/Leapfrog_integration
+#   Yoshida: H. Yoshida, "Construction of higher order symplectic integrators", Phys. Lett. A 150, 262 (1990)
+#   Wisdom-Holman: J. Wisdom and M. Holman, "Symplectic maps for the N-body problem", AJ 102, 1528 (1991), in the
+#                  democratic heliocentric coordinates of Duncan, Levison and Lee, AJ 116, 2067 (1998)
+#   Universal variables for the Kepler drift: https://en.wikipedia.org/wiki/Universal_variable_formulation
+#   Runge-Kutta-Fehlberg: https://en.wikipedia.org/wiki/Runge%E2%80%93Kutta%E2%80%93Fehlberg_method
+
+import numpy as np
+from NBodyEngine import G
+from KeplerOrbits import keplerDrift
+
+# Integrators ---------------------------------------------------------------------------------------------------------
+# Every integrator advances an NBodySystem (see NBodyEngine.py) in place with step(system, dt) and counts how many
+# steps it took and how many times it evaluated the forces. The integrator is chosen by name with makeIntegrator():
+#   'euler'         semi-implicit Euler, the original update (v += a*dt then p += v*dt), first order
+#   'leapfrog'      kick-drift-kick leapfrog (velocity Verlet), second order and symplectic
+#   'yoshida4'      three leapfrog substeps with Yoshida's weights, fourth order and symplectic
+#   'wisdomHolman'  exact Kepler orbits about the sun plus kicks from the other bodies, second order and symplectic;
+#                   with the 'sun' force model the kicks vanish and only the (tiny) sun motion is approximated
+#   'rkf45'         embedded Runge-Kutta-Fehlberg 4(5) with error control; step(system, dt) then takes as many
+#                   internal steps as the tolerance needs to advance exactly dt
+# Symplectic integrators keep the energy error bounded instead of letting it drift, so the same error is reached with
+# a much larger dt than with the Euler step.
+
+class Integrator:
+    name = None
+
+    def __init__(self):
+        self.steps = 0
+        self.forceEvaluations = 0
+        # Acceleration left over from the end of the previous step, reused at the start of the next one
+        self._cache = None
+
+    def _acceleration(self, system):
+        self.forceEvaluations += 1
+        return system.acceleration()
+
+    # The acceleration at the current state, reusing the previous step's last evaluation when nothing has moved since
+    def _startAcceleration(self, system):
+        if self._cache is not None:
+            t, acceleration = self._cache
+            if t == system.t and acceleration.shape == system.position.shape:
+                return acceleration
+        return self._acceleration(system)
+
+    def report(self):
+        return {'integrator': self.name, 'steps': self.steps, 'forceEvaluations': self.forceEvaluations}
+
+    # Everything needed to continue the run exactly where it stopped (used for checkpoints)
+    def getState(self):
+        state = {'steps': self.steps, 'forceEvaluations': self.forceEvaluations}
+        if self._cache is not None:
+            state['cacheTime'], state['cacheAcceleration'] = self._cache
+        return state
+
+    def setState(self, state):
+        self.steps = int(state['steps'])
+        self.forceEvaluations = int(state['forceEvaluations'])
+        self._cache = None
+        if 'cacheAcceleration' in state:
+            self._cache = (float(state['cacheTime']), np.array(state['cacheAcceleration']))
+
+
+class SemiImplicitEuler(Integrator):
+    name = 'euler'
+
+    def step(self, system, dt):
+        if system.forceModel == 'sun':
+            # The engine's own step, which repeats the original loop's arithmetic
+            system.step(dt)
+            self.forceEvaluations += 1
+        else:
+            system.kick(dt*self._acceleration(system))
+            system.drift(dt)
+            system.t += dt
+        self.steps += 1
+
+
+class Leapfrog(Integrator):
+    name = 'leapfrog'
+
+    # One kick-drift-kick substep of length h
+    def _substep(self, system, h):
+        system.kick((h/2)*self._startAcceleration(system))
+        system.drift(h)
+        system.t += h
+        acceleration = self._acceleration(system)
+        system.kick((h/2)*acceleration)
+        self._cache = (system.t, acceleration)
+
+    def step(self, system, dt):
+        self._substep(system, dt)
+        self.steps += 1
+
+
+class Yoshida4(Leapfrog):
+    name = 'yoshida4'
+
+    # Weights of the three substeps (w1, w0, w1), which add up to one
+    w1 = 1/(2 - 2**(1/3))
+    w0 = -2**(1/3)/(2 - 2**(1/3))
+
+    def step(self, system, dt):
+        for w in (self.w1, self.w0, self.w1):
+            self._substep(system, w*dt)
+        self.steps += 1
+
+
+class WisdomHolman(Integrator):
+    name = 'wisdomHolman'
+
+    # Interaction between the bodies other than the sun, in heliocentric positions [m*s^(-2)]
+    def _interaction(self, system, helio):
+        self.forceEvaluations += 1
+        if system.forceModel == 'sun':
+            return np.zeros_like(helio)
+        from GravityKernels import acceleration
+        return acceleration(helio, system.mass[1:], system.forceModel, system.theta, system.softening)
+
+    def step(self, system, dt):
+        mass = system.mass
+        totalMass = mass.sum()
+        mu = G*mass[0]
+
+        # Democratic heliocentric coordinates: heliocentric positions and barycentric velocities
+        centreOfMass = mass @ system.position/totalMass
+        centreVelocity = mass @ system.velocity/totalMass
+        helio = system.position[1:] - system.position[0]
+        velocity = system.velocity[1:] - centreVelocity
+
+        # Half kick from the other bodies
+        acceleration = None
+        if self._cache is not None and self._cache[0] == system.t and len(self._cache[1]) == len(helio):
+            acceleration = self._cache[1]
+        if acceleration is None:
+            acceleration = self._interaction(system, helio)
+        velocity += (dt/2)*acceleration
+
+        # Half drift of the sun's momentum (the "jump"), the Kepler drift about the sun, then the other half jump
+        jump = mass[1:] @ velocity/mass[0]
+        helio += (dt/2)*jump
+        helio, velocity = keplerDrift(helio, velocity, mu, dt)
+        jump = mass[1:] @ velocity/mass[0]
+        helio += (dt/2)*jump
+
+        # Second half kick
+        acceleration = self._interaction(system, helio)
+        velocity += (dt/2)*acceleration
+
+        # Back to barycentric positions and velocities; the centre of mass moves in a straight line
+        centreOfMass = centreOfMass + dt*centreVelocity
+        system.position[0] = centreOfMass - mass[1:] @ helio/totalMass
+        system.position[1:] = helio + system.position[0]
+        system.velocity[0] = centreVelocity - mass[1:] @ velocity/mass[0]
+        system.velocity[1:] = velocity + centreVelocity
+        system.t += dt
+        self._cache = (system.t, acceleration)
+        self.steps += 1
+
+
+class RKF45(Integrator):
+    name = 'rkf45'
+
+    # Butcher tableau of the Runge-Kutta-Fehlberg 4(5) method
+    c = np.array([0, 1/4, 3/8, 12/13, 1, 1/2])
+    a = [[],
+         [1/4],
+         [3/32, 9/32],
+         [1932/2197, -7200/2197, 7296/2197],
+         [439/216, -8, 3680/513, -845/4104],
+         [-8/27, 2, -3544/2565, 1859/4104, -11/40]]
+    b5 = np.array([16/135, 0, 6656/12825, 28561/56430, -9/50, 2/55])
+    b4 = np.array([25/216, 0, 1408/2565, 2197/4104, -1/5, 0])
+
+    def __init__(self, rtol=1e-9, atol=1e-3, safety=0.9):
+        Integrator.__init__(self)
+        self.rtol = rtol                            # Relative tolerance on positions and velocities
+        self.atol = atol                            # Absolute tolerance [m] for positions, [m/s] for velocities
+        self.safety = safety
+        self.rejectedSteps = 0
+        self.h = None                               # Next internal step length [s]
+
+    def report(self):
+        report = Integrator.report(self)
+        report['rejectedSteps'] = self.rejectedSteps
+        return report
+
+    def getState(self):
+        state = Integrator.getState(self)
+        state.update(rejectedSteps=self.rejectedSteps, rtol=self.rtol, atol=self.atol, safety=self.safety)
+        if self.h is not None:
+            state['h'] = self.h
+        return state
+
+    def setState(self, state):
+        Integrator.setState(self, state)
+        self.rejectedSteps = int(state['rejectedSteps'])
+        self.rtol, self.atol, self.safety = float(state['rtol']), float(state['atol']), float(state['safety'])
+        self.h = float(state['h']) if 'h' in state else None
+
+    # One attempt of length h from (position, velocity); returns the fifth order state and the error estimate
+    def _attempt(self, system, position, velocity, t, h):
+        kPosition, kVelocity = [], []
+        for stage in range(6):
+            system.position = position + h*sum(a*k for a, k in zip(self.a[stage], kPosition)) if stage else position
+            system.velocity = velocity + h*sum(a*k for a, k in zip(self.a[stage], kVelocity)) if stage else velocity
+            system.t = t + self.c[stage]*h
+            kPosition.append(system.velocity.copy())
+            kVelocity.append(self._acceleration(system))
+        newPosition = position + h*sum(b*k for b, k in zip(self.b5, kPosition))
+        newVelocity = velocity + h*sum(b*k for b, k in zip(self.b5, kVelocity))
+        errorPosition = h*sum((b5-b4)*k for b5, b4, k in zip(self.b5, self.b4, kPosition))
+        errorVelocity = h*sum((b5-b4)*k for b5, b4, k in zip(self.b5, self.b4, kVelocity))
+
+        # Largest error relative to the tolerance over every body and axis (<= 1 means the step is accepted)
+        scalePosition = self.atol + self.rtol*np.maximum(np.abs(position), np.abs(newPosition))
+        scaleVelocity = self.atol + self.rtol*np.maximum(np.abs(velocity), np.abs(newVelocity))
+        error = max(np.abs(errorPosition/scalePosition).max(), np.abs(errorVelocity/scaleVelocity).max())
+        return newPosition, newVelocity, error
+
+    def step(self, system, dt):
+        position, velocity, t = system.position.copy(), system.velocity.copy(), system.t
+        end = t + dt
+        h = dt if self.h is None else self.h
+
+        while t < end:
+            h = min(h, end - t)
+            newPosition, newVelocity, error = self._attempt(system, position, velocity, t, h)
+            if error <= 1:
+                position, velocity = newPosition, newVelocity
+                t = end if h == end - t else t + h
+                self.steps += 1
+            else:
+                self.rejectedSteps += 1
+            # Standard step size control for a fourth order error estimate, limited to a factor of 5 either way
+            factor = 5.0 if error == 0 else min(5.0, max(0.2, self.safety*error**(-1/5)))
+            h *= factor
+            if error <= 1:
+                self.h = h
+
+        system.position, system.velocity, system.t = position, velocity, end
+
+
+integrators = {
+    SemiImplicitEuler.name: SemiImplicitEuler,
+    Leapfrog.name: Leapfrog,
+    Yoshida4.name: Yoshida4,
+    WisdomHolman.name: WisdomHolman,
+    RKF45.name: RKF45,
+}
+
+def makeIntegrator(name, **options):
+    if name not in integrators:
+        raise ValueError("Unknown integrator '%s', expected one of %s" % (name, ', '.join(integrators)))
+    return integrators[name](**options)
+# ---------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,253 @@
+# Source for Numba: https://numba.readthedocs.io
+
+import warnings
+import numpy as np
+from NBodyEngine import G
+
+# Optional dependency: without Numba every system quietly keeps using the NumPy code of NBodyEngine.py
+try:
+    import numba
+except ImportError:
+    numba = None
+available = numba is not None
+
+# Settings ------------------------------------------------------------------------------------------------------------
+parallelCrossover = 512                             # Number of bodies from which the kernels run on every core
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Compiled kernels ----------------------------------------------------------------------------------------------------
+# For a handful of bodies a NumPy step is a dozen array operations of three to ten elements each, and almost all of
+# the time goes into calling them. Here the whole loop over steps (not only the force) is compiled to machine code,
+# so a run of nSteps is a single call. The kernels are compiled the first time they are used and cached on disk
+# (cache=True, in __pycache__ next to this file, or in NUMBA_CACHE_DIR when that is not writable), so only the very
+# first run pays for the compilation.
+#
+# The 'sun' force model repeats the arithmetic of NBodySystem.step() in the same order, so the compiled Euler step
+# gives the same numbers as the NumPy one. Sums over many bodies (the direct force, and the sun's reaction from
+# parallelCrossover bodies on) are added up in a different order, which changes the last bits.
+if available:
+    jit = numba.njit(cache=True)
+    parallelJit = numba.njit(cache=True, parallel=True)
+    prange = numba.prange
+else:
+    def jit(function):
+        return function
+    parallelJit = jit
+    prange = range
+
+# Force of the sun on every other body and the sum of the reactions of the massive ones on the sun, written to force
+# (shape (N,3), row 0 receives the sum) [kg*m*s^(-2)]
+@jit
+def _sunForce(position, gravConst, reaction, force):
+    sx, sy, sz = position[0, 0], position[0, 1], position[0, 2]
+    fx, fy, fz = 0.0, 0.0, 0.0
+    for i in range(1, position.shape[0]):
+        dx, dy, dz = position[i, 0] - sx, position[i, 1] - sy, position[i, 2] - sz
+        modulus = dx**2 + dy**2 + dz**2
+        modulus *= np.sqrt(modulus)
+        weight = -gravConst[i-1]/modulus
+        force[i, 0], force[i, 1], force[i, 2] = dx*weight, dy*weight, dz*weight
+        fx += force[i, 0]*reaction[i-1]
+        fy += force[i, 1]*reaction[i-1]
+        fz += force[i, 2]*reaction[i-1]
+    force[0, 0], force[0, 1], force[0, 2] = fx, fy, fz
+
+@parallelJit
+def _sunForceParallel(position, gravConst, reaction, force):
+    sx, sy, sz = position[0, 0], position[0, 1], position[0, 2]
+    fx, fy, fz = 0.0, 0.0, 0.0
+    for i in prange(1, position.shape[0]):
+        dx, dy, dz = position[i, 0] - sx, position[i, 1] - sy, position[i, 2] - sz
+        modulus = dx**2 + dy**2 + dz**2
+        modulus *= np.sqrt(modulus)
+        weight = -gravConst[i-1]/modulus
+        force[i, 0], force[i, 1], force[i, 2] = dx*weight, dy*weight, dz*weight
+        fx += force[i, 0]*reaction[i-1]
+        fy += force[i, 1]*reaction[i-1]
+        fz += force[i, 2]*reaction[i-1]
+    force[0, 0], force[0, 1], force[0, 2] = fx, fy, fz
+
+# Formula 0 of GravityKernels.py: the pull of the massive bodies (sources) on every body [m*s^(-2)]
+@jit
+def _directAcceleration(position, mass, sources, softening, acceleration):
+    for i in range(position.shape[0]):
+        ax, ay, az = 0.0, 0.0, 0.0
+        for j in sources:
+            dx, dy, dz = position[j, 0] - position[i, 0], position[j, 1] - position[i, 1], \
+                position[j, 2] - position[i, 2]
+            modulus = dx*dx + dy*dy + dz*dz + softening**2
+            if modulus > 0:
+                modulus *= np.sqrt(modulus)
+                weight = G*mass[j]/modulus
+                ax, ay, az = ax + weight*dx, ay + weight*dy, az + weight*dz
+        acceleration[i, 0], acceleration[i, 1], acceleration[i, 2] = ax, ay, az
+
+@parallelJit
+def _directAccelerationParallel(position, mass, sources, softening, acceleration):
+    for i in prange(position.shape[0]):
+        ax, ay, az = 0.0, 0.0, 0.0
+        for j in sources:
+            dx, dy, dz = position[j, 0] - position[i, 0], position[j, 1] - position[i, 1], \
+                position[j, 2] - position[i, 2]
+            modulus = dx*dx + dy*dy + dz*dz + softening**2
+            if modulus > 0:
+                modulus *= np.sqrt(modulus)
+                weight = G*mass[j]/modulus
+                ax, ay, az = ax + weight*dx, ay + weight*dy, az + weight*dz
+        acceleration[i, 0], acceleration[i, 1], acceleration[i, 2] = ax, ay, az
+
+# values[i,k] += increment, Kahan-compensated with a carry of NBodySystem's 'compensated' precision when one is given
+# (a carry of no rows means plain double precision)
+@jit
+def _add(values, carry, i, k, increment):
+    if carry.shape[0] == 0:
+        values[i, k] += increment
+    else:
+        increment -= carry[i, k]
+        total = values[i, k] + increment
+        carry[i, k] = (total - values[i, k]) - increment
+        values[i, k] = total
+
+# The acceleration of every body under the 'sun' (sunModel=True) or 'direct' force model, written to acceleration
+@jit
+def _acceleration(position, mass, sources, unitMass, gravConst, reaction, softening, sunModel, parallel,
+                  acceleration):
+    if not sunModel:
+        if parallel:
+            _directAccelerationParallel(position, mass, sources, softening, acceleration)
+        else:
+            _directAcceleration(position, mass, sources, softening, acceleration)
+        return
+    if parallel:
+        _sunForceParallel(position, gravConst, reaction, acceleration)
+    else:
+        _sunForce(position, gravConst, reaction, acceleration)
+    for k in range(3):
+        acceleration[0, k] = -acceleration[0, k]/mass[0]
+    for i in range(1, position.shape[0]):
+        for k in range(3):
+            acceleration[i, k] /= unitMass[i-1]
+
+# nSteps semi-implicit Euler steps, as NBodySystem.step(); returns the new time [s]
+@jit
+def _eulerSteps(position, velocity, mass, sources, unitMass, gravConst, reaction, softening, sunModel, parallel,
+                t, dt, nSteps, positionCarry, velocityCarry):
+    work = np.empty_like(position)
+    for step in range(nSteps):
+        if sunModel:
+            if parallel:
+                _sunForceParallel(position, gravConst, reaction, work)
+            else:
+                _sunForce(position, gravConst, reaction, work)
+            for i in range(1, position.shape[0]):
+                scale = dt/unitMass[i-1]
+                for k in range(3):
+                    _add(velocity, velocityCarry, i, k, scale*work[i, k])
+                    _add(position, positionCarry, i, k, dt*velocity[i, k])
+            scale = -dt/mass[0]
+            for k in range(3):
+                _add(velocity, velocityCarry, 0, k, scale*work[0, k])
+                _add(position, positionCarry, 0, k, dt*velocity[0, k])
+        else:
+            _acceleration(position, mass, sources, unitMass, gravConst, reaction, softening, sunModel, parallel, work)
+            for i in range(position.shape[0]):
+                for k in range(3):
+                    _add(velocity, velocityCarry, i, k, dt*work[i, k])
+                    _add(position, positionCarry, i, k, dt*velocity[i, k])
+        t += dt
+    return t
+
+# nSteps kick-drift-kick steps made of the substeps weights*dt (one weight for the leapfrog, three for Yoshida's
+# fourth order scheme), starting from and leaving behind the acceleration at the current state; returns the new time
+@jit
+def _leapfrogSteps(position, velocity, mass, sources, unitMass, gravConst, reaction, softening, sunModel, parallel,
+                   t, dt, nSteps, weights, acceleration, positionCarry, velocityCarry):
+    for step in range(nSteps):
+        for w in weights:
+            h = w*dt
+            for i in range(position.shape[0]):
+                for k in range(3):
+                    _add(velocity, velocityCarry, i, k, (h/2)*acceleration[i, k])
+                    _add(position, positionCarry, i, k, h*velocity[i, k])
+            t += h
+            _acceleration(position, mass, sources, unitMass, gravConst, reaction, softening, sunModel, parallel,
+                          acceleration)
+            for i in range(position.shape[0]):
+                for k in range(3):
+                    _add(velocity, velocityCarry, i, k, (h/2)*acceleration[i, k])
+    return t
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Dispatch ------------------------------------------------------------------------------------------------------------
+# NBodySystem(backend=...) picks the code that advances it:
+#   'numpy'   the NumPy code of NBodyEngine.py and Integrators.py (the default)
+#   'jit'     the compiled kernels above, falling back to NumPy (with one warning) when Numba is not installed
+#   'auto'    the compiled kernels when Numba is installed, NumPy otherwise
+# Compiled are the 'sun' and 'direct' force models, and the euler, leapfrog and yoshida4 integrators; anything else
+# (the Barnes-Hut tree, Wisdom-Holman, rkf45) runs the NumPy code, with compiled forces where they apply. So do the
+# 'heliocentric' and 'float32' precisions of NBodySystem; 'compensated' is compiled, with its carries kept on the
+# system.
+_warned = []
+
+def enabled(system):
+    backend = getattr(system, 'backend', 'numpy')
+    if backend == 'numpy':
+        return False
+    if backend not in ('jit', 'auto'):
+        raise ValueError("Unknown backend '%s', expected 'numpy', 'jit' or 'auto'" % backend)
+    if not available and backend == 'jit' and not _warned:
+        warnings.warn('Numba is not installed, so the NumPy code is used instead of the compiled kernels')
+        _warned.append(True)
+    return available and system.forceModel in ('sun', 'direct') and \
+        getattr(system, 'precision', 'float64') in ('float64', 'compensated')
+
+def _arguments(system):
+    return (system.position, system.velocity, system.mass, np.flatnonzero(system.mass > 0), system._unitMass,
+            system._gravConst,
+            system._reaction[:, 0].copy(), float(system.softening), system.forceModel == 'sun',
+            system.n >= parallelCrossover)
+
+# Acceleration of every body [m*s^(-2)], for NBodySystem.acceleration()
+def acceleration(system):
+    position, velocity, *arguments = _arguments(system)
+    result = np.empty_like(position)
+    _acceleration(position, *arguments, result)
+    return result
+
+# Advancing the system nSteps steps of dt in compiled code, for NBodySystem.run(); returns False (having done nothing)
+# when the integrator is not one of the compiled ones. With a recorder the kernels are called one step at a time.
+def run(system, nSteps, dt, recorder=None, integrator=None):
+    from Integrators import Yoshida4
+
+    name = 'euler' if integrator is None else integrator.name
+    if name not in ('euler', 'leapfrog', 'yoshida4'):
+        return False
+    weights = np.array([Yoshida4.w1, Yoshida4.w0, Yoshida4.w1]) if name == 'yoshida4' else np.array([1.0])
+    arguments = _arguments(system)
+    if system.precision == 'compensated':
+        carries = (system._positionCarry, system._velocityCarry)
+    else:
+        carries = (np.empty((0, 3)), np.empty((0, 3)))
+    acceleration = None
+    if name != 'euler':
+        acceleration = np.array(integrator._startAcceleration(system), dtype=np.float64)
+
+    # The counters are brought up to date even when a recorder stops the run (see Encounters.EncounterStop)
+    done = 0
+    try:
+        for steps in [nSteps] if recorder is None else [1]*nSteps:
+            if name == 'euler':
+                system.t = _eulerSteps(*arguments, system.t, dt, steps, *carries)
+            else:
+                system.t = _leapfrogSteps(*arguments, system.t, dt, steps, weights, acceleration, *carries)
+            done += steps
+            if recorder is not None:
+                recorder.record(system.t, system.position, system.velocity)
+    finally:
+        if integrator is not None:
+            integrator.steps += done
+            integrator.forceEvaluations += done*len(weights)
+            if acceleration is not None:
+                integrator._cache = (system.t, acceleration.copy())
+    return True
+# ---------------------------------------------------------------------------------------------------------------------
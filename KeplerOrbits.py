@@ -0,0 +1,233 @@
+# Sources for formulae:
+#   Ellipse geometry: https://en.wikipedia.org/wiki/Semi-major_and_semi-minor_axes
+#   Kepler's equation: https://en.wikipedia.org/wiki/Kepler%27s_equation
+#   Orbital elements from a state vector: https://en.wikipedia.org/wiki/Orbital_elements
+#   Universal variables for the Kepler drift: https://en.wikipedia.org/wiki/Universal_variable_formulation
+
+import numpy as np
+from NBodyEngine import G
+
+# Formulae ------------------------------------------------------------------------------------------------------------
+# Every function here takes arrays (one entry per body, per angle or per time, broadcast against each other) and has
+# no Python loop over bodies or times.
+#
+# Ellipse geometry, for an orbit of semi-major axis a and eccentricity e:
+# semiMinor = a*sqrt(1-e**2)                                                                                        (0)
+# radius = (a*semiMinor)/sqrt((a*sin(theta))**2+(semiMinor*cos(theta))**2), measured from the ellipse's centre      (1)
+# radius = a*(1-e**2)/(1+e*cos(nu)), measured from the sun at the focus, nu being the true anomaly                  (2)
+#
+# Motion along the orbit about a central body with mu = G*(M+m):
+# n = sqrt(mu/a**3), the mean motion, and period = 2*pi/n                                                           (3)
+# M = M0 + n*(t - epoch), the mean anomaly                                                                          (4)
+# M = E - e*sin(E), Kepler's equation for the eccentric anomaly E, solved with Newton's iteration                   (5)
+#     E <- E - (E - e*sin(E) - M)/(1 - e*cos(E))
+# x = a*(cos(E) - e),  y = semiMinor*sin(E)                                                   in the orbital plane  (6)
+# vx = -n*a*sin(E)/(1 - e*cos(E)),  vy = n*semiMinor*cos(E)/(1 - e*cos(E))                                          (7)
+# position = x*P + y*Q, P pointing to perihelion and Q 90 degrees ahead of it, both set by the inclination i,
+# the longitude of the ascending node W and the argument of perihelion w:                                           (8)
+#     P = (cos W cos w - sin W sin w cos i,  sin W cos w + cos W sin w cos i,  sin w sin i)
+#     Q = (-cos W sin w - sin W cos w cos i, -sin W sin w + cos W cos w cos i,  cos w sin i)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Ellipse geometry ----------------------------------------------------------------------------------------------------
+# Formula 0 [m]
+def semiMinorAxis(semiMajor, eccentricity):
+    return semiMajor*np.sqrt(1 - np.square(eccentricity))
+
+# Formula 1: distance from the centre of the ellipse at angle theta [m]
+def ellipseRadius(semiMajor, semiMinor, theta):
+    return semiMajor*semiMinor/np.sqrt((semiMajor*np.sin(theta))**2 + (semiMinor*np.cos(theta))**2)
+
+# Formula 2: distance from the sun at true anomaly nu [m]
+def focalRadius(semiMajor, eccentricity, trueAnomaly):
+    return semiMajor*(1 - np.square(eccentricity))/(1 + eccentricity*np.cos(trueAnomaly))
+
+# Formula 3 [s]
+def orbitalPeriod(semiMajor, mu):
+    return 2*np.pi*np.sqrt(semiMajor**3/mu)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Kepler's equation ---------------------------------------------------------------------------------------------------
+# Formula 5 for any number of mean anomalies at once [rad], elliptic orbits (0 <= e < 1). Newton's iteration converges
+# in a handful of steps from E = M + e*sin(M), or from E = pi for very eccentric orbits; the iteration runs on the
+# whole array until every entry has converged.
+def solveKepler(meanAnomaly, eccentricity, tolerance=1e-14, maxIterations=50):
+    meanAnomaly, eccentricity = np.broadcast_arrays(np.asarray(meanAnomaly, dtype=np.float64),
+                                                    np.asarray(eccentricity, dtype=np.float64))
+    meanAnomaly = np.remainder(meanAnomaly + np.pi, 2*np.pi) - np.pi          # Into [-pi, pi)
+    E = np.where(eccentricity < 0.8, meanAnomaly + eccentricity*np.sin(meanAnomaly), np.pi*np.sign(meanAnomaly))
+    for _ in range(maxIterations):
+        delta = (E - eccentricity*np.sin(E) - meanAnomaly)/(1 - eccentricity*np.cos(E))
+        E -= delta
+        if np.all(np.abs(delta) <= tolerance*np.maximum(np.abs(E), 1.0)):
+            break
+    return E
+
+def trueAnomaly(eccentricAnomaly, eccentricity):
+    return 2*np.arctan2(np.sqrt(1 + eccentricity)*np.sin(eccentricAnomaly/2),
+                        np.sqrt(1 - eccentricity)*np.cos(eccentricAnomaly/2))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Orbits --------------------------------------------------------------------------------------------------------------
+# Elliptic two-body orbits of N bodies about the sun, as arrays of orbital elements (one entry per body):
+#   semiMajor [m], eccentricity, mu = G*(M+m) [m^3*s^(-2)], meanAnomaly at the epoch [rad], inclination,
+#   node (longitude of the ascending node) and periapsis (argument of perihelion) [rad], epoch [s]
+# Positions and velocities are heliocentric and exact for the two-body problem at any time, without stepping there.
+class KeplerOrbits:
+    def __init__(self, semiMajor, eccentricity, mu, meanAnomaly=0.0, inclination=0.0, node=0.0, periapsis=0.0,
+                 epoch=0.0, names=None):
+        self.semiMajor, self.eccentricity, self.mu, self.meanAnomaly, self.inclination, self.node, self.periapsis = \
+            np.broadcast_arrays(*[np.array(value, dtype=np.float64, ndmin=1) for value in
+                                  (semiMajor, eccentricity, mu, meanAnomaly, inclination, node, periapsis)])
+        self.epoch = float(epoch)
+        self.names = None if names is None else list(names)
+        if np.any(self.eccentricity >= 1) or np.any(self.semiMajor <= 0):
+            raise ValueError('KeplerOrbits is for elliptic orbits only (use keplerDrift for unbound ones)')
+
+        self.semiMinor = semiMinorAxis(self.semiMajor, self.eccentricity)
+        self.meanMotion = np.sqrt(self.mu/self.semiMajor**3)                      # Formula 3 [rad/s]
+        # Formula 8, the orbital plane of every body, shape (N,3)
+        cosW, sinW = np.cos(self.node), np.sin(self.node)
+        cosw, sinw = np.cos(self.periapsis), np.sin(self.periapsis)
+        cosi, sini = np.cos(self.inclination), np.sin(self.inclination)
+        self.P = np.stack([cosW*cosw - sinW*sinw*cosi, sinW*cosw + cosW*sinw*cosi, sinw*sini], axis=-1)
+        self.Q = np.stack([-cosW*sinw - sinW*cosw*cosi, -sinW*sinw + cosW*cosw*cosi, cosw*sini], axis=-1)
+
+    def __len__(self):
+        return len(self.semiMajor)
+
+    @property
+    def period(self):
+        return 2*np.pi/self.meanMotion                                           # [s]
+
+    # The orbits that the bodies of an NBodySystem (or any heliocentric states) are on at time t
+    @classmethod
+    def fromState(cls, position, velocity, mu, t=0.0, names=None):
+        elements = elementsFromState(position, velocity, mu)
+        return cls(elements['semiMajor'], elements['eccentricity'], mu, elements['meanAnomaly'],
+                   elements['inclination'], elements['node'], elements['periapsis'], t, names)
+
+    # The orbits of the planets of a system, about its sun (body 0), e.g. KeplerOrbits.fromSystem(catalog.system())
+    @classmethod
+    def fromSystem(cls, system):
+        mu = G*(system.mass[0] + system.mass[1:])
+        return cls.fromState(system.position[1:] - system.position[0], system.velocity[1:] - system.velocity[0], mu,
+                             system.t, system.names[1:])
+
+    def _anomalies(self, index, t):
+        M = self.meanAnomaly[index] + self.meanMotion[index]*(np.asarray(t, dtype=np.float64) - self.epoch)
+        E = solveKepler(M, self.eccentricity[index])
+        return np.cos(E), np.sin(E)
+
+    # Formulae 4-8 for the bodies index (an array, broadcast against t) at times t [s]; returns positions [m] and
+    # velocities [m/s] of shape broadcast(index, t) + (3,)
+    def stateAt(self, index, t, velocities=True):
+        index = np.asarray(index)
+        cosE, sinE = self._anomalies(index, t)
+        e, a, b = self.eccentricity[index], self.semiMajor[index], self.semiMinor[index]
+        P, Q = self.P[index], self.Q[index]
+        x, y = a*(cosE - e), b*sinE
+        position = x[..., None]*P + y[..., None]*Q
+        if not velocities:
+            return position
+        factor = self.meanMotion[index]/(1 - e*cosE)
+        vx, vy = -factor*a*sinE, factor*b*cosE
+        return position, vx[..., None]*P + vy[..., None]*Q
+
+    # Every body at every one of the times t, shape (T,N,3) (or (N,3) for a single time)
+    def state(self, t, velocities=True):
+        t = np.asarray(t, dtype=np.float64)
+        return self.stateAt(np.arange(len(self)), t[..., None], velocities)
+
+    def positions(self, t):
+        return self.state(t, velocities=False)
+
+# Osculating orbital elements of heliocentric states, shape (N,3) each, about central masses mu = G*(M+m) (scalar or
+# one per body). Angles are in radians; bodies in the reference plane get node 0 and circular orbits periapsis 0, so
+# the elements are always defined. Unbound states get semiMajor <= 0 and eccentricity >= 1.
+def elementsFromState(position, velocity, mu):
+    position = np.asarray(position, dtype=np.float64).reshape(-1, 3)
+    velocity = np.asarray(velocity, dtype=np.float64).reshape(-1, 3)
+    mu = np.broadcast_to(np.asarray(mu, dtype=np.float64), position.shape[:1])
+    r = np.sqrt(np.einsum('ij,ij->i', position, position))
+    v2 = np.einsum('ij,ij->i', velocity, velocity)
+    h = np.cross(position, velocity)                                              # Specific angular momentum
+    hNorm = np.sqrt(np.einsum('ij,ij->i', h, h))
+    eVector = np.cross(velocity, h)/mu[:, None] - position/r[:, None]
+    e = np.sqrt(np.einsum('ij,ij->i', eVector, eVector))
+    a = 1/(2/r - v2/mu)
+
+    inclination = np.arccos(np.clip(h[:, 2]/hNorm, -1, 1))
+    nodeVector = np.stack([-h[:, 1], h[:, 0], np.zeros(len(h))], axis=-1)
+    nodeNorm = np.sqrt(np.einsum('ij,ij->i', nodeVector, nodeVector))
+    planar = nodeNorm <= 1e-12*hNorm
+    node = np.where(planar, 0.0, np.arctan2(nodeVector[:, 1], nodeVector[:, 0]))
+    # The line the periapsis is measured from: the ascending node, or the x-axis for orbits in the reference plane
+    reference = np.where(planar[:, None], [1.0, 0.0, 0.0], nodeVector/np.where(planar, 1.0, nodeNorm)[:, None])
+    W = h/hNorm[:, None]
+    circular = e <= 1e-10
+    direction = np.where(circular[:, None], position, eVector)                   # Perihelion (or the body itself)
+    periapsis = np.arctan2(np.einsum('ij,ij->i', np.cross(reference, direction), W),
+                           np.einsum('ij,ij->i', reference, direction))
+    # Mean anomaly from the eccentric anomaly (for circular orbits the angle from the reference line is the anomaly)
+    cosE = np.where(circular, 1.0, (1 - r/a)/np.where(circular, 1.0, e))
+    sinE = np.einsum('ij,ij->i', position, velocity)/(np.where(circular, 1.0, e)*np.sqrt(mu*np.abs(a)))
+    E = np.where(circular, 0.0, np.arctan2(sinE, cosE))
+    meanAnomaly = np.where(e < 1, E - e*np.sin(E), np.nan)
+    return {'semiMajor': a, 'eccentricity': e, 'inclination': inclination, 'node': node, 'periapsis': periapsis,
+            'meanAnomaly': meanAnomaly}
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Kepler drift --------------------------------------------------------------------------------------------------------
+# Stumpff functions C(z) and S(z), with their series near z = 0 where the closed forms lose precision
+def stumpff(z):
+    c, s = np.empty_like(z), np.empty_like(z)
+    small = np.abs(z) < 1e-4
+    positive, negative = (z > 0) & ~small, (z < 0) & ~small
+    root = np.sqrt(z[positive])
+    c[positive] = (1 - np.cos(root))/z[positive]
+    s[positive] = (root - np.sin(root))/root**3
+    root = np.sqrt(-z[negative])
+    c[negative] = (np.cosh(root) - 1)/-z[negative]
+    s[negative] = (np.sinh(root) - root)/root**3
+    zs = z[small]
+    c[small] = 1/2 - zs/24 + zs**2/720
+    s[small] = 1/6 - zs/120 + zs**2/5040
+    return c, s
+
+# Moving every body along its own two-body orbit about a central mass (mu = G*M) for a time dt, all bodies at once,
+# elliptic or hyperbolic alike [m], [m/s]
+def keplerDrift(position, velocity, mu, dt, tolerance=1e-13, maxIterations=50):
+    r0 = np.sqrt(np.einsum('ij,ij->i', position, position))                     # [m]
+    v2 = np.einsum('ij,ij->i', velocity, velocity)                               # [m^2/s^2]
+    eta = np.einsum('ij,ij->i', position, velocity)                              # r0*radial velocity [m^2/s]
+    alpha = 2/r0 - v2/mu                                                         # 1/semi-major axis [1/m]
+    sqrtMu = np.sqrt(mu)
+
+    # Solving the universal Kepler equation for chi with the Laguerre-Conway iteration (robust for any orbit)
+    chi = sqrtMu*dt*np.where(alpha > 0, alpha, 1/r0)
+    for _ in range(maxIterations):
+        z = alpha*chi**2
+        c, s = stumpff(z)
+        f = eta/sqrtMu*chi**2*c + (1 - alpha*r0)*chi**3*s + r0*chi - sqrtMu*dt
+        df = eta/sqrtMu*chi*(1 - z*s) + (1 - alpha*r0)*chi**2*c + r0
+        ddf = eta/sqrtMu*(1 - z*c) + (1 - alpha*r0)*chi*(1 - z*s)
+        n = 5
+        root = np.sqrt(np.abs((n - 1)**2*df**2 - n*(n - 1)*f*ddf))
+        delta = n*f/(df + np.sign(df)*root)
+        chi = chi - delta
+        if np.all(np.abs(delta) <= tolerance*np.maximum(np.abs(chi), 1e-30)):
+            break
+
+    z = alpha*chi**2
+    c, s = stumpff(z)
+    # Lagrange coefficients f, g and their time derivatives
+    f = 1 - chi**2/r0*c
+    g = dt - chi**3/sqrtMu*s
+    newPosition = f[:, None]*position + g[:, None]*velocity
+    r = np.sqrt(np.einsum('ij,ij->i', newPosition, newPosition))
+    fDot = sqrtMu/(r*r0)*chi*(z*s - 1)
+    gDot = 1 - chi**2/r*c
+    newVelocity = fDot[:, None]*position + gDot[:, None]*velocity
+    return newPosition, newVelocity
+# ---------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,281 @@
+# Source for data: https://nssdc.gsfc.nasa.gov/planetary/factsheet/index.html
+
+import numpy as np
+
+# Constants -----------------------------------------------------------------------------------------------------------
+G               = 6.6743e-11                        # Gravitational constant [m^3*kg^(-1)*s^(-2)]
+secondsPerDay   = 24.0*60*60                        # Number of seconds in a day [s]
+daysPerYear     = 365.2422                          # Number of days in a tropical year [days]
+precisions      = ('float64', 'compensated', 'heliocentric', 'float32')
+precisionIntegrators = ('euler', 'leapfrog', 'yoshida4')   # The integrators that run in every precision
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Engine --------------------------------------------------------------------------------------------------------------
+# Instead of one dictionary entry of three-element lists per body, every body lives in one row of a contiguous (N,3)
+# array. Row 0 is always the central body (the sun), rows 1..N-1 are the planets followed by any test particles.
+#
+# The step below is the same semi-implicit Euler step used in SolarSystemSimulation.py and EarthMarsSimulation.py:
+#   1. every body feels the pull of the sun only (r^2 in the denominator, written as |r|^3 times the distance vector)
+#   2. the velocity of each body is updated with v += (dt/m)*F and then its position with p += dt*v
+#   3. the sun feels the sum of the reactions of every massive body and is moved last
+# The arithmetic is done in the same order as the original loops. The only rounding difference is that r^1.5 is
+# computed as r^2*sqrt(r^2) instead of with pow(), which changes the last bit of the modulus now and then; over the
+# five year daily run of SolarSystemSimulation.py the positions agree with the original loop to a relative error
+# below 1e-12 (a few centimetres). The only physical difference is that the original SolarSystemSimulation.py never
+# cleared force['sun'], so the sun's force kept accumulating from one step to the next and the sun drifted away;
+# here it is recomputed every step.
+#
+# Test particles are bodies with zero mass. They are pulled by the sun but do not pull back, and their force is
+# computed per unit mass so that (dt/m) never divides by zero.
+#
+# The force model is chosen with forceModel:
+#   'sun'        only the sun pulls on the planets (the original model, and the default)
+#   'direct'     every massive body pulls on every body, all pairs (see GravityKernels.py)
+#   'barnesHut'  every massive body pulls on every body, approximated with an octree of opening angle theta
+#   'auto'       'direct' for small systems and 'barnesHut' for large ones
+# With mutual gravitation all bodies are kicked and then drifted at the same time.
+#
+# The code that does the work is chosen with backend: 'numpy' (the default), or 'jit' / 'auto' for the compiled
+# kernels of JitKernels.py, which need Numba and fall back to NumPy without it.
+#
+# The arithmetic of the kick v += dv and the drift p += h*v is chosen with precision:
+#   'float64'       plain double precision (the default, and the original update)
+#   'compensated'   double precision with Kahan summation: the low-order bits each addition rounds away are kept in
+#                   carry arrays and put back into the next one. A daily step adds ~2.5e9 m to coordinates of ~1e12 m
+#                   and ~0.5 m/s to velocities of ~3e4 m/s, and the velocities lose the more: compensating only the
+#                   positions hardly helps, compensating both takes the rounding error of a century down 30-300 times
+#   'heliocentric'  as 'compensated', but the planets are kept as offsets from the sun and drifted with their
+#                   velocity relative to it, and the sun on its own; the 'sun' force then needs no subtraction of two
+#                   large coordinates, and the inner planets keep their bits however far the whole system drifts from
+#                   the origin (12 m/s with the catalog's starting velocities, 4e11 m in a thousand years)
+#   'float32'       positions and velocities in single precision, and the 'sun' force worked out per unit mass, for
+#                   large swarms of test particles where half the memory traffic matters more than the last digits;
+#                   the other force models are still worked out in double precision
+# The modes act on the kicks and drifts of the Euler, leapfrog and Yoshida integrators (and, for 'compensated', of
+# their compiled kernels); Wisdom-Holman and rkf45 move the bodies their own way and only run in 'float64'. What the
+# modes cost and gain is measured in the README.
+
+class NBodySystem:
+    def __init__(self, names, mass, position, velocity, t=0.0, forceModel='sun', theta=0.5, softening=0.0,
+                 backend='numpy', precision='float64'):
+        if precision not in precisions:
+            raise ValueError("Unknown precision '%s', expected one of %s" % (precision, ', '.join(precisions)))
+        self.precision = precision
+        dtype = np.float32 if precision == 'float32' else np.float64
+        self.names    = list(names)
+        self.mass     = np.array(mass, dtype=np.float64).reshape(-1)              # [kg]    shape (N,)
+        self.position = np.array(position, dtype=dtype).reshape(-1, 3)            # [m]     shape (N,3)
+        self.velocity = np.array(velocity, dtype=dtype).reshape(-1, 3)            # [m/s]   shape (N,3)
+        self.t        = float(t)                                                  # [s]
+        self.forceModel = forceModel
+        self.theta      = theta                                                   # Barnes-Hut opening angle
+        self.softening  = softening                                               # [m]
+        self.backend    = backend                                                 # 'numpy', 'jit' or 'auto'
+
+        if not (len(self.names) == len(self.mass) == len(self.position) == len(self.velocity)):
+            raise ValueError('names, mass, position and velocity must describe the same number of bodies')
+        self._refresh()
+
+    # Rebuilding the cached per-body quantities whenever bodies are added
+    def _refresh(self):
+        self.index = {name: k for k, name in enumerate(self.names)}
+        massive = self.mass[1:] > 0
+        # Test particles get a unit mass so their "force" is really an acceleration [m*s^(-2)]
+        self._unitMass = np.where(massive, self.mass[1:], 1.0)
+        # Numerator of Newton's law for each body and the sun (G*M*m) [m^3*kg*s^(-2)]
+        self._gravConst = G*self._unitMass*self.mass[0]
+        # Only massive bodies push back on the sun
+        self._reaction = massive.astype(np.float64)[:, None]
+        # G*M of the sun and of every body that pulls back on it, for the single precision force [m^3*s^(-2)]
+        self._sunGM32 = np.float32(G*self.mass[0])
+        self._reactionGM32 = (G*self.mass[1:]*massive).astype(np.float32)
+        # Side state of the precision modes, started afresh from the positions
+        compensated = self.precision in ('compensated', 'heliocentric')
+        self._positionCarry = np.zeros_like(self.position) if compensated else None
+        self._velocityCarry = np.zeros_like(self.velocity) if compensated else None
+        self._offset, self._synced = None, None
+
+    @property
+    def n(self):
+        return len(self.names)
+
+    # Building a system the way the scripts do: every planet starts on the x-axis at aphelion moving along y
+    @classmethod
+    def fromAphelion(cls, mass, aphelion, initialVelocity, central='sun', **options):
+        names = [central] + list(aphelion)
+        masses = [mass[central]] + [mass[planet] for planet in aphelion]
+        position = np.zeros((len(names), 3))
+        velocity = np.zeros((len(names), 3))
+        position[1:, 0] = [aphelion[planet] for planet in aphelion]
+        velocity[1:, 1] = [initialVelocity[planet] for planet in aphelion]
+        return cls(names, masses, position, velocity, **options)
+
+    # Adding massless test particles, e.g. thousands of asteroids that only feel the sun
+    def addTestParticles(self, position, velocity, names=None):
+        position = np.array(position, dtype=np.float64).reshape(-1, 3)
+        if names is None:
+            names = ['particle%d' % k for k in range(len(self.names), len(self.names)+len(position))]
+        self.addBodies(names, np.zeros(len(position)), position, velocity)
+
+    # Adding bodies of any mass part way through a run, e.g. a comet sent in by a client of SimulationServer.py
+    def addBodies(self, names, mass, position, velocity):
+        mass = np.array(mass, dtype=np.float64).reshape(-1)
+        position = np.array(position, dtype=self.position.dtype).reshape(-1, 3)
+        velocity = np.array(velocity, dtype=self.velocity.dtype).reshape(-1, 3)
+        if not (len(names) == len(mass) == len(position) == len(velocity)):
+            raise ValueError('names, mass, position and velocity must describe the same number of bodies')
+        self.names += list(names)
+        self.mass = np.concatenate([self.mass, mass])
+        self.position = np.concatenate([self.position, position])
+        self.velocity = np.concatenate([self.velocity, velocity])
+        self._refresh()
+
+    def copy(self):
+        return NBodySystem(self.names, self.mass, self.position, self.velocity, self.t,
+                           self.forceModel, self.theta, self.softening, self.backend, self.precision)
+
+    # The side state of the precision mode (the Kahan carries, and the heliocentric offsets), for checkpoints
+    def getPrecisionState(self):
+        state = {}
+        if self.precision == 'heliocentric':
+            state['offset'] = self._heliocentric()
+        if self._positionCarry is not None:
+            state['positionCarry'], state['velocityCarry'] = self._positionCarry, self._velocityCarry
+        return state
+
+    def setPrecisionState(self, state):
+        if 'positionCarry' in state:
+            self._positionCarry = np.array(state['positionCarry'], dtype=np.float64).reshape(self.position.shape)
+            self._velocityCarry = np.array(state['velocityCarry'], dtype=np.float64).reshape(self.velocity.shape)
+        if 'offset' in state:
+            self._offset = np.array(state['offset'], dtype=np.float64).reshape(-1, 3)
+            self._synced = self.position.copy()
+
+    # Position of every body but the sun relative to the sun [m]. In 'heliocentric' precision these are the offsets
+    # the bodies are kept as, worked out again (and their carries cleared) only if something else has moved them since
+    # the last drift, e.g. a client of SimulationServer.py.
+    def _heliocentric(self):
+        if self.precision != 'heliocentric':
+            return self.position[1:] - self.position[0]
+        if self._synced is None or not np.array_equal(self._synced, self.position):
+            self._offset = self.position[1:] - self.position[0]
+            self._synced = self.position.copy()
+            self._positionCarry[1:] = 0.0
+        return self._offset
+
+    # Kahan summation values += increment in place: what the addition rounds away, (total - values) - increment, is
+    # kept in carry and taken off the next increment
+    @staticmethod
+    def _compensatedAdd(values, increment, carry):
+        increment = increment - carry
+        total = values + increment
+        np.subtract(total, values, out=carry)
+        carry -= increment
+        values[:] = total
+
+    # Changing every velocity by dv [m/s], in the arithmetic of the chosen precision
+    def kick(self, dv):
+        if self._velocityCarry is not None:
+            self._compensatedAdd(self.velocity, dv, self._velocityCarry)
+        else:
+            self.velocity += dv
+
+    # Moving every body along its velocity for h [s], p += h*v, in the arithmetic of the chosen precision
+    def drift(self, h):
+        if self.precision == 'compensated':
+            self._compensatedAdd(self.position, h*self.velocity, self._positionCarry)
+        elif self.precision == 'heliocentric':
+            offset = self._heliocentric()
+            self._compensatedAdd(offset, h*(self.velocity[1:] - self.velocity[0]), self._positionCarry[1:])
+            self._compensatedAdd(self.position[:1], h*self.velocity[:1], self._positionCarry[:1])
+            np.add(self.position[0], offset, out=self.position[1:])
+            self._synced[:] = self.position
+        else:
+            self.position += h*self.velocity
+
+    # Force on every body from the sun [kg*m*s^(-2)] (per unit mass for test particles)
+    def sunForce(self):
+        distance = self._heliocentric()                                          # [m]
+        # (x^2+y^2+z^2), summed axis by axis like the original loop [m^2]
+        modulus = distance[:, 0]**2 + distance[:, 1]**2 + distance[:, 2]**2
+        # then raised to the power 1.5 as r^2*sqrt(r^2), which is cheaper than a general power [m^3]
+        modulus *= np.sqrt(modulus)
+        return distance * (-self._gravConst/modulus)[:, None]
+
+    # The same pull per unit mass in single precision, where G*M*m (and r^3 past 7e12 m) would overflow: the
+    # weight G*M/r^3 is worked out as ((G*M/r)/r)/r, and the sun's reaction as the sum of G*m/r^3 times the distance
+    def _sunAcceleration32(self):
+        distance = self.position[1:] - self.position[0]                          # [m]
+        inverse = 1/np.sqrt(distance[:, 0]**2 + distance[:, 1]**2 + distance[:, 2]**2)      # [m^(-1)]
+        squared = inverse*inverse
+        acceleration = np.empty_like(self.position)
+        acceleration[1:] = distance*(-self._sunGM32*inverse*squared)[:, None]
+        acceleration[0] = np.add.reduce(distance*(self._reactionGM32*inverse*squared)[:, None], axis=0)
+        return acceleration
+
+    # Acceleration of every body under the chosen force model [m*s^(-2)]
+    def acceleration(self):
+        if self.backend != 'numpy':
+            import JitKernels
+            if JitKernels.enabled(self):
+                return JitKernels.acceleration(self)
+        if self.forceModel == 'sun' and self.precision == 'float32':
+            return self._sunAcceleration32()
+        if self.forceModel == 'sun':
+            force = self.sunForce()
+            acceleration = np.empty_like(self.position)
+            acceleration[1:] = force/self._unitMass[:, None]
+            acceleration[0] = -np.add.reduce(force*self._reaction, axis=0)/self.mass[0]
+            return acceleration
+        # Imported here because GravityKernels.py itself imports G from this file
+        from GravityKernels import acceleration
+        # The kernels work out r^3, which overflows single precision past 7e12 m, so float32 positions are widened
+        position = self.position.astype(np.float64) if self.precision == 'float32' else self.position
+        return acceleration(position, self.mass, self.forceModel, self.theta, self.softening)
+
+    # Advancing the whole system by one step of dt [s]
+    def step(self, dt):
+        if self.forceModel != 'sun' or self.precision == 'float32':
+            self.kick(dt*self.acceleration())
+            self.drift(dt)
+            self.t += dt
+            return
+
+        force = self.sunForce()
+        dv = np.empty_like(self.velocity)
+
+        # v = (s*kg^(-1))*(kg*m*s^(-2)) = m*s^(-1)
+        dv[1:] = (dt/self._unitMass)[:, None]*force
+
+        # The force on the sun is the sum of the forces on the massive bodies, but negative
+        forceSun = np.add.reduce(force*self._reaction, axis=0)
+        dv[0] = (-dt/self.mass[0])*forceSun
+        self.kick(dv)
+
+        # p = (s)*(m*s^(-1)) = m, for every body at once: the original loop moves the sun last, but nothing in between
+        # depends on the positions, so the numbers are the same
+        self.drift(dt)
+
+        self.t += dt
+
+    # Advancing nSteps steps. Without an integrator (see Integrators.py) the engine's own semi-implicit Euler step is
+    # used. After every step the state is offered to the recorder, e.g. a TrajectoryBuffer (see TrajectoryBuffer.py).
+    # With the jit backend the steps themselves run in compiled code when the integrator is one of the compiled ones.
+    def run(self, nSteps, dt, recorder=None, integrator=None):
+        if self.precision != 'float64' and integrator is not None and \
+                integrator.name not in precisionIntegrators:
+            raise ValueError("The %s integrator only runs in 'float64' precision, not '%s'"
+                             % (integrator.name, self.precision))
+        if self.backend != 'numpy':
+            import JitKernels
+            if JitKernels.enabled(self) and JitKernels.run(self, nSteps, dt, recorder, integrator):
+                return recorder
+        for k in range(nSteps):
+            if integrator is None:
+                self.step(dt)
+            else:
+                integrator.step(self, dt)
+            if recorder is not None:
+                recorder.record(self.t, self.position, self.velocity)
+        return recorder
+# ---------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,132 @@
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib import animation
+
+# Settings ------------------------------------------------------------------------------------------------------------
+# Marker colour and size of the bodies the simulations know; any other body (a minor body, say) gets defaultStyle
+bodyStyles = {
+    'sun':      ('yellow', 10),
+    'mercury':  ('mediumblue', 2),
+    'venus':    ('orange', 4),
+    'earth':    ('blue', 5),
+    'mars':     ('red', 3),
+    'jupiter':  ('burlywood', 9),
+    'saturn':   ('beige', 8),
+    'uranus':   ('turquoise', 7),
+    'neptune':  ('lightsteelblue', 6),
+    'pluto':    ('brown', 1),
+}
+defaultStyle = ('grey', 1)
+blockFrames = 256                                   # Frames read from the trajectory at a time
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Trails --------------------------------------------------------------------------------------------------------------
+# The last `length` positions of every body, kept in a fixed NumPy array instead of lists that grow every frame.
+# Every point is written twice, at slot k and slot k+length, so the newest `length` points are always one contiguous
+# slice of the array; drawing a trail is then a view, and adding a point costs the same however long the run is.
+class TrailBuffer:
+    def __init__(self, nBodies, length):
+        self.length = int(length)
+        self._points = np.full((nBodies, 2*self.length, 2), np.nan)
+        self._head = 0                              # Slot the next point goes into
+        self.count = 0
+
+    def push(self, xy):
+        self._points[:, self._head] = xy
+        self._points[:, self._head + self.length] = xy
+        self._head = (self._head + 1) % self.length
+        self.count += 1
+
+    # The trail of body b, oldest point first (a view)
+    def trail(self, b):
+        if self.count < self.length:
+            return self._points[b, :self.count]
+        return self._points[b, self._head:self._head + self.length]
+
+    def clear(self):
+        self._points[:] = np.nan
+        self._head = 0
+        self.count = 0
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Renderer ------------------------------------------------------------------------------------------------------------
+# Animates any trajectory with names and positions() (a TrajectoryBuffer, or a run read back with openTrajectory()):
+# one path, marker and label per body, built from the trajectory's list of bodies rather than a variable per planet.
+#   trailLength   number of frames each body's path is drawn for
+#   stride        frame decimation: every frame advances this many records, so long runs play back at a set speed
+#   limit         half-width of the (fixed) view [m]; the axes are set once, so blitting only redraws the bodies
+#   styles        {body: (colour, marker size)} overriding bodyStyles
+#   trailColour   colour of every trail, or None to draw each trail in its body's colour
+class OrbitRenderer:
+    def __init__(self, trajectory, bodies=None, ax=None, trailLength=500, stride=1, limit=None, labels=True,
+                 styles=None, trailColour='g'):
+        self.trajectory = trajectory
+        self.names = list(trajectory.names if bodies is None else bodies)
+        self.columns = np.array([trajectory.names.index(name) for name in self.names])
+        self.stride = max(1, int(stride))
+        self.trails = TrailBuffer(len(self.names), trailLength)
+        self._block, self._blockStart = None, 0
+
+        if ax is None:
+            fig, ax = plt.subplots(figsize=(10, 10))
+        self.ax = ax
+        ax.set_aspect('equal')
+        ax.grid()
+        start = self._frame(0)
+        if limit is None:
+            limit = 1.1*np.abs(start).max()
+        ax.set_xlim(-limit, limit)
+        ax.set_ylim(-limit, limit)
+
+        styles = dict(bodyStyles, **(styles or {}))
+        self.paths, self.markers, self.labels = [], [], []
+        for b, name in enumerate(self.names):
+            colour, size = styles.get(name, defaultStyle)
+            self.paths.append(ax.plot([], [], '-', color=colour if trailColour is None else trailColour, lw=1)[0])
+            self.markers.append(ax.plot([start[b, 0]], [start[b, 1]], marker='o', markersize=size,
+                                        markeredgecolor=colour, markerfacecolor=colour)[0])
+            self.labels.append(ax.text(start[b, 0], start[b, 1], name.title()) if labels else None)
+        self.artists = self.paths + self.markers + [label for label in self.labels if label is not None]
+
+    @property
+    def frames(self):
+        return len(self.trajectory)//self.stride
+
+    # x and y of the drawn bodies at frame i. Frames are read blockFrames at a time, so a stored run is read (an npz
+    # shard decompressed) once per block rather than once per frame
+    def _frame(self, i):
+        start = self._blockStart
+        if self._block is None or not start <= i < start + len(self._block):
+            start = i - i % blockFrames
+            records = self.trajectory.positions()[start*self.stride:(start + blockFrames)*self.stride:self.stride]
+            self._block, self._blockStart = np.asarray(records)[:, self.columns, :2], start
+        return self._block[i - start]
+
+    def init(self):
+        self.trails.clear()
+        for path in self.paths:
+            path.set_data([], [])
+        return self.artists
+
+    # Filling the trails as they stand just before frame i, so that drawing can start anywhere in the run
+    def seek(self, i):
+        self.trails.clear()
+        for k in range(max(0, i - self.trails.length + 1), i):
+            self.trails.push(self._frame(k))
+
+    # Drawing frame i: one record in, one point per trail, and only the bodies' artists are touched
+    def update(self, i):
+        xy = self._frame(i)
+        self.trails.push(xy)
+        for b in range(len(self.names)):
+            trail = self.trails.trail(b)
+            self.paths[b].set_data(trail[:, 0], trail[:, 1])
+            self.markers[b].set_data([xy[b, 0]], [xy[b, 1]])
+            if self.labels[b] is not None:
+                self.labels[b].set_position((xy[b, 0], xy[b, 1]))
+        return self.artists
+
+    def animate(self, interval=1):
+        return animation.FuncAnimation(self.ax.figure, func=self.update, init_func=self.init, frames=self.frames,
+                                       interval=interval, blit=True)
+# ---------------------------------------------------------------------------------------------------------------------
@@ -1,56 +1,18 @@
 # Source for formulae: https://en.wikipedia.org/wiki/Semi-major_and_semi-minor_axes
 # Source for data: https://nssdc.gsfc.nasa.gov/planetary/factsheet/index.html
 
-from math import sqrt
-import math
 import numpy as np
 import matplotlib.pyplot as plt
+from BodyCatalog import loadCatalog
+from KeplerOrbits import semiMinorAxis, ellipseRadius
 
 # Variable definitions ------------------------------------------------------------------------------------------------
-semiMajor = {
-    'mercury':  5.7909e10,                          # Mercury's semi-major axis length [m]
-    'venus':    1.0821e11,                          # Venus' semi-major axis length [m]
-    'earth':    1.49598e11,                         # Earth's semi-major axis length [m]
-    'mars':     2.27956e11,                         # Mars' semi-major axis length [m]
-    'jupiter':  7.78479e11,                         # Jupiter's semi-major axis length [m]
-    'saturn':   1.43204e12,                         # Saturn's semi-major axis length [m]
-    'uranus':   2.86704e12,                         # Uranus' semi-major axis length [m]
-    'neptune':  4.51495e12,                         # Neptune's semi-major axis length [m]
-    'pluto':    5.869656e12                         # Pluto's semi-major axis length [m]
-}
-aphelion = {
-    'mercury':  6.9818e10,                          # Mercury's furthest distance from the sun [m]
-    'venus':    1.08941e11,                         # Venuss' furthest distance from the sun [m]
-    'earth':    1.521e11,                           # Earth's furthest distance from the sun [m]
-    'mars':     2.49261e11,                         # Mars' furthest distance from the sun [m]
-    'jupiter':  8.16363e11,                         # Jupiter's furthest distance from the sun [m]
-    'saturn':   1.50653e12,                         # Saturn's furthest distance from the sun [m]
-    'uranus':   3.00139e12,                         # Uranus' furthest distance from the sun [m]
-    'neptune':  4.55886e12,                         # Neptune's furthest distance from the sun [m]
-    'pluto':    7.304326e12                         # Pluto's furthest distance from the sun [m]
-}
-perihelion = {
-    'mercury':  4.6e10,                             # Mercury's closest diatance to the sun [m]
-    'venus':    1.0748e11,                          # Venus' closest diatance to the sun [m]
-    'earth':    1.47095e11,                         # Earth's closest diatance to the sun [m]
-    'mars':     2.0665e11,                          # Mars' closest diatance to the sun [m]
-    'jupiter':  7.40595e11,                         # Jupiter's closest diatance to the sun [m]
-    'saturn':   1.35755e12,                         # Saturn's closest diatance to the sun [m]
-    'uranus':   2.7327e12,                          # Uranus' closest diatance to the sun [m]
-    'neptune':  4.47105e12,                         # Neptune's closest diatance to the sun [m]
-    'pluto':    4.434987e12                         # PLuto's closest diatance to the sun [m]
-}
-eccentricity = {
-    'mercury':  0.2056,                             # Mercury's eccentricity
-    'venus':    0.0068,                             # Venus' eccentricity
-    'earth':    0.0167,                             # Earth's eccentricity
-    'mars':     0.0935,                             # Mars' eccentricity
-    'jupiter':  0.0487,                             # Jupiter's eccentricity
-    'saturn':   0.052,                              # Saturn's eccentricity
-    'uranus':   0.0469,                             # Uranus' eccentricity
-    'neptune':  0.0097,                             # Neptune's eccentricity
-    'pluto':    0.2444                              # PLuto's eccentricity
-}
+# The eight planets and Pluto, read from PlanetaryFactSheet.xlsx (see BodyCatalog.py)
+catalog         = loadCatalog()
+semiMajor       = catalog.asDict('semiMajor', catalog.planets)          # Semi-major axis length of each planet [m]
+aphelion        = catalog.asDict('aphelion', catalog.planets)           # Furthest distance from the sun [m]
+perihelion      = catalog.asDict('perihelion', catalog.planets)         # Closest distance to the sun [m]
+eccentricity    = catalog.asDict('eccentricity', catalog.planets)       # Eccentricity of each orbit
 # ---------------------------------------------------------------------------------------------------------------------
 
 # Formulae ------------------------------------------------------------------------------------------------------------
@@ -70,50 +32,38 @@ eccentricity = {
 # ---------------------------------------------------------------------------------------------------------------------
 
 # Calculations --------------------------------------------------------------------------------------------------------
+# Every planet is one row of an array and every angle one column, so the formulae below run on all of them at once
+# (see KeplerOrbits.py for the functions, and for positions along the orbits at any time)
+planets = list(semiMajor)
+a = np.array([semiMajor[planet] for planet in planets])[:, None]
+ap = np.array([aphelion[planet] for planet in planets])[:, None]
+pe = np.array([perihelion[planet] for planet in planets])[:, None]
+e = np.array([eccentricity[planet] for planet in planets])[:, None]
+
 # Here we use the two methods described above (formula 1 and formula 2) and then find their average in order to get the
 # length of the semi-minor axis for each planet:
-semiMinor, formula1, formula2 = {}, {}, {}
-for planet in semiMajor:
-    formula1[planet] = sqrt(aphelion[planet]*perihelion[planet])
-    formula2[planet] = semiMajor[planet]*sqrt(1-eccentricity[planet]**2)
-    semiMinor[planet] = (formula1[planet]+formula2[planet])/2
-
-# Initializing two dictionaries, one for the radii of ellipse, and the other for the cartesian coordinates
-radius, cartesian = {}, {}
+b = (np.sqrt(ap*pe) + semiMinorAxis(a, e))/2
+semiMinor = dict(zip(planets, b[:, 0]))
 
 # Creating a list containing the name of all planets for the legend
-planetList = list(semiMajor.keys())
-planetList = [word.title() for word in planetList]
+planetList = [word.title() for word in planets]
 
 # Creating an array for the angle theta
 theta = np.arange(0, (2 * np.pi), 0.01)
 
-for planet in semiMajor:
-    # Giving each planet two coordinates
-    cartesian[planet] = [[], []]
+# Here we use formula 0 to find the radius of each ellipse at every angle, shape (planets, angles)
+radii = ellipseRadius(a, b, theta)
 
-    # Opening a list for each planet
-    radius[planet] = []
+# Using formulae 3 and 4 to convert from polar to cartesian coordinates
+x, y = radii*np.cos(theta), radii*np.sin(theta)
 
-    # Here we use formula 0 to find the radius of each ellipse at every angle
-    for angle in theta:
-        radius[planet].append((semiMajor[planet]*semiMinor[planet])/math.sqrt((semiMajor[planet]*np.sin(angle))**2 + \
-                                                                              (semiMinor[planet]*np.cos(angle))**2))
+# The radii and cartesian coordinates of each planet (rows of the arrays above)
+radius = dict(zip(planets, radii))
+cartesian = {planet: [x[k], y[k]] for k, planet in enumerate(planets)}
 # ---------------------------------------------------------------------------------------------------------------------
 
 # Plotting in cartesian coordinates -----------------------------------------------------------------------------------
 for planet in semiMajor:
-    # Iterative variable
-    enum = 0
-
-    # Converting from polar to cartesian coordinates
-    for angle in theta:
-        # Using formula 3 to find the x-coordinate corresponding to the given radius and theta values
-        cartesian[planet][0].append(radius[planet][enum]*np.cos(angle))
-
-        # Using formula 4 to find the y-coordinate corresponding to the given radius and theta values
-        cartesian[planet][1].append(radius[planet][enum]*np.sin(angle))
-        enum += 1
     plt.subplot(1, 2, 1)
     plt.plot(cartesian[planet][0], cartesian[planet][1])
 
@@ -0,0 +1,84 @@
+# Plotting a trajectory saved by RunSimulation.py (or any writer in TrajectoryIO.py)
+# Usage: python PlotTrajectory.py runs/century [--bodies earth,mars] [--save orbits.png]
+#        python PlotTrajectory.py runs/century --animate [--stride 10] [--trail 500]
+#        python PlotTrajectory.py runs/century --lod [--limit 2] [--years 10,20] [--budget 100000]
+#
+# This is the only place the saved runs meet matplotlib, and it is imported only once there is something to draw, so
+# the simulation side never pays for it. With --lod the paths are drawn from a level-of-detail pyramid (see
+# TrajectoryPyramid.py) and redrawn at the right level as you zoom, so the inner planets can be looked at without
+# editing the view limits, however long the run.
+
+import argparse
+import os
+import numpy as np
+from TrajectoryIO import openTrajectory
+
+# Drawing the path of every chosen body in the x-y plane, at most maxPoints points per body [m]
+def plotTrajectory(trajectory, bodies=None, maxPoints=20000, ax=None):
+    import matplotlib.pyplot as plt
+
+    bodies = trajectory.names if bodies is None else bodies
+    stride = max(1, len(trajectory)//maxPoints)
+    if ax is None:
+        fig, ax = plt.subplots(figsize=(10, 10))
+    for name in bodies:
+        path = np.asarray(trajectory.body(name)[::stride])
+        ax.plot(path[:, 0], path[:, 1], lw=1, label=name.title())
+        ax.plot(path[-1, 0], path[-1, 1], 'o', markersize=4, color=ax.lines[-1].get_color())
+    ax.set_aspect('equal')
+    ax.grid()
+    ax.legend(bbox_to_anchor=(1.02, 1), loc='upper left', borderaxespad=0, title='Bodies')
+    ax.set_title('%s, %d records' % (trajectory.metadata['integrator'], len(trajectory)))
+    return ax
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Plot a saved trajectory.')
+    parser.add_argument('path', help='trajectory directory or HDF5 file')
+    parser.add_argument('--bodies', help='comma separated bodies to draw (default: all)')
+    parser.add_argument('--save', help='write the figure to this file instead of opening a window')
+    parser.add_argument('--animate', action='store_true', help='play the run back (see OrbitRenderer.py)')
+    parser.add_argument('--stride', type=int, default=1, help='records per animation frame (default: 1)')
+    parser.add_argument('--trail', type=int, default=500, help='frames of trail behind each body (default: 500)')
+    parser.add_argument('--lod', action='store_true',
+                        help='draw from the pyramid of TrajectoryPyramid.py (built first if the run has none)')
+    parser.add_argument('--limit', type=float, help='with --lod: half-width of the first view [AU] (default: all)')
+    parser.add_argument('--years', help='with --lod: time range to draw, as start,end [years] (default: all)')
+    parser.add_argument('--budget', type=int, default=20000,
+                        help='with --lod: most points per body and view; a view that needs more is cut short in '
+                             'time (default: 20000)')
+    options = parser.parse_args()
+
+    if options.save:
+        import matplotlib
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    with openTrajectory(options.path) as trajectory:
+        bodies = None if options.bodies is None else [name.strip().lower() for name in options.bodies.split(',')]
+        if options.animate:
+            from OrbitRenderer import OrbitRenderer
+            renderer = OrbitRenderer(trajectory, bodies, trailLength=options.trail, stride=options.stride)
+            anim = renderer.animate(interval=1)
+            plt.show()
+        elif options.lod:
+            from NBodyEngine import secondsPerDay, daysPerYear
+            from TrajectoryPyramid import PyramidPlot, buildPyramid, loadPyramid, pyramidPath
+            if os.path.exists(pyramidPath(options.path)):
+                pyramid = loadPyramid(pyramidPath(options.path))
+            else:
+                pyramid = buildPyramid(trajectory, bodies)
+            timeRange = None
+            if options.years:
+                timeRange = [float(value)*daysPerYear*secondsPerDay for value in options.years.split(',')]
+            plot = PyramidPlot(pyramid, bodies, limit=None if options.limit is None else options.limit*1.496e11,
+                               timeRange=timeRange, budget=options.budget)
+            if options.save:
+                plt.savefig(options.save, bbox_inches='tight')
+            else:
+                plt.show()
+        elif options.save:
+            plotTrajectory(trajectory, bodies)
+            plt.savefig(options.save, bbox_inches='tight')
+        else:
+            plotTrajectory(trajectory, bodies)
+            plt.show()
@@ -0,0 +1,171 @@
+# Headless command-line runs, for compute nodes without a display
+# Usage: python RunSimulation.py --years 100 --dt 1 --integrator wisdomHolman --output runs/century
+#        python RunSimulation.py --years 20 --diagnostics metrics.json --profile
+#        python RunSimulation.py --help
+#
+# Nothing here imports matplotlib: the run is streamed to disk (see TrajectoryIO.py) and looked at afterwards with
+# PlotTrajectory.py, on any machine.
+
+import argparse
+import sys
+import time
+import numpy as np
+from NBodyEngine import secondsPerDay, daysPerYear, precisions, precisionIntegrators
+from Integrators import integrators, makeIntegrator
+from TrajectoryIO import makeWriter, openTrajectory, writers
+from BodyCatalog import loadCatalog
+from Checkpoint import loadCheckpoint, saveCheckpoint
+from TrajectoryBuffer import RecorderGroup
+from Diagnostics import ConservationMonitor, PhaseTimers, instrument, writeMetrics
+from Encounters import EncounterDetector, EncounterStop, catalogRadii, writeEvents
+from Ephemeris import fitEphemeris
+
+def parseArguments(arguments=None):
+    parser = argparse.ArgumentParser(description='Run a solar system simulation without plotting it.')
+    parser.add_argument('--bodies', default='all',
+                        help="comma separated bodies from the catalog, e.g. 'earth,mars' (default: all planets)")
+    parser.add_argument('--minor-bodies', dest='minorBodies', action='append', default=[], metavar='CSV',
+                        help='CSV file of minor bodies to add (see BodyCatalog.addCsv), may be repeated')
+    parser.add_argument('--years', type=float, default=5.0, help='length of the run [years] (default: 5)')
+    parser.add_argument('--dt', type=float, default=1.0, help='time step [days] (default: 1)')
+    parser.add_argument('--integrator', default='euler', choices=sorted(integrators),
+                        help='integrator (default: euler, the original update)')
+    parser.add_argument('--force-model', dest='forceModel', default='sun',
+                        choices=['sun', 'direct', 'barnesHut', 'auto'], help='force model (default: sun)')
+    parser.add_argument('--theta', type=float, default=0.5, help='Barnes-Hut opening angle (default: 0.5)')
+    parser.add_argument('--backend', default='numpy', choices=['numpy', 'jit', 'auto'],
+                        help='numpy, or the compiled kernels of JitKernels.py (needs Numba) (default: numpy)')
+    parser.add_argument('--precision', default='float64', choices=list(precisions),
+                        help='arithmetic of the position updates, see NBodyEngine.py (default: float64)')
+    parser.add_argument('--output', help='where to write the trajectory; without it only the final state is printed')
+    parser.add_argument('--format', default='npy', choices=sorted(writers), help='trajectory format (default: npy)')
+    parser.add_argument('--every', type=int, default=1, help='record every k-th step (default: 1)')
+    parser.add_argument('--float32', action='store_true', help='store the trajectory in single precision')
+    parser.add_argument('--velocities', action='store_true', help='store velocities as well as positions')
+    parser.add_argument('--checkpoint', help='checkpoint file, written every --checkpoint-interval steps')
+    parser.add_argument('--checkpoint-interval', dest='checkpointInterval', type=int, default=10000,
+                        help='steps between checkpoints (default: 10000)')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue the run saved in --checkpoint (--output then holds the rest of the run)')
+    parser.add_argument('--diagnostics', metavar='PATH',
+                        help='write energy, momentum and angular momentum checks (and timings) to a JSON or CSV file')
+    parser.add_argument('--diagnostics-every', dest='diagnosticsEvery', type=int, default=100,
+                        help='steps between conservation checks (default: 100)')
+    parser.add_argument('--elements', action='store_true',
+                        help='add the osculating elements of every body to the conservation checks')
+    parser.add_argument('--profile', action='store_true',
+                        help='time the force evaluations, integration, recording and I/O of the run (the '
+                             'compiled steps of --backend jit only show in the wall time)')
+    parser.add_argument('--encounters', metavar='PATH',
+                        help='log close approaches, collisions and ejections to a JSON or CSV file')
+    parser.add_argument('--hill-factor', dest='hillFactor', type=float, default=3.0,
+                        help='close approaches are within this many Hill radii (default: 3)')
+    parser.add_argument('--stop-on', dest='stopOn', action='append', default=[],
+                        choices=['approach', 'collision', 'ejection'],
+                        help='stop the run after the step in which such an event happens (repeatable)')
+    parser.add_argument('--ephemeris', metavar='PATH',
+                        help='fit a Chebyshev ephemeris (see Ephemeris.py) to the run in --output and save it here')
+    parser.add_argument('--quiet', action='store_true', help='do not print progress')
+    return parser.parse_args(arguments)
+
+def main(arguments=None):
+    options = parseArguments(arguments)
+    start = time.perf_counter()
+
+    if options.ephemeris and not options.output:
+        sys.exit('--ephemeris needs --output')
+    if options.precision != 'float64' and options.integrator not in precisionIntegrators:
+        sys.exit("The %s integrator only runs in 'float64' precision, not '%s' (use %s)"
+                 % (options.integrator, options.precision, ', '.join(precisionIntegrators)))
+    step = 0
+    if options.resume:
+        if not options.checkpoint:
+            sys.exit('--resume needs --checkpoint')
+        system, integrator, settings = loadCheckpoint(options.checkpoint)
+        dt, step, nSteps = settings['dt'], settings['step'], settings['nSteps']
+    else:
+        catalog = loadCatalog(minorBodies=options.minorBodies)
+        bodies = None if options.bodies == 'all' else [name.strip().lower() for name in options.bodies.split(',')]
+        if bodies is not None:
+            unknown = [name for name in bodies if name not in catalog.index]
+            if unknown:
+                sys.exit('Unknown bodies: %s (the catalog has %s)' % (', '.join(unknown), ', '.join(catalog.names)))
+        elif options.minorBodies:
+            bodies = catalog.names
+        system = catalog.system(bodies, forceModel=options.forceModel, theta=options.theta,
+                                precision=options.precision)
+        integrator = makeIntegrator(options.integrator)
+        dt = options.dt*secondsPerDay
+        nSteps = int(np.ceil(options.years*daysPerYear*secondsPerDay/dt))
+    system.backend = options.backend
+
+    writer, monitor, detector, timers = None, None, None, None
+    if options.output:
+        writer = makeWriter(options.output, system, dt, integrator, options.format, every=options.every,
+                            dtype=np.float32 if options.float32 else np.float64, velocities=options.velocities)
+    if options.diagnostics:
+        monitor = ConservationMonitor(system, options.diagnosticsEvery, options.elements)
+    if options.encounters:
+        detector = EncounterDetector(system, catalogRadii(system.names, loadCatalog(minorBodies=options.minorBodies)),
+                                     options.hillFactor, stopOn=options.stopOn)
+    # The detector goes last, so that the step it stops the run at is still recorded by the others
+    recorders = [part for part in (writer, monitor, detector) if part is not None]
+    recorder = RecorderGroup(*recorders) if len(recorders) > 1 else (recorders[0] if recorders else None)
+    if options.profile:
+        timers = instrument(PhaseTimers(), system, integrator, recorder)
+
+    # Running in slices so that progress can be reported (and checkpoints written) while the run goes
+    progressEvery = max(1, nSteps//20)
+    while step < nSteps:
+        stop = min(nSteps, (step//progressEvery + 1)*progressEvery)
+        if options.checkpoint:
+            stop = min(stop, (step//options.checkpointInterval + 1)*options.checkpointInterval)
+        checks = detector.checks if detector is not None else 0
+        stopped = None
+        try:
+            system.run(stop - step, dt, recorder=recorder, integrator=integrator)
+        except EncounterStop as encounter:
+            stopped = encounter
+            stop = step + detector.checks - checks
+        step = stop
+        if options.checkpoint and (step % options.checkpointInterval == 0 or step == nSteps or stopped):
+            if timers is None:
+                saveCheckpoint(options.checkpoint, system, integrator, dt, step, nSteps)
+            else:
+                with timers.phase('checkpoint'):
+                    saveCheckpoint(options.checkpoint, system, integrator, dt, step, nSteps)
+        if not options.quiet and (step % progressEvery == 0 or step == nSteps):
+            print('%5.1f%%  t = %.4g years' % (100.0*step/nSteps, system.t/(daysPerYear*secondsPerDay)), flush=True)
+        if stopped is not None:
+            if not options.quiet:
+                print('Stopped after step %d: %s' % (step, stopped), flush=True)
+            break
+
+    if writer is not None:
+        writer.close()
+    if options.ephemeris:
+        with openTrajectory(options.output) as trajectory:
+            ephemeris = fitEphemeris(trajectory)
+        ephemeris.save(options.ephemeris)
+    if options.diagnostics:
+        writeMetrics(options.diagnostics, monitor, timers, settings=vars(options), integrator=integrator.report())
+    if detector is not None:
+        writeEvents(options.encounters, detector.events, summary=detector.summary(), settings=vars(options))
+
+    if not options.quiet:
+        print('Finished %d steps of %d bodies in %.3g s' % (step, system.n, time.perf_counter() - start),
+              integrator.report())
+        if options.output:
+            print('Trajectory written to %s' % options.output)
+        if options.ephemeris:
+            print('Ephemeris written to %s' % options.ephemeris)
+        if monitor is not None:
+            print('Conservation:', monitor.summary())
+        if detector is not None:
+            print('Encounters:', detector.summary())
+        if timers is not None:
+            print(timers)
+    return system, integrator
+
+if __name__ == '__main__':
+    main()
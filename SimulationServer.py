@@ -0,0 +1,565 @@
+# Live simulation server: a run integrated in a worker thread, watched and steered by any number of clients
+# Usage: python SimulationServer.py serve --years 100 --integrator leapfrog --every 10 [--port 8765]
+#        python SimulationServer.py watch [--port 8765] [--bodies earth,mars] [--command '{"command": "pause"}']
+#        python SimulationServer.py demo
+#
+# 'demo' starts a server and two clients (one of them slow) in one process, steers the run through every command and
+# prints what came back, so the whole thing can be tried without a network or a display.
+
+import argparse
+import asyncio
+import json
+import queue
+import socket
+import sys
+import threading
+import time
+from collections import deque
+import numpy as np
+from NBodyEngine import secondsPerDay, daysPerYear
+from Integrators import integrators, makeIntegrator
+from BodyCatalog import loadCatalog
+from Checkpoint import saveCheckpoint
+
+# Protocol ------------------------------------------------------------------------------------------------------------
+# TCP with one JSON object per line in both directions, so that `nc localhost 8765` is a client too. The server sends
+#   {"type": "hello", "client": k, "names": [...], "mass": [...], "t": ..., "step": ..., "dt": ..., "paused": ...}
+#                                                       once, on connecting
+#   {"type": "state", "t": ..., "step": ..., "position": [[x, y, z], ...], "velocity": [...]}
+#                                                       every `every` steps, rows in the order of the last names
+#   {"type": "bodies", "names": [...], "mass": [...]}   when bodies are added
+#   {"type": "reply", "id": ..., "command": ..., ...}   or {"type": "error", "id": ..., "message": ...}
+#   {"type": "finished", "t": ..., "step": ...}         at the end of the run, after which the server closes
+# and takes commands {"command": ..., "id": ...} (the id, if any, comes back in the reply):
+#   pause, resume       stop and restart the integration, between two slices of `every` steps
+#   dt                  {"days": 0.5} changes the time step
+#   add                 {"name": ..., "mass": 0, "position": [...], "velocity": [...]} adds a body [kg, m, m/s]
+#   checkpoint          saves a checkpoint (see Checkpoint.py) to the server's checkpoint file
+#   subscribe           {"bodies": [...] or null, "every": k}: only these bodies (in this order) and only every k-th
+#                       state, for this client
+#   status              time, step, dt, and the states sent to and dropped for every client
+#   stop                ends the run
+# Units are those of the engine: [s], [m], [m/s], [kg].
+#
+# Backpressure: every client has its own sender task and a queue of at most clientQueue states. When a client reads
+# slower than the states come, the oldest waiting state is dropped (a live view only needs the newest), so a slow
+# client never holds up the integration or the other clients. The socket buffers are kept small (sendBuffer) for the
+# same reason: what a client gets should be recent. States are encoded to JSON only when they are sent, so dropped ones
+# cost nothing. Replies and the other messages are never dropped.
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Settings ------------------------------------------------------------------------------------------------------------
+host = '127.0.0.1'                                  # Only local clients by default
+port = 8765
+every = 10                                          # Steps between two states sent out
+clientQueue = 8                                     # States waiting per client before the oldest is dropped
+sendBuffer = 2**16                                  # Bytes in flight per client (kernel and asyncio buffers each)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Worker --------------------------------------------------------------------------------------------------------------
+# Runs the simulation in its own thread, `every` steps at a time, until the system reaches the time end [s]. Commands
+# are queued by the server and applied between two slices, so they never see a half done step. publish() is called
+# from the worker thread with every message for the clients; stepsPerSecond (None: as fast as possible) slows the
+# run down to watching speed.
+class SimulationWorker:
+    def __init__(self, system, integrator, dt, end, every=every, checkpoint='checkpoint.npz', stepsPerSecond=None):
+        self.system = system
+        self.integrator = integrator
+        self.dt = float(dt)                                                         # [s]
+        self.end = float(end)                                                       # [s]
+        self.every = int(every)
+        self.checkpoint = checkpoint
+        self.stepsPerSecond = stepsPerSecond
+        self.step = 0
+        self.paused = False
+        self.stopped = False
+        self.finished = False
+        self._controls = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='simulation', daemon=True)
+
+    def start(self, publish):
+        self.publish = publish
+        self._thread.start()
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+    # Queuing a command; reply(message) is called from the worker thread once it has been applied
+    def command(self, message, reply):
+        with self._lock:
+            if self.finished:
+                result = {'type': 'error', 'message': 'the run is over'}
+                if 'id' in message:
+                    result['id'] = message['id']
+                reply(result)
+            else:
+                self._controls.put((message, reply))
+
+    def remaining(self):
+        return max(0, int(np.ceil((self.end - self.system.t)/self.dt - 1e-9)))
+
+    def _run(self):
+        paceTime, paceStep = time.perf_counter(), self.step
+        while not self.stopped and self.remaining() > 0:
+            if self._applyCommands(block=self.paused):
+                paceTime, paceStep = time.perf_counter(), self.step
+            if self.paused or self.stopped:
+                continue
+            steps = min(self.every, self.remaining())
+            self.system.run(steps, self.dt, integrator=self.integrator)
+            self.step += steps
+            self.publish(_State(self.system.t, self.step, self.system.position.copy(), self.system.velocity.copy()))
+            if self.stepsPerSecond:
+                delay = paceTime + (self.step - paceStep)/self.stepsPerSecond - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+        with self._lock:
+            self.finished = True
+        self._applyCommands(block=False)
+        self.publish({'type': 'finished', 't': self.system.t, 'step': self.step})
+
+    # Applying the queued commands; while paused this waits for the next one. Returns whether it waited.
+    def _applyCommands(self, block):
+        waited = False
+        while True:
+            waited = waited or block
+            try:
+                message, reply = self._controls.get(block=block)
+            except queue.Empty:
+                return waited
+            try:
+                if self.finished:
+                    raise RuntimeError('the run is over')
+                result = self._apply(message)
+                result.update({'type': 'reply', 'command': message['command']})
+            except RuntimeError as error:
+                result = {'type': 'error', 'message': str(error)}
+            except (KeyError, TypeError, ValueError) as error:
+                result = {'type': 'error', 'message': '%s: %s' % (type(error).__name__, error)}
+            if 'id' in message:
+                result['id'] = message['id']
+            reply(result)
+            block = self.paused and not self.stopped
+
+    def _apply(self, message):
+        command = message['command']
+        system = self.system
+        if command == 'pause':
+            self.paused = True
+        elif command == 'resume':
+            self.paused = False
+        elif command == 'stop':
+            self.stopped = True
+        elif command == 'dt':
+            dt = float(message['days'])*secondsPerDay
+            if not dt > 0:
+                raise ValueError('dt must be positive')
+            self.dt = dt
+        elif command == 'add':
+            name = str(message['name'])
+            if name in system.index:
+                raise ValueError("there already is a body called '%s'" % name)
+            mass = float(message.get('mass', 0.0))
+            if mass < 0:
+                raise ValueError('the mass cannot be negative')
+            system.addBodies([name], [mass], [message['position']], [message['velocity']])
+            self.publish({'type': 'bodies', 'names': list(system.names), 'mass': system.mass.tolist()})
+            return {'name': name, 'n': system.n}
+        elif command == 'checkpoint':
+            saveCheckpoint(self.checkpoint, system, self.integrator, self.dt, self.step, self.step + self.remaining())
+            return {'path': self.checkpoint, 't': system.t, 'step': self.step}
+        else:
+            raise ValueError("unknown command '%s'" % command)
+        return {'t': system.t, 'step': self.step, 'dt': self.dt, 'paused': self.paused}
+
+# One state as the worker left it; its JSON lines are made when a client first sends it, once per body selection.
+# Bodies are only ever added at the end, so a row index means the same body in every state, but states from before an
+# add have fewer rows: line() gives None for those when the selection has a body they don't have yet.
+class _State:
+    def __init__(self, t, step, position, velocity):
+        self.t, self.step = t, step
+        self.position, self.velocity = position, velocity
+        self._lines = {}
+
+    def line(self, bodies=None):
+        key = None if bodies is None else tuple(bodies)
+        if key and max(key) >= len(self.position):
+            return None
+        if key not in self._lines:
+            rows = slice(None) if bodies is None else list(bodies)
+            self._lines[key] = (json.dumps({'type': 'state', 't': self.t, 'step': self.step,
+                                            'position': self.position[rows].tolist(),
+                                            'velocity': self.velocity[rows].tolist()}) + '\n').encode()
+        return self._lines[key]
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Server --------------------------------------------------------------------------------------------------------------
+class _Client:
+    def __init__(self, number, writer, size):
+        self.number = number
+        self.writer = writer
+        self.size = size
+        self.pending = deque()                      # States and messages in the order they came
+        self.waitingStates = 0
+        self.ready = asyncio.Event()
+        self.bodies = None                          # Indices of the subscribed bodies, None for all
+        self.every = 1
+        self.offered, self.sent, self.dropped = 0, 0, 0
+
+    def offer(self, state):
+        self.offered += 1
+        if self.offered % self.every:
+            return
+        if self.waitingStates >= self.size:
+            for k, item in enumerate(self.pending):
+                if isinstance(item, _State):
+                    del self.pending[k]
+                    break
+            self.waitingStates -= 1
+            self.dropped += 1
+        self.pending.append(state)
+        self.waitingStates += 1
+        self.ready.set()
+
+    def send(self, message):
+        self.pending.append(message)
+        self.ready.set()
+
+    # Sending until the connection goes; if anything goes wrong the connection is closed rather than left open with
+    # nothing coming through it
+    async def sendLoop(self):
+        try:
+            while True:
+                if not self.pending:
+                    self.ready.clear()
+                    await self.ready.wait()
+                    continue
+                item = self.pending.popleft()
+                if isinstance(item, _State):
+                    self.waitingStates -= 1
+                    line = item.line(self.bodies)
+                    if line is None:
+                        self.dropped += 1
+                        continue
+                    self.sent += 1
+                    self.writer.write(line)
+                else:
+                    self.writer.write((json.dumps(item) + '\n').encode())
+                await self.writer.drain()
+        except Exception as error:
+            if not isinstance(error, ConnectionError):
+                print('Closing client %d: %s: %s' % (self.number, type(error).__name__, error), file=sys.stderr)
+            self.writer.close()
+
+    # Waiting (at most timeout seconds) until everything queued has gone out
+    async def flush(self, timeout):
+        deadline = time.perf_counter() + timeout
+        while self.pending and time.perf_counter() < deadline:
+            await asyncio.sleep(0.01)
+
+
+class SimulationServer:
+    def __init__(self, worker, host=host, port=port, clientQueue=clientQueue):
+        self.worker = worker
+        self.host, self.port = host, port
+        self.clientQueue = clientQueue
+        self.clients = set()
+        self._handlers = set()
+        self.connections = 0
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.done = asyncio.Event()
+        self.server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.worker.start(lambda message: self.loop.call_soon_threadsafe(self._publish, message))
+        return self
+
+    # Serving until the run is over, then letting the clients have the last messages and closing
+    async def serveUntilFinished(self, flushTimeout=5.0):
+        await self.done.wait()
+        await asyncio.gather(*(client.flush(flushTimeout) for client in list(self.clients)))
+        self.server.close()
+        for client in list(self.clients):
+            client.writer.close()
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+        await self.server.wait_closed()
+        self.worker.join()
+
+    def _publish(self, message):
+        for client in self.clients:
+            if isinstance(message, _State):
+                client.offer(message)
+            else:
+                client.send(message)
+        if isinstance(message, dict) and message['type'] == 'finished':
+            self.done.set()
+
+    def _hello(self):
+        worker, system = self.worker, self.worker.system
+        return {'type': 'hello', 'names': list(system.names), 'mass': system.mass.tolist(), 't': system.t,
+                'step': worker.step, 'dt': worker.dt, 'end': worker.end, 'every': worker.every,
+                'paused': worker.paused}
+
+    async def _serve(self, reader, writer):
+        self._handlers.add(asyncio.current_task())
+        # Small buffers, so that a slow client is noticed (and given fresh states) instead of being sent stale ones
+        writer.get_extra_info('socket').setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, sendBuffer)
+        writer.transport.set_write_buffer_limits(high=sendBuffer)
+        self.connections += 1
+        client = _Client(self.connections, writer, self.clientQueue)
+        client.send(dict(self._hello(), client=client.number))
+        self.clients.add(client)
+        sender = asyncio.create_task(client.sendLoop())
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    message = json.loads(line)
+                    if not isinstance(message, dict) or 'command' not in message:
+                        raise ValueError('expected {"command": ...}')
+                except ValueError as error:
+                    client.send({'type': 'error', 'message': str(error)})
+                    continue
+                client.send(await self._command(client, message))
+        except ConnectionError:
+            pass
+        finally:
+            self.clients.discard(client)
+            self._handlers.discard(asyncio.current_task())
+            sender.cancel()
+            writer.close()
+
+    async def _command(self, client, message):
+        command = message['command']
+        if command in ('subscribe', 'status'):
+            try:
+                result = self._subscribe(client, message) if command == 'subscribe' else self._status()
+                result.update({'type': 'reply', 'command': command})
+            except (KeyError, TypeError, ValueError) as error:
+                result = {'type': 'error', 'message': '%s: %s' % (type(error).__name__, error)}
+            if 'id' in message:
+                result['id'] = message['id']
+            return result
+        future = self.loop.create_future()
+        self.worker.command(message, lambda result: self.loop.call_soon_threadsafe(future.set_result, result))
+        return await future
+
+    def _subscribe(self, client, message):
+        names = message.get('bodies')
+        index = self.worker.system.index
+        if names is not None:
+            unknown = [name for name in names if name not in index]
+            if unknown:
+                raise ValueError('unknown bodies %s' % ', '.join(map(str, unknown)))
+        every = int(message.get('every', 1))
+        if every < 1:
+            raise ValueError('every must be a positive whole number')
+        client.bodies = None if names is None else [index[name] for name in names]
+        client.every = every
+        return {'bodies': names, 'every': every}
+
+    def _status(self):
+        worker = self.worker
+        return {'t': worker.system.t, 'step': worker.step, 'dt': worker.dt, 'n': worker.system.n,
+                'paused': worker.paused,
+                'clients': {client.number: {'sent': client.sent, 'dropped': client.dropped,
+                                            'waiting': client.waitingStates} for client in self.clients}}
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Client --------------------------------------------------------------------------------------------------------------
+# A small client for scripts and tests: command() sends a command and waits for its reply, the states (and the other
+# messages) are kept in the asyncio queue `messages`. To play a slow client, delay [s] is slept after every line read
+# and receiveBuffer [bytes] shrinks the socket's receive buffer, so that the server notices sooner.
+class SimulationClient:
+    def __init__(self, delay=0.0, receiveBuffer=None):
+        self.delay = delay
+        self.receiveBuffer = receiveBuffer
+        self.messages = asyncio.Queue()
+        self.names = []
+        self.states = 0
+        self.finished = asyncio.Event()
+        self._replies = {}
+        self._ids = 0
+
+    async def connect(self, host=host, port=port):
+        if self.receiveBuffer is None:
+            self.reader, self.writer = await asyncio.open_connection(host, port)
+        else:
+            connection = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            connection.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.receiveBuffer)
+            connection.setblocking(False)
+            await asyncio.get_running_loop().sock_connect(connection, (host, port))
+            self.reader, self.writer = await asyncio.open_connection(sock=connection, limit=self.receiveBuffer)
+        self.hello = json.loads(await self.reader.readline())
+        self.names = self.hello['names']
+        self._task = asyncio.create_task(self._read())
+        return self
+
+    async def _read(self):
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                self.finished.set()
+                return
+            message = json.loads(line)
+            if message.get('id') in self._replies:
+                self._replies.pop(message['id']).set_result(message)
+            else:
+                if message['type'] == 'bodies':
+                    self.names = message['names']
+                elif message['type'] == 'state':
+                    self.states += 1
+                elif message['type'] == 'finished':
+                    self.finished.set()
+                self.messages.put_nowait(message)
+            if self.delay:
+                await asyncio.sleep(self.delay)
+
+    # Sending a command and waiting for its reply; an error reply raises RuntimeError
+    async def command(self, command, **fields):
+        self._ids += 1
+        future = asyncio.get_running_loop().create_future()
+        self._replies[self._ids] = future
+        self.writer.write((json.dumps(dict(fields, command=command, id=self._ids)) + '\n').encode())
+        await self.writer.drain()
+        reply = await future
+        if reply['type'] == 'error':
+            raise RuntimeError(reply['message'])
+        return reply
+
+    # The next state (other messages on the way are skipped)
+    async def state(self):
+        while True:
+            message = await self.messages.get()
+            if message['type'] == 'state':
+                return message
+
+    async def close(self):
+        self._task.cancel()
+        self.writer.close()
+# ---------------------------------------------------------------------------------------------------------------------
+
+def makeWorker(options):
+    system = loadCatalog().system(None if options.bodies == 'all' else
+                                  [name.strip().lower() for name in options.bodies.split(',')],
+                                  forceModel=options.forceModel)
+    system.backend = options.backend
+    return SimulationWorker(system, makeIntegrator(options.integrator), options.dt*secondsPerDay,
+                            system.t + options.years*daysPerYear*secondsPerDay, options.every, options.checkpoint,
+                            options.stepsPerSecond)
+
+async def serve(options):
+    server = await SimulationServer(makeWorker(options), options.host, options.port, options.clientQueue).start()
+    print('Serving %d bodies on %s:%d' % (server.worker.system.n, options.host, server.port), flush=True)
+    await server.serveUntilFinished()
+    print('Finished %d steps' % server.worker.step)
+
+async def watch(options):
+    try:
+        client = await SimulationClient().connect(options.host, options.port)
+    except OSError as error:
+        sys.exit('Cannot connect to %s:%d (%s)' % (options.host, options.port, error))
+    if options.bodies != 'all':
+        await client.command('subscribe', bodies=[name.strip().lower() for name in options.bodies.split(',')])
+    for text in options.command:
+        message = json.loads(text)
+        print(await client.command(message.pop('command'), **message))
+    names = client.names if options.bodies == 'all' else options.bodies.split(',')
+    while not (client.finished.is_set() and client.messages.empty()):
+        message = await client.messages.get()
+        if message['type'] == 'state':
+            position = np.array(message['position'])/1.496e11
+            print('%10.4f years  ' % (message['t']/(daysPerYear*secondsPerDay)) +
+                  '  '.join('%s (%.3f, %.3f) AU' % (name, p[0], p[1]) for name, p in zip(names, position[:4])))
+        else:
+            print(message)
+        if message['type'] == 'finished':
+            break
+    await client.close()
+
+# Steering a run through every command from one client while a slow client lags behind, and printing what happened
+async def demo(options):
+    import os
+    import tempfile
+    options.checkpoint = os.path.join(tempfile.mkdtemp(), 'checkpoint.npz')
+    server = await SimulationServer(makeWorker(options), options.host, 0, options.clientQueue).start()
+    fast = await SimulationClient().connect(options.host, server.port)
+    slow = await SimulationClient(delay=0.02, receiveBuffer=4096).connect(options.host, server.port)
+    print('Server on port %d, %d bodies, %d steps per state' % (server.port, len(fast.hello['names']),
+                                                               fast.hello['every']))
+
+    reply = await fast.command('subscribe', bodies=['earth', 'mars'])
+    first = await fast.state()
+    print('subscribe  ->', reply['bodies'], 'first state at t = %.0f s with %d rows' % (first['t'],
+                                                                                     len(first['position'])))
+    reply = await fast.command('pause')
+    while not fast.messages.empty():
+        fast.messages.get_nowait()
+    await asyncio.sleep(0.2)
+    print('pause      -> at step %d, %d states in the next 0.2 s' % (reply['step'], fast.messages.qsize()))
+    reply = await fast.command('dt', days=0.5)
+    print('dt         -> %.0f s' % reply['dt'])
+    reply = await fast.command('add', name='visitor', mass=0.0, position=[3e11, 0.0, 0.0],
+                               velocity=[0.0, 2.1e4, 0.0])
+    print('add        -> %s, now %d bodies' % (reply['name'], reply['n']))
+    reply = await fast.command('checkpoint')
+    print('checkpoint -> %s at step %d' % (reply['path'], reply['step']))
+    await fast.command('subscribe', bodies=['earth', 'visitor'])
+    await fast.command('resume')
+    states = [await fast.state() for k in range(3)]
+    print('resume     -> states %.1f days apart, visitor at x = %.4g m' % (
+        (states[2]['t'] - states[1]['t'])/secondsPerDay, states[2]['position'][1][0]))
+    try:
+        await fast.command('add', name='visitor', position=[0, 0, 0], velocity=[0, 0, 0])
+    except RuntimeError as error:
+        print('add again  -> error:', error)
+    await asyncio.sleep(2.0)
+    status = await fast.command('status')
+    clients = {name: status['clients'][str(client.hello['client'])]
+               for name, client in (('fast', fast), ('slow', slow))}
+    print('status     -> t = %.4g s, step %d, states sent (dropped): %s' % (status['t'], status['step'], ', '.join(
+        '%s %d (%d)' % (name, client['sent'], client['dropped']) for name, client in clients.items())))
+    await fast.command('stop')
+    await server.serveUntilFinished()
+    print('stop       -> finished at step %d; the fast client got %d states, the slow one %d' % (
+        server.worker.step, fast.states, slow.states))
+    await fast.close()
+    await slow.close()
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='Serve a live simulation to clients, or watch one.')
+    parser.add_argument('mode', choices=['serve', 'watch', 'demo'])
+    parser.add_argument('--host', default=host, help='address to serve on or connect to (default: %s)' % host)
+    parser.add_argument('--port', type=int, default=port, help='port (default: %d)' % port)
+    parser.add_argument('--bodies', default='all',
+                        help="serve: bodies of the run; watch: bodies to subscribe to (default: all)")
+    parser.add_argument('--years', type=float, default=100.0, help='length of the run [years] (default: 100)')
+    parser.add_argument('--dt', type=float, default=1.0, help='time step [days] (default: 1)')
+    parser.add_argument('--integrator', default='leapfrog', choices=sorted(integrators),
+                        help='integrator (default: leapfrog)')
+    parser.add_argument('--force-model', dest='forceModel', default='sun', choices=['sun', 'direct', 'barnesHut'],
+                        help='force model (default: sun)')
+    parser.add_argument('--backend', default='numpy', choices=['numpy', 'jit', 'auto'],
+                        help='see JitKernels.py (default: numpy)')
+    parser.add_argument('--every', type=int, default=every, help='steps between states (default: %d)' % every)
+    parser.add_argument('--steps-per-second', dest='stepsPerSecond', type=float,
+                        help='slow the run down to this many steps per second (default: as fast as it goes)')
+    parser.add_argument('--client-queue', dest='clientQueue', type=int, default=clientQueue,
+                        help='states waiting per client before the oldest is dropped (default: %d)' % clientQueue)
+    parser.add_argument('--checkpoint', default='checkpoint.npz', help='where the checkpoint command saves')
+    parser.add_argument('--command', action='append', default=[], metavar='JSON',
+                        help='watch: a command to send first, e.g. \'{"command": "dt", "days": 0.5}\' (repeatable)')
+    options = parser.parse_args(arguments)
+    if options.mode == 'demo' and options.stepsPerSecond is None:
+        options.stepsPerSecond = 2000.0
+    try:
+        asyncio.run({'serve': serve, 'watch': watch, 'demo': demo}[options.mode](options))
+    except KeyboardInterrupt:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
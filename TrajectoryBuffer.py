@@ -0,0 +1,104 @@
+import numpy as np
+
+# Trajectory buffer ---------------------------------------------------------------------------------------------------
+# Instead of three growing lists of Python floats per body, the positions are written into one preallocated
+# (records,N,3) array. Every value then costs 8 bytes (4 with float32 storage) instead of a boxed float and a list slot.
+#
+#   capacity    number of records to preallocate; when it is None (or runs out) the array grows chunkSize records
+#               at a time
+#   every       record only every k-th step (output decimation); the steps in between are integrated but not kept
+#   dtype       np.float64 (default) or np.float32 to halve the memory of long runs
+#   velocities  also keep the velocity of every body at every record
+#
+# body(name) and times() return views into the buffer, so plotting or analysing a body never copies its history.
+# Views taken before the buffer grows point to the old array, so take them once the run is over (or call trim()).
+
+class TrajectoryBuffer:
+    def __init__(self, names, capacity=None, every=1, dtype=np.float64, velocities=False, chunkSize=4096):
+        self.names      = list(names)
+        self.index      = {name: k for k, name in enumerate(self.names)}
+        self.every      = int(every)
+        self.dtype      = np.dtype(dtype)
+        self.chunkSize  = int(chunkSize)
+        self.count      = 0                         # Number of records kept
+        self.calls      = 0                         # Number of steps offered to record()
+
+        if self.every < 1:
+            raise ValueError('every must be a positive whole number of steps')
+        capacity = self.chunkSize if capacity is None else max(1, -(-int(capacity)//self.every))
+        self._time      = np.empty(capacity)                                                      # [s]
+        self._position  = np.empty((capacity, len(self.names), 3), dtype=self.dtype)               # [m]
+        self._velocity  = np.empty((capacity, len(self.names), 3), dtype=self.dtype) if velocities else None
+
+    @property
+    def capacity(self):
+        return len(self._time)
+
+    # Making room for chunkSize more records, copying what was kept so far
+    def _grow(self):
+        extra = self.chunkSize
+        self._time = np.concatenate([self._time, np.empty(extra)])
+        self._position = np.concatenate([self._position, np.empty((extra,) + self._position.shape[1:], self.dtype)])
+        if self._velocity is not None:
+            self._velocity = np.concatenate([self._velocity,
+                                             np.empty((extra,) + self._velocity.shape[1:], self.dtype)])
+
+    # Called once per step by NBodySystem.run(); keeps every k-th state
+    def record(self, t, position, velocity=None):
+        self.calls += 1
+        if (self.calls - 1) % self.every:
+            return
+        if self.count == self.capacity:
+            self._grow()
+        self._time[self.count] = t
+        self._position[self.count] = position
+        if self._velocity is not None:
+            self._velocity[self.count] = velocity
+        self.count += 1
+
+    # Dropping the unused preallocated records (only copies if the buffer was over-allocated)
+    def trim(self):
+        if self.count < self.capacity:
+            self._time = self._time[:self.count].copy()
+            self._position = self._position[:self.count].copy()
+            if self._velocity is not None:
+                self._velocity = self._velocity[:self.count].copy()
+
+    # Views of what has been recorded so far ------------------------------------------------------------------------
+    def times(self):
+        return self._time[:self.count]                                             # [s]    shape (records,)
+
+    def positions(self):
+        return self._position[:self.count]                                         # [m]    shape (records,N,3)
+
+    def velocities(self):
+        if self._velocity is None:
+            raise ValueError('this buffer was created without velocities=True')
+        return self._velocity[:self.count]                                         # [m/s]  shape (records,N,3)
+
+    # Position history of one body, history[step][axis] [m]; .T gives history[axis][step] like the old lists
+    def body(self, name):
+        return self._position[:self.count, self.index[name], :]
+
+    def bodyVelocity(self, name):
+        return self.velocities()[:, self.index[name], :]
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def nbytes(self):
+        return self._time.nbytes + self._position.nbytes + (0 if self._velocity is None else self._velocity.nbytes)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Recorder group ------------------------------------------------------------------------------------------------------
+# Several recorders fed by one run, e.g. RecorderGroup(writer, monitor) to store a trajectory and check it as it goes;
+# None entries are skipped so that optional recorders can be passed as they are
+class RecorderGroup:
+    def __init__(self, *recorders):
+        self.recorders = [recorder for recorder in recorders if recorder is not None]
+
+    def record(self, t, position, velocity=None):
+        for recorder in self.recorders:
+            recorder.record(t, position, velocity)
+# ---------------------------------------------------------------------------------------------------------------------
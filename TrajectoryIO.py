@@ -0,0 +1,318 @@
+import json
+import os
+import numpy as np
+
+# Streaming trajectory files ------------------------------------------------------------------------------------------
+# The writers below take the place of a TrajectoryBuffer (see TrajectoryBuffer.py) in NBodySystem.run(): they keep a
+# small chunk of records in memory and write it out every chunkSize records, so a run can be far larger than RAM.
+# Three formats are available, each a directory (or file) that also carries the run's metadata (body names, masses,
+# dt, integrator, force model) and its initial conditions:
+#
+#   'npy'   run/metadata.json, run/initialConditions.npz and run/times.npy, run/positions.npy (run/velocities.npy);
+#           the .npy headers are rewritten after every chunk so the files are valid even if the run dies, and they
+#           are read back with memory maps
+#   'hdf5'  one run.h5 file with chunked, resizable datasets (needs h5py, which is optional)
+#   'npz'   run/metadata.json, run/initialConditions.npz and compressed shards run/shard00000.npz, ...; the smallest
+#           on disk, read back one shard at a time
+#
+# openTrajectory(path) reads any of them lazily: nothing is loaded until a slice of it is asked for.
+
+# Metadata of a run, stored next to the trajectory
+def trajectoryMetadata(system, dt, integrator=None, **extra):
+    metadata = {
+        'names':        list(system.names),
+        'mass':         [float(m) for m in system.mass],                            # [kg]
+        'dt':           float(dt),                                                  # [s]
+        'startTime':    float(system.t),                                            # [s]
+        'integrator':   'euler' if integrator is None else integrator.name,
+        'forceModel':   system.forceModel,
+        'theta':        system.theta,
+        'softening':    system.softening,                                           # [m]
+    }
+    metadata.update(extra)
+    return metadata
+
+
+# Writing a .npy header of a fixed length, so it can be rewritten in place as the array grows
+npyHeaderLength = 128
+
+def writeNpyHeader(handle, dtype, shape):
+    header = "{'descr': %r, 'fortran_order': False, 'shape': %r, }" % (np.lib.format.dtype_to_descr(dtype), shape)
+    header = header.ljust(npyHeaderLength - 10 - 1) + '\n'
+    handle.seek(0)
+    handle.write(b'\x93NUMPY\x01\x00' + np.uint16(len(header)).tobytes() + header.encode('latin1'))
+
+
+class _ChunkedWriter:
+    def __init__(self, metadata, initialPosition, initialVelocity, every=1, dtype=np.float64, velocities=False,
+                 chunkSize=1024):
+        self.metadata = dict(metadata, every=int(every), dtype=np.dtype(dtype).name, velocities=bool(velocities))
+        self.initialPosition = np.array(initialPosition, dtype=np.float64)
+        self.initialVelocity = np.array(initialVelocity, dtype=np.float64)
+        self.every = int(every)
+        self.dtype = np.dtype(dtype)
+        self.chunkSize = int(chunkSize)
+        self.count = 0                              # Records written to disk or waiting in the chunk
+        self.calls = 0
+        nBodies = len(self.metadata['names'])
+        self._time = np.empty(self.chunkSize)
+        self._position = np.empty((self.chunkSize, nBodies, 3), dtype=self.dtype)
+        self._velocity = np.empty((self.chunkSize, nBodies, 3), dtype=self.dtype) if velocities else None
+        self._filled = 0
+
+    def record(self, t, position, velocity=None):
+        self.calls += 1
+        if (self.calls - 1) % self.every:
+            return
+        self._time[self._filled] = t
+        self._position[self._filled] = position
+        if self._velocity is not None:
+            self._velocity[self._filled] = velocity
+        self._filled += 1
+        self.count += 1
+        if self._filled == self.chunkSize:
+            self.flush()
+
+    def flush(self):
+        if self._filled:
+            velocity = None if self._velocity is None else self._velocity[:self._filled]
+            self._writeChunk(self._time[:self._filled], self._position[:self._filled], velocity)
+            self._filled = 0
+
+    def close(self):
+        self.flush()
+        self._close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _writeSidecar(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, 'metadata.json'), 'w') as handle:
+            json.dump(self.metadata, handle, indent=1)
+        np.savez(os.path.join(directory, 'initialConditions.npz'),
+                 position=self.initialPosition, velocity=self.initialVelocity)
+
+
+class NpyTrajectoryWriter(_ChunkedWriter):
+    format = 'npy'
+
+    def __init__(self, path, *args, **options):
+        _ChunkedWriter.__init__(self, *args, **options)
+        self.path = path
+        self._writeSidecar(path)
+        nBodies = len(self.metadata['names'])
+        self._files = {'times': (open(os.path.join(path, 'times.npy'), 'wb'), np.dtype(np.float64), ()),
+                       'positions': (open(os.path.join(path, 'positions.npy'), 'wb'), self.dtype, (nBodies, 3))}
+        if self._velocity is not None:
+            self._files['velocities'] = (open(os.path.join(path, 'velocities.npy'), 'wb'), self.dtype, (nBodies, 3))
+        self._written = 0
+        self._rewriteHeaders()
+
+    def _rewriteHeaders(self):
+        for handle, dtype, shape in self._files.values():
+            writeNpyHeader(handle, dtype, (self._written,) + shape)
+            handle.seek(0, os.SEEK_END)
+            handle.flush()
+
+    def _writeChunk(self, times, positions, velocities):
+        chunk = {'times': times, 'positions': positions, 'velocities': velocities}
+        for key, (handle, dtype, shape) in self._files.items():
+            handle.write(np.ascontiguousarray(chunk[key], dtype=dtype).tobytes())
+        self._written += len(times)
+        self._rewriteHeaders()
+
+    def _close(self):
+        for handle, dtype, shape in self._files.values():
+            handle.close()
+
+
+class NpzTrajectoryWriter(_ChunkedWriter):
+    format = 'npz'
+
+    def __init__(self, path, *args, **options):
+        _ChunkedWriter.__init__(self, *args, **options)
+        self.path = path
+        self._writeSidecar(path)
+        self._shard = 0
+
+    def _writeChunk(self, times, positions, velocities):
+        arrays = {'times': times, 'positions': positions}
+        if velocities is not None:
+            arrays['velocities'] = velocities
+        np.savez_compressed(os.path.join(self.path, 'shard%05d.npz' % self._shard), **arrays)
+        self._shard += 1
+
+    def _close(self):
+        pass
+
+
+class Hdf5TrajectoryWriter(_ChunkedWriter):
+    format = 'hdf5'
+
+    def __init__(self, path, *args, **options):
+        try:
+            import h5py
+        except ImportError:
+            raise ImportError("Writing HDF5 trajectories needs the h5py package (pip install h5py), "
+                              "or use format='npy' or 'npz'")
+        _ChunkedWriter.__init__(self, *args, **options)
+        self.path = path
+        nBodies = len(self.metadata['names'])
+        self._file = h5py.File(path, 'w')
+        self._file.attrs['metadata'] = json.dumps(self.metadata)
+        self._file['initialPosition'] = self.initialPosition
+        self._file['initialVelocity'] = self.initialVelocity
+        self._datasets = {'times': self._file.create_dataset('times', (0,), maxshape=(None,), dtype=np.float64,
+                                                             chunks=(self.chunkSize,))}
+        for key in ['positions'] + (['velocities'] if self._velocity is not None else []):
+            self._datasets[key] = self._file.create_dataset(key, (0, nBodies, 3), maxshape=(None, nBodies, 3),
+                                                            dtype=self.dtype, chunks=(self.chunkSize, nBodies, 3))
+
+    def _writeChunk(self, times, positions, velocities):
+        chunk = {'times': times, 'positions': positions, 'velocities': velocities}
+        for key, dataset in self._datasets.items():
+            start = dataset.shape[0]
+            dataset.resize(start + len(times), axis=0)
+            dataset[start:] = chunk[key]
+        self._file.flush()
+
+    def _close(self):
+        self._file.close()
+
+
+writers = {
+    NpyTrajectoryWriter.format: NpyTrajectoryWriter,
+    NpzTrajectoryWriter.format: NpzTrajectoryWriter,
+    Hdf5TrajectoryWriter.format: Hdf5TrajectoryWriter,
+}
+
+# A writer for a system about to be run, e.g. system.run(nSteps, dt, recorder=makeWriter('run', system, dt))
+def makeWriter(path, system, dt, integrator=None, format='npy', **options):
+    if format not in writers:
+        raise ValueError("Unknown trajectory format '%s', expected one of %s" % (format, ', '.join(writers)))
+    metadata = trajectoryMetadata(system, dt, integrator)
+    return writers[format](path, metadata, system.position, system.velocity, **options)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Reading trajectories back -------------------------------------------------------------------------------------------
+# Array-like view over the npz shards: indexing it only decompresses the shards the index touches
+class ShardedArray:
+    def __init__(self, files, key):
+        self.files = files
+        self.key = key
+        lengths = []
+        for name in files:
+            with np.load(name) as shard:
+                lengths.append(len(shard['times']))
+        with np.load(files[0]) as shard:
+            self.rowShape = shard[key].shape[1:]
+            self.dtype = shard[key].dtype
+        self.bounds = np.concatenate([[0], np.cumsum(lengths)]).astype(int)
+        self.shape = (int(self.bounds[-1]),) + self.rowShape
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _shard(self, k):
+        with np.load(self.files[k]) as shard:
+            return shard[self.key]
+
+    def __getitem__(self, index):
+        rows, rest = (index[0], index[1:]) if isinstance(index, tuple) else (index, ())
+        if isinstance(rows, (int, np.integer)):
+            rows = int(rows) + len(self) if rows < 0 else int(rows)
+            k = np.searchsorted(self.bounds, rows, side='right') - 1
+            return self._shard(k)[(rows - self.bounds[k],) + rest]
+        # The rest of the index is applied to each shard before they are joined, so that asking for one body only
+        # ever holds one shard of the other bodies in memory
+        rest = (slice(None),) + rest
+        wanted = np.arange(*rows.indices(len(self))) if isinstance(rows, slice) else np.asarray(rows)
+        parts = []
+        for k in np.unique(np.searchsorted(self.bounds, wanted, side='right') - 1):
+            inShard = wanted[(wanted >= self.bounds[k]) & (wanted < self.bounds[k+1])]
+            parts.append(self._shard(k)[inShard - self.bounds[k]][rest])
+        return np.concatenate(parts) if parts else np.empty((0,) + self.rowShape, self.dtype)[rest]
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self[:], dtype=dtype)
+
+
+# A stored run with the same reading methods as a TrajectoryBuffer
+class StoredTrajectory:
+    def __init__(self, metadata, times, positions, velocities, initialPosition, initialVelocity, handle=None):
+        self.metadata = metadata
+        self.names = metadata['names']
+        self.index = {name: k for k, name in enumerate(self.names)}
+        self.mass = np.array(metadata['mass'])
+        self.initialPosition = initialPosition
+        self.initialVelocity = initialVelocity
+        self._times, self._positions, self._velocities = times, positions, velocities
+        self._handle = handle
+
+    def times(self):
+        return self._times
+
+    def positions(self):
+        return self._positions
+
+    def velocities(self):
+        if self._velocities is None:
+            raise ValueError('this trajectory was written without velocities')
+        return self._velocities
+
+    # Position history of one body, history[step][axis] [m]
+    def body(self, name):
+        return self._positions[:, self.index[name], :]
+
+    def bodyVelocity(self, name):
+        return self.velocities()[:, self.index[name], :]
+
+    def __len__(self):
+        return len(self._times)
+
+    def close(self):
+        if self._handle is not None:
+            self._handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _readSidecar(path):
+    with open(os.path.join(path, 'metadata.json')) as handle:
+        metadata = json.load(handle)
+    with np.load(os.path.join(path, 'initialConditions.npz')) as initial:
+        return metadata, initial['position'], initial['velocity']
+
+# Opening a stored run without loading it: .npy files are memory-mapped, HDF5 datasets and npz shards are read
+# slice by slice
+def openTrajectory(path):
+    if os.path.isfile(path):
+        import h5py
+        handle = h5py.File(path, 'r')
+        metadata = json.loads(handle.attrs['metadata'])
+        velocities = handle['velocities'] if 'velocities' in handle else None
+        return StoredTrajectory(metadata, handle['times'], handle['positions'], velocities,
+                                handle['initialPosition'][()], handle['initialVelocity'][()], handle)
+
+    metadata, initialPosition, initialVelocity = _readSidecar(path)
+    if os.path.exists(os.path.join(path, 'positions.npy')):
+        load = lambda name: np.load(os.path.join(path, name), mmap_mode='r')
+        velocities = load('velocities.npy') if os.path.exists(os.path.join(path, 'velocities.npy')) else None
+        return StoredTrajectory(metadata, load('times.npy'), load('positions.npy'), velocities,
+                                initialPosition, initialVelocity)
+
+    shards = sorted(os.path.join(path, name) for name in os.listdir(path) if name.startswith('shard'))
+    if not shards:
+        raise ValueError("'%s' does not hold a trajectory" % path)
+    velocities = ShardedArray(shards, 'velocities') if metadata.get('velocities') else None
+    return StoredTrajectory(metadata, ShardedArray(shards, 'times'), ShardedArray(shards, 'positions'), velocities,
+                            initialPosition, initialVelocity)
+# ---------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,335 @@
+# Level-of-detail pyramids of the paths in a stored run, for plots that zoom and pan in constant time
+# Usage: python TrajectoryPyramid.py runs/millennium [--bodies earth,mars] [--check]
+#
+# Builds runs/millennium/pyramid.npz (runs/millennium.h5.pyramid.npz for an HDF5 run), which PlotTrajectory.py --lod
+# then draws from; without it PlotTrajectory.py builds the pyramid in memory first. --check measures, for views of the
+# whole run and of 2 and 0.5 AU across 1000 pixels, how far every record in the view is from the line drawn.
+
+import argparse
+import os
+import time
+import numpy as np
+
+# Pyramid -------------------------------------------------------------------------------------------------------------
+# The path of a body in the x-y plane is kept at several levels of detail. Level 0 is every record; at level L the
+# records are cut into bins of 4**L, and each bin keeps at most six of them: its first and last record and the records
+# with the smallest and largest x and y (the min/max, or M4, decimation of time series plots, done on both axes). Each
+# bin also keeps its bounding box, which takes in the first record of the next bin, so that the segment joining the two
+# bins is inside it as well.
+#
+# The path a bin stands for never leaves its box, and neither does the line through its kept records, so a bin whose
+# box is smaller than a pixel looks the same at every finer level. A larger bin's records are not the path between
+# them, and are never joined up. A view starts from the coarsest level: bins outside the window or the time range are
+# dropped along with everything below them, and the largest of the bins bigger than a pixel are replaced by their four
+# children, for as long as the points stay within a budget. A path that needs more points than that (a thousand
+# years of Mercury, say, whose records are further apart than a pixel once zoomed in) is drawn exactly for as long
+# as the budget lasts and then stops, rather than being drawn roughly all the way. What a view costs therefore depends
+# on the budget, not on how long the run is or how far it is zoomed in.
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Settings ------------------------------------------------------------------------------------------------------------
+levelFactor = 4                                     # Records per bin grow by this factor from one level to the next
+pointBudget = 20000                                 # Largest number of points drawn per body in one view
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Level L >= 1 of the path xy (records,2), with bins of `size` records: the bounding boxes of the bins
+# (xmin, xmax, ymin, ymax) [m], and the records every bin keeps (in order), bin b's being index[offsets[b]:offsets[b+1]]
+def _level(xy, size):
+    n = len(xy)
+    indexType = np.int32 if n < 2**31 else np.int64
+    nBins = -(-n//size)
+    padded = np.concatenate([xy, np.repeat(xy[-1:], nBins*size - n, axis=0)]).reshape(nBins, size, 2)
+    starts = np.arange(nBins)*size
+    picks = np.stack([starts, np.minimum(starts + size, n) - 1,
+                      starts + padded[:, :, 0].argmin(axis=1), starts + padded[:, :, 0].argmax(axis=1),
+                      starts + padded[:, :, 1].argmin(axis=1), starts + padded[:, :, 1].argmax(axis=1)], axis=1)
+    picks = np.sort(np.minimum(picks, n - 1), axis=1)
+    keep = np.ones(picks.shape, dtype=bool)
+    keep[:, 1:] = picks[:, 1:] != picks[:, :-1]
+    offsets = np.concatenate([[0], np.cumsum(keep.sum(axis=1))]).astype(indexType)
+
+    following = np.concatenate([padded[1:, 0], padded[-1:, -1]])              # first record of the next bin
+    low = np.minimum(padded.min(axis=1), following)
+    high = np.maximum(padded.max(axis=1), following)
+    boxes = np.stack([low[:, 0], high[:, 0], low[:, 1], high[:, 1]], axis=1)
+    return boxes, offsets, picks[keep].astype(indexType)
+
+# Record indices of the bins `bins` of a level, bin after bin
+def _gather(offsets, index, bins):
+    counts = offsets[bins + 1] - offsets[bins]
+    first = np.repeat(offsets[bins] - np.concatenate([[0], np.cumsum(counts)[:-1]]), counts)
+    return index[first + np.arange(counts.sum())]
+
+def _visible(boxes, xlim, ylim):
+    return (boxes[:, 1] >= xlim[0]) & (boxes[:, 0] <= xlim[1]) & (boxes[:, 3] >= ylim[0]) & (boxes[:, 2] <= ylim[1])
+
+class PathPyramid:
+    def __init__(self, xy, levels):
+        self.xy = xy                                                                # [m]  shape (records,2)
+        self.levels = levels                                                        # (boxes, offsets, index) per level
+
+    @classmethod
+    def build(cls, xy):
+        xy = np.ascontiguousarray(xy, dtype=np.float64)
+        levels, size = [], levelFactor
+        while True:
+            levels.append(_level(xy, size))
+            if size >= len(xy):
+                return cls(xy, levels)
+            size *= levelFactor
+
+    # The bins of a level (records at level 0) among `bins` that hold records of first..last and are in the window:
+    # their positions in `bins`, their extents (the longer side of the box) [m] and the number of records each keeps
+    def _bins(self, level, bins, first, last, xlim, ylim):
+        n = len(self.xy)
+        size = levelFactor**level
+        selected = np.flatnonzero((bins >= first//size) & (bins <= last//size))
+        bins = bins[selected]
+        if level == 0:
+            # Every record, with the segment to the next one as its box
+            here, following = self.xy[bins], self.xy[np.minimum(bins + 1, n - 1)]
+            low, high = np.minimum(here, following), np.maximum(here, following)
+            box = np.stack([low[:, 0], high[:, 0], low[:, 1], high[:, 1]], axis=1)
+            count = np.ones(len(bins), dtype=np.int64)
+        else:
+            boxes, offsets, index = self.levels[level - 1]
+            box = boxes[bins]
+            count = (offsets[bins + 1] - offsets[bins]).astype(np.int64)
+        inside = _visible(box, xlim, ylim)
+        extent = np.maximum(box[:, 1] - box[:, 0], box[:, 3] - box[:, 2])
+        return selected[inside], extent[inside], count[inside]
+
+    # The records view() draws, in time order, and the places in that list where the line breaks (np.insert style)
+    def _view(self, xlim, ylim, pixel, first, last, budget):
+        n = len(self.xy)
+        top = len(self.levels)
+        bins = np.arange(first//levelFactor**top, last//levelFactor**top + 1)
+        selected, extent, count = self._bins(top, bins, first, last, xlim, ylim)
+        level, bins = np.full(len(selected), top), bins[selected]
+
+        # Splitting the largest bins first, as many at a time as the budget takes, until every bin left is smaller
+        # than a pixel. When the largest no longer fits, the view is cut short in time instead, so that the earlier part
+        # of the path can be finished: only the bins that take up the first half of the budget are kept (and never the
+        # last bin still too large), and the splitting goes on from there.
+        while True:
+            large = np.flatnonzero((extent > pixel) & (level > 0))
+            if len(large) == 0:
+                break
+            large = large[np.argsort(-extent[large], kind='stable')]
+            # Splitting a bin rarely costs less than a point, so there is no need to look at more of them than that
+            remaining = budget - count.sum()
+            tried = large[:max(1, remaining)]
+            children, added = [], np.zeros(len(tried))
+            for parent in np.unique(level[tried]):
+                mine = np.flatnonzero(level[tried] == parent)
+                candidates = (bins[tried[mine], None]*levelFactor + np.arange(levelFactor)).reshape(-1)
+                selected, childExtent, childCount = self._bins(parent - 1, candidates, first, last, xlim, ylim)
+                owner = mine[selected//levelFactor]
+                added += np.bincount(owner, weights=childCount, minlength=len(tried))
+                children.append((parent - 1, owner, candidates[selected], childExtent, childCount))
+            fits = np.cumsum(added - count[tried]) <= remaining
+            split = len(tried) if fits.all() else int(np.argmin(fits))
+            if split == 0:
+                starts = bins*levelFactor**level
+                order = np.argsort(starts, kind='stable')
+                cut = np.searchsorted(np.cumsum(count[order]), budget//2, side='right')
+                keep = starts < min(starts[order[min(cut, len(order) - 1)]], starts[large].max())
+                level, bins, extent, count = level[keep], bins[keep], extent[keep], count[keep]
+                continue
+            keep = np.ones(len(bins), dtype=bool)
+            keep[tried[:split]] = False
+            parts = [(level[keep], bins[keep], extent[keep], count[keep])]
+            for childLevel, owner, childBins, childExtent, childCount in children:
+                taken = owner < split
+                parts.append((np.full(taken.sum(), childLevel), childBins[taken], childExtent[taken],
+                              childCount[taken]))
+            level, bins, extent, count = [np.concatenate(part) for part in zip(*parts)]
+
+        # What is left is bins smaller than a pixel, and single records, whose segment to the next record is the path
+        # itself; the picks of a larger bin are never joined up, as the lines between them are not the path
+        size = levelFactor**level
+        order = np.argsort(bins*size, kind='stable')
+        starts, ends, counts = (bins*size)[order], np.minimum((bins + 1)*size, n)[order], count[order]
+        records = [bins[level == 0]]
+        for binLevel in np.unique(level[level > 0]):
+            boxes, offsets, index = self.levels[binLevel - 1]
+            records.append(_gather(offsets, index, bins[level == binLevel]))
+        records = np.sort(np.concatenate(records))
+        gaps = np.cumsum(counts)[:-1][ends[:-1] != starts[1:]]
+        return records, gaps
+
+    # Points to draw for the window xlim, ylim [m] with pixels of `pixel` [m], over the records first..last; runs of
+    # the path that leave the window, or that the budget did not reach down to pixel size, are separated by rows of
+    # NaN (which matplotlib leaves a gap for)
+    def view(self, xlim, ylim, pixel, first=0, last=None, budget=pointBudget):
+        n = len(self.xy)
+        last = n - 1 if last is None else min(int(last), n - 1)
+        first = max(0, int(first))
+        if last < first:
+            return np.empty((0, 2))
+        records, gaps = self._view(xlim, ylim, pixel, first, last, budget)
+        return np.insert(self.xy[records], gaps, np.nan, axis=0)
+
+    # How well view() draws the records first..last that are inside the window: the largest distance from such a record
+    # to the drawn segment that spans it [pixels], and the share of them that fell in a gap
+    def viewError(self, xlim, ylim, pixel, first=0, last=None, budget=pointBudget):
+        n = len(self.xy)
+        last = n - 1 if last is None else min(int(last), n - 1)
+        first = max(0, int(first))
+        records, gaps = self._view(xlim, ylim, pixel, first, last, budget)
+        wanted = np.arange(first, last + 1)
+        point = self.xy[wanted]
+        wanted = wanted[(point[:, 0] >= xlim[0]) & (point[:, 0] <= xlim[1]) &
+                        (point[:, 1] >= ylim[0]) & (point[:, 1] <= ylim[1])]
+        if len(wanted) == 0:
+            return 0.0, 0.0
+        if len(records) == 0:
+            return 0.0, 1.0
+        k = np.searchsorted(records, wanted, side='right') - 1
+        hit = (k >= 0) & (records[np.maximum(k, 0)] == wanted)
+        spanned = (k >= 0) & (k < len(records) - 1) & ~np.isin(k + 1, gaps) & ~hit
+        a, b = self.xy[records[k[spanned]]], self.xy[records[k[spanned] + 1]]
+        p = self.xy[wanted[spanned]]
+        segment = b - a
+        length = np.einsum('ij,ij->i', segment, segment)
+        along = np.clip(np.einsum('ij,ij->i', p - a, segment)/np.where(length > 0, length, 1.0), 0.0, 1.0)
+        distance = np.sqrt(np.sum((a + along[:, None]*segment - p)**2, axis=1))
+        worst = float(distance.max())/pixel if len(distance) else 0.0
+        return worst, 1.0 - (hit.sum() + spanned.sum())/len(wanted)
+
+# Pyramids of the paths of the bodies of a run, with its record times [s]
+class TrajectoryPyramid:
+    def __init__(self, names, times, paths):
+        self.names = list(names)
+        self.index = {name: k for k, name in enumerate(self.names)}
+        self.times = times
+        self.paths = paths
+
+    # The first and last record within the time range (start, end) [s]; None for the whole run
+    def records(self, timeRange=None):
+        if timeRange is None:
+            return 0, len(self.times) - 1
+        return (int(np.searchsorted(self.times, timeRange[0], side='left')),
+                int(np.searchsorted(self.times, timeRange[1], side='right')) - 1)
+
+    def view(self, name, xlim, ylim, pixel, timeRange=None, budget=pointBudget):
+        first, last = self.records(timeRange)
+        return self.paths[self.index[name]].view(xlim, ylim, pixel, first, last, budget)
+
+    def viewError(self, name, xlim, ylim, pixel, timeRange=None, budget=pointBudget):
+        first, last = self.records(timeRange)
+        return self.paths[self.index[name]].viewError(xlim, ylim, pixel, first, last, budget)
+
+    def save(self, path):
+        arrays = {'names': np.array(self.names), 'times': np.asarray(self.times)}
+        for k, pyramid in enumerate(self.paths):
+            arrays['xy.%d' % k] = pyramid.xy
+            for level, (boxes, offsets, index) in enumerate(pyramid.levels):
+                arrays['boxes.%d.%d' % (k, level)] = boxes
+                arrays['offsets.%d.%d' % (k, level)] = offsets
+                arrays['index.%d.%d' % (k, level)] = index
+        np.savez(path, **arrays)
+
+def buildPyramid(trajectory, bodies=None):
+    names = list(trajectory.names) if bodies is None else list(bodies)
+    paths = [PathPyramid.build(np.asarray(trajectory.positions()[:, trajectory.index[name], :2])) for name in names]
+    return TrajectoryPyramid(names, np.asarray(trajectory.times(), dtype=np.float64), paths)
+
+def loadPyramid(path):
+    with np.load(path) as arrays:
+        names = [str(name) for name in arrays['names']]
+        paths = []
+        for k in range(len(names)):
+            levels = []
+            while 'boxes.%d.%d' % (k, len(levels)) in arrays.files:
+                level = len(levels)
+                levels.append((arrays['boxes.%d.%d' % (k, level)], arrays['offsets.%d.%d' % (k, level)],
+                               arrays['index.%d.%d' % (k, level)]))
+            paths.append(PathPyramid(arrays['xy.%d' % k], levels))
+        return TrajectoryPyramid(names, arrays['times'], paths)
+
+# Where the pyramid of a stored run is kept
+def pyramidPath(path):
+    return path + '.pyramid.npz' if os.path.isfile(path) else os.path.join(path, 'pyramid.npz')
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Plot ----------------------------------------------------------------------------------------------------------------
+# One line per body drawn from a TrajectoryPyramid, whose points are picked again from the right level whenever the view
+# changes (zooming or panning with the toolbar, or set_xlim()/set_ylim(), before the figure is next drawn), over the
+# time range (start, end) [s] (None: the whole run).
+#   limit   half-width of the first view [m]; None fits all the chosen bodies in
+#   budget  largest number of points per body and view; a view that needs more is cut short in time
+class PyramidPlot:
+    def __init__(self, pyramid, bodies=None, ax=None, limit=None, timeRange=None, budget=pointBudget):
+        import matplotlib.pyplot as plt
+
+        self.pyramid = pyramid
+        self.bodies = pyramid.names if bodies is None else list(bodies)
+        self.timeRange = timeRange
+        self.budget = budget
+        if ax is None:
+            fig, ax = plt.subplots(figsize=(10, 10))
+        self.ax = ax
+        first, last = pyramid.records(timeRange)
+        self.lines, self.markers = [], []
+        for name in self.bodies:
+            line, = ax.plot([], [], lw=1, label=name.title())
+            end = pyramid.paths[pyramid.index[name]].xy[last]
+            self.markers.append(ax.plot(end[0], end[1], 'o', markersize=4, color=line.get_color())[0])
+            self.lines.append(line)
+        if limit is None:
+            limit = max(np.abs(pyramid.paths[pyramid.index[name]].xy).max() for name in self.bodies)*1.05
+        ax.set_aspect('equal')
+        ax.grid()
+        ax.legend(bbox_to_anchor=(1.02, 1), loc='upper left', borderaxespad=0, title='Bodies')
+        ax.set_xlim(-limit, limit)
+        ax.set_ylim(-limit, limit)
+        self.points = self.redraw()
+        ax.callbacks.connect('xlim_changed', self._changed)
+        ax.callbacks.connect('ylim_changed', self._changed)
+
+    def _changed(self, ax):
+        self.points = self.redraw()
+
+    # Drawing the current view; returns the number of points drawn
+    def redraw(self):
+        xlim, ylim = sorted(self.ax.get_xlim()), sorted(self.ax.get_ylim())
+        extent = self.ax.get_window_extent()
+        pixel = max((xlim[1] - xlim[0])/max(extent.width, 1.0), (ylim[1] - ylim[0])/max(extent.height, 1.0))
+        points = 0
+        for name, line in zip(self.bodies, self.lines):
+            path = self.pyramid.view(name, xlim, ylim, pixel, self.timeRange, self.budget)
+            line.set_data(path[:, 0], path[:, 1])
+            points += len(path)
+        return points
+# ---------------------------------------------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    from TrajectoryIO import openTrajectory
+
+    parser = argparse.ArgumentParser(description='Build the level-of-detail pyramid of a stored run.')
+    parser.add_argument('path', help='trajectory directory or HDF5 file')
+    parser.add_argument('--bodies', help='comma separated bodies (default: all)')
+    parser.add_argument('--check', action='store_true',
+                        help='measure how far the records are from the line drawn, for a few views of the run')
+    options = parser.parse_args()
+
+    start = time.perf_counter()
+    with openTrajectory(options.path) as trajectory:
+        bodies = None if options.bodies is None else [name.strip().lower() for name in options.bodies.split(',')]
+        pyramid = buildPyramid(trajectory, bodies)
+    pyramid.save(pyramidPath(options.path))
+    print('Pyramid of %d bodies over %d records (%d levels) written to %s in %.3g s'
+          % (len(pyramid.names), len(pyramid.times), len(pyramid.paths[0].levels), pyramidPath(options.path),
+             time.perf_counter() - start))
+
+    if options.check:
+        # Views 1000 pixels across, centred like those of PyramidPlot: of everything, then of 2 and of 0.5 AU
+        print('%-10s %8s %8s %12s %10s' % ('body', 'view AU', 'points', 'worst pixel', 'left out'))
+        for half in (max(np.abs(path.xy).max() for path in pyramid.paths), 2*1.496e11, 0.5*1.496e11):
+            xlim, ylim, pixel = (-half, half), (-half, half), 2*half/1000
+            for name in pyramid.names:
+                worst, missed = pyramid.viewError(name, xlim, ylim, pixel)
+                print('%-10s %8.3g %8d %12.3f %9.1f%%' % (name, half/1.496e11,
+                                                          len(pyramid.view(name, xlim, ylim, pixel)), worst,
+                                                          100*missed))